@@ -0,0 +1,111 @@
+import bz2
+import gzip
+import lzma
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+# сжатый tar распаковывается модулями сжатия, а не потоком tarfile: они проверяют конец потока и контрольную сумму
+TAR_DECOMPRESSORS = {
+    '.tar.gz': gzip.open,
+    '.tgz': gzip.open,
+    '.tar.bz2': bz2.open,
+    '.tar.xz': lzma.open,
+}
+# bz2 сообщает о поврежденных данных через OSError
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error, lzma.LZMAError, OSError)
+
+
+class UploadError(ValueError):
+    pass
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _skip(name):
+    # служебные файлы архиваторов (macOS, скрытые файлы)
+    base = posixpath.basename(name)
+    return not base or base.startswith('.') or '__MACOSX/' in name
+
+
+class _MemberReader:
+    '''Поток файла из архива: читается только вперед (seek скрыт от File.chunks()),
+    ошибки распаковки превращаются в UploadError'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        try:
+            return self.fileobj.read(size)
+        except ARCHIVE_ERRORS as e:
+            raise UploadError(f"Поврежденный архив: {e}")
+
+
+class _CountingReader:
+    '''Поток, считающий прочитанные байты'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        return data
+
+
+def _iter_tar(fileobj, name):
+    '''Файлы tar потоком. Обрезанный архив tarfile в потоковом режиме молча считает законченным,
+    поэтому после последнего файла поток дочитывается: сжатый проверяется до конца потока сжатия,
+    а архив должен закончиться целым нулевым блоком'''
+    decompress = next((open_ for ext, open_ in TAR_DECOMPRESSORS.items() if name.lower().endswith(ext)), None)
+    stream = decompress(fileobj, 'rb') if decompress is not None else fileobj
+    reader = _CountingReader(stream)
+    with tarfile.open(fileobj=reader, mode='r|') as archive:
+        for member in archive:
+            if not member.isfile() or _skip(member.name):
+                continue
+            yield member.name, _MemberReader(archive.extractfile(member))
+        end = archive.offset
+    while reader.read(tarfile.RECORDSIZE):
+        pass
+    if reader.size % tarfile.BLOCKSIZE or reader.size < end + tarfile.BLOCKSIZE:
+        raise UploadError("Поврежденный архив: tar обрезан")
+
+
+def iter_archive(fileobj, name):
+    '''Файлы архива .zip/.tar(.gz/.bz2/.xz) парами (имя, файловый объект) без распаковки на диск.
+    tar читается потоком; каждый файл нужно дочитать до перехода к следующему'''
+    try:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or _skip(info.filename):
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, _MemberReader(member)
+        else:
+            yield from _iter_tar(fileobj, name)
+    except ARCHIVE_ERRORS as e:
+        raise UploadError(f"Поврежденный архив: {e}")
+
+
+def iter_uploads(files, archive=None, max_files=None):
+    '''Файлы пакетной загрузки: отдельные файлы и содержимое архива, не больше max_files'''
+    def uploads():
+        for file in files:
+            yield file.name, file
+        if archive is not None:
+            if not is_archive(archive.name):
+                raise UploadError(f"Неизвестный формат архива, поддерживаются: {', '.join(ARCHIVE_EXTENSIONS)}")
+            yield from iter_archive(archive, archive.name)
+
+    for count, upload in enumerate(uploads(), 1):
+        if max_files is not None and count > max_files:
+            raise UploadError(f"Слишком много файлов, максимум {max_files}")
+        yield upload
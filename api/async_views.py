@@ -0,0 +1,44 @@
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+
+# Синхронный код из корутин: database — в общем потоке Django для ORM (там же живет соединение с БД),
+# blocking — в пуле потоков без доступа к БД: чтение файлов и CPU-работа не задерживают запросы к базе
+database = sync_to_async
+blocking = partial(sync_to_async, thread_sensitive=False)
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+class AsyncAPIViewMixin:
+    '''async dispatch для APIView: под ASGI (uvicorn) представление выполняется в event loop, не занимая поток.
+    Аутентификация, права и троттлинг DRF синхронные и ходят в БД — они выполняются через database.
+    Все обработчики методов (get, post, delete, ...) должны быть async, кроме options'''
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await database(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if hasattr(response, '__await__'):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
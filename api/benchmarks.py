@@ -0,0 +1,216 @@
+import io
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from itertools import accumulate
+from statistics import median
+
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from tf_idf_calculator.functions import TfidfComputer
+from .models import Collection
+from .utils import (calculate_bulk_statistics, calculate_collection_statistics, compute_tfidf, create_documents,
+                    get_term_counts, huffman)
+
+# Слоги, из которых собираются слова синтетического словаря, и служебные слова каждого языка:
+# служебные стоят на первых местах рейтинга частот, как в настоящих текстах, и проверяют фильтр стоп-слов
+SYLLABLES = {
+    'en': ['ka', 'lo', 'mi', 'ter', 'son', 'ra', 've', 'nu', 'pre', 'tion', 'al', 'in', 'or', 'ex', 'us',
+           'ma', 'de', 'li', 'co', 'ber', 'st', 'ing', 'th', 'ou', 'gr'],
+    'ru': ['ка', 'ло', 'ми', 'тер', 'сон', 'ра', 'ве', 'ну', 'пре', 'ция', 'ал', 'ин', 'ор', 'ст', 'ус',
+           'ма', 'де', 'ли', 'ко', 'бер', 'ство', 'ени', 'ова', 'жи', 'щу'],
+}
+FUNCTION_WORDS = {
+    'en': ['the', 'of', 'and', 'to', 'in', 'is', 'that', 'it', 'for', 'was', 'on', 'with', 'as', 'by', 'this'],
+    'ru': ['и', 'в', 'не', 'на', 'что', 'с', 'как', 'по', 'это', 'но', 'из', 'у', 'за', 'от', 'для'],
+}
+LANGUAGES = ('en', 'ru', 'mixed')
+WORDS_PER_LINE = 12
+
+# быстрые операции меряются пачками не короче этого: иначе в замер попадает шум таймера и планировщика
+MIN_SAMPLE_SECONDS = 0.05
+# допуск на шум измерения памяти: меньше этого прирост пика не считается регрессией
+MEMORY_NOISE_MB = 0.1
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    '''Регистрация бенчмарка: функция получает BenchmarkData и возвращает измеряемую операцию без аргументов'''
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def generate_vocabulary(language, size, rng):
+    '''size различных слов из слогов языка; служебные слова — в начале списка (самые частые)'''
+    syllables = SYLLABLES[language]
+    words = list(FUNCTION_WORDS[language])
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words[:size]
+
+
+def generate_corpus(documents=200, words_per_document=300, vocabulary=5000, skew=1.0, language='mixed', seed=0):
+    '''Детерминированный синтетический корпус: список (имя файла, текст).
+    Частоты слов подчиняются закону Ципфа с показателем skew (0 — равномерно, больше — сильнее перекос
+    к частым словам), длина документа — words_per_document ± 50%. language=mixed чередует en и ru'''
+    if language not in LANGUAGES:
+        raise ValueError(f"language: одно из {', '.join(LANGUAGES)}")
+    rng = random.Random(f'{seed}:{documents}:{words_per_document}:{vocabulary}:{skew}:{language}')
+    languages = ['en', 'ru'] if language == 'mixed' else [language]
+    dictionaries = {}
+    for code in languages:
+        words = generate_vocabulary(code, vocabulary, rng)
+        dictionaries[code] = (words, list(accumulate(1 / rank ** skew for rank in range(1, len(words) + 1))))
+
+    corpus = []
+    for i in range(documents):
+        code = languages[i % len(languages)]
+        words, cum_weights = dictionaries[code]
+        length = max(1, round(words_per_document * rng.uniform(0.5, 1.5)))
+        tokens = rng.choices(words, cum_weights=cum_weights, k=length)
+        lines = (' '.join(tokens[j:j + WORDS_PER_LINE]) for j in range(0, length, WORDS_PER_LINE))
+        corpus.append((f'{code}-{i:05d}.txt', '.\n'.join(lines) + '.\n'))
+    return corpus
+
+
+class BenchmarkData:
+    '''Корпус, загруженный в БД так же, как через /documents/bulk/: пользователь, коллекция со всеми
+    документами, посчитанные частоты слов и статистика'''
+
+    def __init__(self, corpus, username='benchmark'):
+        self.texts = [text for _, text in corpus]
+        self.files = [(name, text.encode('utf-8')) for name, text in corpus]
+        self.user = get_user_model().objects.create_user(username=username, password=username)
+        self.collection = Collection.objects.create(owner=self.user, name=username)
+        self.documents = create_documents(
+            self.user, [(name, io.BytesIO(data)) for name, data in self.files], self.collection
+        )
+        calculate_bulk_statistics(self.documents)
+
+
+def timed(operation, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        operation()
+    return time.perf_counter() - start
+
+
+def measure(operation, repeat=5):
+    '''Время операции (лучшее и медиана из repeat замеров) и пик выделенной за один вызов памяти (tracemalloc; NumPy туда тоже отчитывается).
+    Первый вызов — прогрев (отложенные импорты, кэши процесса), время и память меряются отдельными вызовами:
+    tracemalloc замедляет выполнение'''
+    number = 1
+    elapsed = timed(operation, number)
+    while elapsed < MIN_SAMPLE_SECONDS:
+        number *= 2 if elapsed * 2 >= MIN_SAMPLE_SECONDS else 10
+        elapsed = timed(operation, number)
+    timings = [timed(operation, number) / number for _ in range(repeat)]
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # пропускная способность — по лучшему замеру: он меньше всего зависит от соседей по машине
+    seconds = min(timings)
+    return {
+        'seconds': round(seconds, 6),
+        'median_seconds': round(median(timings), 6),
+        'ops_per_second': round(1 / seconds, 3) if seconds > 0 else None,
+        'peak_memory_mb': round(peak / 2 ** 20, 3),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def run_benchmarks(corpus_options, names=None, repeat=5):
+    '''Прогон бенчмарков names (по умолчанию всех) на корпусе generate_corpus(**corpus_options)'''
+    names = list(names or BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Неизвестные бенчмарки: {', '.join(sorted(unknown))}")
+    data = BenchmarkData(generate_corpus(**corpus_options))
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'corpus': dict(corpus_options, characters=sum(len(text) for text in data.texts)),
+        'benchmarks': {name: measure(BENCHMARKS[name](data), repeat) for name in names},
+    }
+
+
+def compare_results(baseline, current, throughput_threshold=0.2, memory_threshold=0.2):
+    '''Регрессии current относительно baseline: пропускная способность упала больше чем на throughput_threshold
+    или пик памяти вырос больше чем на memory_threshold (доли). Список (бенчмарк, метрика, было, стало)'''
+    regressions = []
+    for name, result in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            continue
+        if result['ops_per_second'] < base['ops_per_second'] * (1 - throughput_threshold):
+            regressions.append((name, 'ops_per_second', base['ops_per_second'], result['ops_per_second']))
+        if result['peak_memory_mb'] > base['peak_memory_mb'] * (1 + memory_threshold) + MEMORY_NOISE_MB:
+            regressions.append((name, 'peak_memory_mb', base['peak_memory_mb'], result['peak_memory_mb']))
+    return regressions
+
+
+############### Бенчмарки ###############
+
+@benchmark('tfidf_computer')
+def bench_tfidf_computer(data):
+    '''Веб-калькулятор: токенизация загруженных файлов и TF-IDF всего корпуса'''
+    def operation():
+        files = []
+        for name, content in data.files:
+            fileobj = io.BytesIO(content)
+            fileobj.name = name
+            files.append(fileobj)
+        return TfidfComputer(files).results
+    return operation
+
+
+@benchmark('compute_tfidf')
+def bench_compute_tfidf(data):
+    '''TF-IDF документа по сохраненным частотам слов корпуса (статистика документа)'''
+    term_counts = get_term_counts(data.documents)
+    return lambda: compute_tfidf(term_counts, 0)
+
+
+@benchmark('calculate_collection_statistics')
+def bench_calculate_collection_statistics(data):
+    '''Пересчет и сохранение статистики коллекции по счетчикам CollectionTerm'''
+    return lambda: calculate_collection_statistics(data.collection)
+
+
+@benchmark('huffman')
+def bench_huffman(data):
+    '''Кодирование Хаффмана текста всего корпуса'''
+    text = '\n'.join(data.texts)
+    return lambda: huffman(text)
+
+
+@benchmark('metrics_view')
+def bench_metrics_view(data):
+    '''GET /api/metrics/ через весь стек Django и DRF'''
+    client = APIClient()
+    client.force_authenticate(data.user)
+
+    def operation():
+        response = client.get('/api/metrics/')
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/metrics/ ответил {response.status_code}")
+        return response
+    return operation
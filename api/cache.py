@@ -0,0 +1,67 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Кэш результатов (Huffman, статистика коллекций), общий для воркеров: файловый на хосте по умолчанию,
+# memcached или любой другой бэкенд Django — для нескольких хостов (CACHES['results'])
+RESULTS_CACHE = 'results'
+# сколько держится блокировка расчета и сколько ее ждут остальные
+LOCK_TIMEOUT = 60
+WAIT_INTERVAL = 0.05
+
+_MISSING = object()
+# блокировки внутри процесса (по хешу ключа): потоки одного воркера не ходят в кэш за блокировкой наперегонки
+_local_locks = [threading.RLock() for _ in range(64)]
+
+
+def results_cache():
+    return caches[RESULTS_CACHE]
+
+
+@contextmanager
+def computing(key):
+    '''Блокировка расчета ключа: из параллельных промахов считает один, остальные ждут его результат.
+    Между процессами и хостами — через cache.add (атомарен в memcached, redis и AtomicFileBasedCache).
+    Если владелец не отпустил блокировку за LOCK_TIMEOUT, расчет идет без нее'''
+    cache = results_cache()
+    lock_key = f'lock:{key}'
+    token = f'{os.getpid()}:{uuid.uuid4().hex}'
+    with _local_locks[hash(key) % len(_local_locks)]:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        with span('cache.wait'):
+            while not cache.add(lock_key, token, LOCK_TIMEOUT):
+                if time.monotonic() > deadline:
+                    logger.warning("Блокировка %s не освобождена за %s с", key, LOCK_TIMEOUT)
+                    token = None
+                    break
+                time.sleep(WAIT_INTERVAL)
+        try:
+            yield
+        finally:
+            if token is not None and cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+
+def get_or_compute(key, compute, timeout=DEFAULT_TIMEOUT):
+    '''Результат из кэша или compute(), посчитанный один раз на все параллельные промахи'''
+    cache = results_cache()
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    with computing(key):
+        # пока ждали блокировку, результат мог посчитать другой воркер
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class AtomicFileBasedCache(FileBasedCache):
+    '''Файловый кэш Django с атомарным add. В исходном add проверка и запись разнесены,
+    и два процесса могут оба «добавить» ключ — на add держатся блокировки расчета (api/cache.py).
+    Здесь файл появляется через os.link, который не перезаписывает существующий'''
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        self._cull()
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            try:
+                os.link(tmp_path, fname)
+                return True
+            except FileExistsError:
+                pass
+            # ключ есть; если он истек, has_key удалит файл и можно занять его место
+            if self.has_key(key, version):
+                return False
+            try:
+                os.link(tmp_path, fname)
+                return True
+            except FileExistsError:
+                return False
+        finally:
+            os.remove(tmp_path)
+
+
+class SizeBoundedFileBasedCache(AtomicFileBasedCache):
+    '''Файловый кэш с ограничением по объему: OPTIONS['MAX_BYTES'] — сколько байт могут занимать файлы.
+    MAX_ENTRIES считает записи, а не их размер, и один большой результат стоит в нем столько же, сколько маленький.
+    При превышении удаляются самые старые по времени записи файлы, пока объем не станет CULL_TO_RATIO от предела.
+    Обход каталога — stat каждого файла, поэтому объем проверяется не чаще раза в SCAN_INTERVAL секунд
+    на процесс: предел может быть превышен на то, что успели записать за это время'''
+
+    CULL_TO_RATIO = 0.75
+    SCAN_INTERVAL = 5
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._max_bytes = int(params.get('OPTIONS', {}).get('MAX_BYTES', 0))
+        self._scanned_at = None
+
+    def _cull(self):
+        super()._cull()
+        if not self._max_bytes:
+            return
+        now = time.monotonic()
+        if self._scanned_at is not None and now - self._scanned_at < self.SCAN_INTERVAL:
+            return
+        self._scanned_at = now
+        files = []
+        for fname in self._list_cache_files():
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, fname))
+        total = sum(size for _, size, _ in files)
+        if total <= self._max_bytes:
+            return
+        files.sort()
+        for _, size, fname in files:
+            if total <= self._max_bytes * self.CULL_TO_RATIO:
+                break
+            self._delete(fname)
+            total -= size
@@ -0,0 +1,124 @@
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job, Document
+from .decorators import track_processing_time
+from .metrics import record_processing_time
+from .utils import batched, calculate_statistics, calculate_bulk_statistics
+
+HANDLERS = {}
+
+
+def job_handler(kind):
+    '''Регистрация обработчика задач данного типа.
+    Обработчик может вернуть текст о частичной неудаче — он сохраняется в error выполненной задачи'''
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, owner=None, **payload):
+    '''Постановка задачи в очередь. В режиме STATS_JOBS_EAGER задача выполняется сразу'''
+    job = Job.objects.create(
+        owner=owner,
+        kind=kind,
+        payload=payload,
+        max_attempts=settings.STATS_JOB_MAX_ATTEMPTS,
+    )
+    if settings.STATS_JOBS_EAGER:
+        claimed = claim_job(job_id=job.pk)
+        if claimed:
+            run_job(claimed)
+            job.refresh_from_db()
+    return job
+
+
+def claim_job(job_id=None):
+    '''Забирает одну готовую к выполнению задачу и помечает ее running'''
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = Job.objects.select_for_update(skip_locked=True).filter(status=Job.QUEUED, run_after__lte=now)
+        if job_id is not None:
+            queryset = queryset.filter(pk=job_id)
+        job = queryset.order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        # условие по статусу — защита от двойного захвата там, где нет SKIP LOCKED (SQLite)
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=now, finished_at=None, attempts=job.attempts + 1
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run_job(job):
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"Неизвестный тип задачи: {job.kind}")
+        note = handler(**job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            # повтор с экспоненциальной задержкой
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=settings.STATS_JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.DONE
+        job.error = note or ''
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'run_after', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(older_than):
+    '''Возвращает в очередь задачи, зависшие в running (например, воркер был убит)'''
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=timezone.now() - older_than).update(
+        status=Job.QUEUED, run_after=timezone.now()
+    )
+
+
+############### Обработчики ###############
+
+@job_handler('document_statistics')
+@track_processing_time
+def document_statistics(document_id):
+    document = Document.objects.filter(pk=document_id).first()
+    if document is None:
+        # документ успели удалить — считать нечего
+        return
+    calculate_statistics(document)
+
+
+@job_handler('bulk_statistics')
+def bulk_statistics(document_ids):
+    documents = []
+    for batch in batched(document_ids):
+        documents.extend(Document.objects.filter(pk__in=batch))
+    if not documents:
+        return
+    start = time.time()
+    failed = calculate_bulk_statistics(documents)
+    processed = len(documents) - len(failed)
+    if processed:
+        # расчет пачки общий и по документам не делится: каждый посчитанный документ — отдельный файл
+        # в files_processed и гистограмме, со средним временем пачки
+        duration = (time.time() - start) / processed
+        for _ in range(processed):
+            record_processing_time(duration)
+    if failed:
+        # повтор задачи не поможет: остальные документы уже посчитаны, неудачные перечисляются в error
+        return "Не удалось посчитать статистику документов:\n" + "\n".join(
+            f"{document_id}: {error}" for document_id, error in failed.items()
+        )
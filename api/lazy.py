@@ -0,0 +1,43 @@
+import importlib
+
+from .tracing import span
+
+_modules = {}
+
+
+class LazyModule:
+    '''Модуль, который импортируется при первом обращении к атрибуту (np.array и т.п.).
+    После импорта атрибуты модуля копируются в объект — дальше доступ без накладных расходов.
+    Время импорта попадает в span import.<модуль> запроса, который его вызвал'''
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with span(f"import.{self.__dict__['_lazy_name']}"):
+                module = importlib.import_module(self.__dict__['_lazy_name'])
+            self.__dict__.update(module.__dict__)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_load(), name)
+
+    def __repr__(self):
+        return f"<lazy module '{self.__dict__['_lazy_name']}'>"
+
+
+def lazy_import(name):
+    '''Один объект на модуль: какой бы файл ни обратился первым, импорт выполняется и замеряется один раз'''
+    if name not in _modules:
+        _modules[name] = LazyModule(name)
+    return _modules[name]
+
+
+def load_all():
+    '''Импортирует все отложенные модули (прогрев перед fork)'''
+    for module in list(_modules.values()):
+        module._lazy_load()
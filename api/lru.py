@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class ByteLRUCache:
+    '''Потокобезопасный LRU-кэш, ограниченный суммарным размером значений в байтах'''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, size):
+        if size > self.max_bytes:
+            # слишком большое значение вытеснило бы весь кэш
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self.current_bytes -= item[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._items),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# Тексты документов, к которым часто обращаются (content в detail, Хаффман, коллекции)
+text_cache = ByteLRUCache(settings.DOCUMENT_TEXT_CACHE_BYTES)
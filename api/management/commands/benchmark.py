@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import BENCHMARKS, LANGUAGES, compare_results, run_benchmarks
+from api.cache import results_cache
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарки горячих путей на синтетическом корпусе (SQLite): '
+            'manage.py benchmark --settings=tf_idf.bench_settings [--compare baseline.json]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=200, help='Документов в корпусе')
+        parser.add_argument('--words', type=int, default=300, help='Среднее число слов в документе')
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Размер словаря каждого языка')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Показатель закона Ципфа для частот слов (0 — равномерно)')
+        parser.add_argument('--language', choices=LANGUAGES, default='mixed')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=5, help='Замеров времени на бенчмарк (берется лучший)')
+        parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='Запустить только эти бенчмарки')
+        parser.add_argument('--output', default=getattr(settings, 'BENCHMARK_OUTPUT', 'benchmark.json'),
+                            help='Куда сохранить результаты (JSON)')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Сравнить с сохраненными результатами; корпус берется из них же')
+        parser.add_argument('--results', metavar='CURRENT',
+                            help='С --compare: сравнить два сохраненных файла, не запуская бенчмарки')
+        parser.add_argument('--throughput-threshold', type=float, default=0.2,
+                            help='Допустимое падение пропускной способности (доля)')
+        parser.add_argument('--memory-threshold', type=float, default=0.2,
+                            help='Допустимый рост пика памяти (доля)')
+
+    def handle(self, *args, **options):
+        baseline = self.load(options['compare']) if options['compare'] else None
+        if options['results']:
+            if baseline is None:
+                raise CommandError("--results сравнивается с файлом из --compare")
+            results = self.load(options['results'])
+        else:
+            if baseline is not None:
+                corpus = {key: baseline['corpus'][key]
+                          for key in ('documents', 'words_per_document', 'vocabulary', 'skew', 'language', 'seed')}
+            else:
+                corpus = {
+                    'documents': options['documents'],
+                    'words_per_document': options['words'],
+                    'vocabulary': options['vocabulary'],
+                    'skew': options['skew'],
+                    'language': options['language'],
+                    'seed': options['seed'],
+                }
+            self.reset()
+            results = run_benchmarks(corpus, names=options['only'], repeat=options['repeat'])
+            self.save(results, options['output'])
+
+        self.report(results, baseline)
+        if baseline is not None:
+            regressions = compare_results(
+                baseline, results, options['throughput_threshold'], options['memory_threshold']
+            )
+            for name, metric, before, after in regressions:
+                self.stderr.write(f"Регрессия {name}: {metric} {before} -> {after}")
+            if regressions:
+                raise CommandError(f"Регрессий: {len(regressions)}")
+            self.stdout.write(self.style.SUCCESS("Регрессий нет"))
+
+    def reset(self):
+        '''Чистая база, файлы и кэши: бенчмарк каждый раз строит корпус заново'''
+        if not getattr(settings, 'BENCHMARK', False):
+            raise CommandError("Бенчмарк очищает базу и MEDIA_ROOT: запускайте с --settings=tf_idf.bench_settings")
+        os.makedirs(settings.BENCHMARK_DIR, exist_ok=True)
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        call_command('migrate', verbosity=0)
+        call_command('flush', interactive=False, verbosity=0)
+        results_cache().clear()
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Не удалось прочитать {path}: {e}")
+
+    def save(self, results, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Результаты сохранены в {path}")
+
+    def report(self, results, baseline=None):
+        corpus = results['corpus']
+        self.stdout.write(
+            f"Корпус: {corpus['documents']} документов, ~{corpus['words_per_document']} слов, "
+            f"словарь {corpus['vocabulary']}, skew {corpus['skew']}, {corpus['language']}"
+        )
+        for name, result in results['benchmarks'].items():
+            line = (f"{name:<34} {result['seconds'] * 1000:>10.2f} мс  {result['ops_per_second']:>10.2f} оп/с  "
+                    f"{result['peak_memory_mb']:>9.3f} МБ")
+            base = baseline['benchmarks'].get(name) if baseline else None
+            if base:
+                line += (f"  ({result['ops_per_second'] / base['ops_per_second'] - 1:+.1%} оп/с, "
+                         f"{result['peak_memory_mb'] - base['peak_memory_mb']:+.3f} МБ)")
+            self.stdout.write(line)
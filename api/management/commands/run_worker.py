@@ -0,0 +1,58 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from api.jobs import claim_job, run_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Воркер очереди фоновых задач (подсчет статистики документов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.STATS_WORKER_CONCURRENCY,
+                            help='Количество потоков, одновременно выполняющих задачи')
+        parser.add_argument('--poll-interval', type=float, default=settings.STATS_WORKER_POLL_INTERVAL,
+                            help='Пауза (сек) между опросами пустой очереди')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить все готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(timedelta(seconds=settings.STATS_JOB_STALE_AFTER))
+        if requeued:
+            self.stdout.write(f"Возвращено в очередь зависших задач: {requeued}")
+
+        self.stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(options['poll_interval'], options['once']), daemon=True)
+            for _ in range(max(1, options['concurrency']))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Воркер запущен, потоков: {len(threads)}")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, poll_interval, once):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                job = claim_job()
+                if job is None:
+                    if once:
+                        return
+                    self.stop.wait(poll_interval)
+                    continue
+                job = run_job(job)
+                self.stdout.write(f"{job} attempt {job.attempts}")
+        finally:
+            connection.close()
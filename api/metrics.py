@@ -1,35 +1,183 @@
-import time
+import fcntl
+import math
+import mmap
+import os
+import struct
 import threading
+import time
 
+from django.conf import settings
 
-lock = threading.Lock()
-metrics_data = {
-    'files_processed': 0,
-    'times': [],  
-    'latest_file_processed_timestamp': None
-}
+# Логарифмические корзины: 0 — всё меньше BASE, дальше каждая корзина в GROWTH раз шире
+# предыдущей (~10% точности). 190 корзин покрывают диапазон от 0.1 мс до часа.
+BASE = 0.0001
+GROWTH = 1.1
+BUCKETS = 190
+LOG_GROWTH = math.log(GROWTH)
+
+# Скользящее окно: SLOTS ячеек по SLOT_SECONDS, старые ячейки перезаписываются по кругу
+SLOT_SECONDS = 60
+SLOTS = 60
+
+# заголовок: всего замеров, время последнего, сумма, минимум, максимум (за все время)
+HEADER = struct.Struct('<Qqddd')
+# ячейка: номер минуты, замеров, сумма, минимум, максимум, счетчики корзин
+SLOT = struct.Struct(f'<qQddd{BUCKETS}I')
+FILE_SIZE = HEADER.size + SLOTS * SLOT.size
+
+
+def bucket_index(value):
+    if value < BASE:
+        return 0
+    return min(BUCKETS - 1, 1 + int(math.log(value / BASE) / LOG_GROWTH))
+
+
+def bucket_upper_bound(index):
+    return BASE * GROWTH ** index
+
+
+class LatencyHistogram:
+    '''Гистограмма задержек в файле, общем для всех процессов (воркеры gunicorn, run_worker).
+    Размер фиксирован, запись под flock, чтение и запись через mmap'''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        # после fork (gunicorn --preload) у процесса должен быть свой дескриптор, иначе flock общий
+        if self._pid == os.getpid():
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, FILE_SIZE)
+        self._pid = os.getpid()
+
+    def record(self, duration, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        slot_id = int(timestamp // SLOT_SECONDS)
+        offset = HEADER.size + (slot_id % SLOTS) * SLOT.size
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                count, _, total, low, high = HEADER.unpack_from(self._map, 0)
+                HEADER.pack_into(
+                    self._map, 0, count + 1, int(timestamp), total + duration,
+                    min(low, duration) if count else duration, max(high, duration)
+                )
+
+                slot = list(SLOT.unpack_from(self._map, offset))
+                if slot[0] != slot_id:
+                    # ячейка осталась от прошлого круга — обнуляем
+                    slot = [slot_id, 0, 0.0, 0.0, 0.0] + [0] * BUCKETS
+                slot[2] += duration
+                slot[3] = min(slot[3], duration) if slot[1] else duration
+                slot[4] = max(slot[4], duration)
+                slot[1] += 1
+                slot[5 + bucket_index(duration)] += 1
+                SLOT.pack_into(self._map, offset, *slot)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def snapshot(self, window=None):
+        '''Сводка: за все время и перцентили за последние window секунд (по умолчанию — все окно)'''
+        window = SLOTS * SLOT_SECONDS if window is None else min(window, SLOTS * SLOT_SECONDS)
+        now_slot = int(time.time() // SLOT_SECONDS)
+        oldest_slot = now_slot - max(1, math.ceil(window / SLOT_SECONDS)) + 1
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                header = HEADER.unpack_from(self._map, 0)
+                slots = [SLOT.unpack_from(self._map, HEADER.size + i * SLOT.size) for i in range(SLOTS)]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        buckets = [0] * BUCKETS
+        count, total, low, high = 0, 0.0, math.inf, 0.0
+        for slot in slots:
+            if slot[1] == 0 or not oldest_slot <= slot[0] <= now_slot:
+                continue
+            count += slot[1]
+            total += slot[2]
+            low = min(low, slot[3])
+            high = max(high, slot[4])
+            for i, bucket_count in enumerate(slot[5:]):
+                buckets[i] += bucket_count
 
-def record_processing_time(duration: float):
-    with lock:
-        metrics_data['files_processed'] += 1
-        metrics_data['times'].append(duration)
-        metrics_data['latest_file_processed_timestamp'] = int(time.time())
-
-def get_metrics():
-    with lock:
-        times = metrics_data['times']
-        if not times:
-            return {
-                'files_processed': 0,
-                'min_time_processed': 0.0,
-                'avg_time_processed': 0.0,
-                'max_time_processed': 0.0,
-                'latest_file_processed_timestamp': None,
-            }
         return {
-            'files_processed': metrics_data['files_processed'],
-            'min_time_processed': round(min(times), 3),
-            'avg_time_processed': round(sum(times) / len(times), 3),
-            'max_time_processed': round(max(times), 3),
-            'latest_file_processed_timestamp': metrics_data['latest_file_processed_timestamp'],
+            'total_count': header[0],
+            'latest_timestamp': header[1] or None,
+            'total_sum': header[2],
+            'total_min': header[3],
+            'total_max': header[4],
+            'window_seconds': window,
+            'count': count,
+            'sum': total,
+            'min': low if count else 0.0,
+            'max': high,
+            'p50': self.percentile(buckets, count, 0.50, low, high),
+            'p90': self.percentile(buckets, count, 0.90, low, high),
+            'p99': self.percentile(buckets, count, 0.99, low, high),
         }
+
+    @staticmethod
+    def percentile(buckets, count, q, low, high):
+        if not count:
+            return 0.0
+        rank = max(1, math.ceil(q * count))
+        seen = 0
+        for i, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= rank:
+                # верхняя граница корзины, но не за пределами реальных min/max
+                return min(max(bucket_upper_bound(i), low), high)
+        return high
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name):
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = LatencyHistogram(os.path.join(settings.METRICS_DIR, f'{name}.hist'))
+        return _histograms[name]
+
+
+def record_processing_time(duration: float):
+    histogram('processing').record(duration)
+
+
+def get_metrics(window=None):
+    '''Метрики обработки документов всех процессов; перцентили и окно — за последние window секунд'''
+    stats = histogram('processing').snapshot(window)
+    if window is None:
+        # без окна min/avg/max, как и раньше, за все время
+        count, total, low, high = stats['total_count'], stats['total_sum'], stats['total_min'], stats['total_max']
+    else:
+        count, total, low, high = stats['count'], stats['sum'], stats['min'], stats['max']
+    return {
+        'files_processed': stats['total_count'],
+        'min_time_processed': round(low, 3) if count else 0.0,
+        'avg_time_processed': round(total / count, 3) if count else 0.0,
+        'max_time_processed': round(high, 3) if count else 0.0,
+        'p50_time_processed': round(stats['p50'], 3),
+        'p90_time_processed': round(stats['p90'], 3),
+        'p99_time_processed': round(stats['p99'], 3),
+        'window_seconds': stats['window_seconds'],
+        'files_in_window': stats['count'],
+        'latest_file_processed_timestamp': stats['latest_timestamp'],
+    }
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_documentterms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='document_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='terms_built',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='CollectionTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.TextField()),
+                ('df', models.PositiveIntegerField(default=0)),
+                ('cf', models.PositiveIntegerField(default=0)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='api.collection')),
+            ],
+            options={
+                'unique_together': {('collection', 'term')},
+            },
+        ),
+    ]
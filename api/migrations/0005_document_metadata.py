@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='char_count',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='token_count',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
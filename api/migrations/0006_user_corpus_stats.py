@@ -0,0 +1,40 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_document_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCorpusStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='corpus_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('documents_total', models.PositiveIntegerField(default=0)),
+                ('total_length', models.PositiveBigIntegerField(default=0)),
+                ('built', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name_plural': 'User corpus stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserWordCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.TextField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='word_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-count', 'word'], name='api_userwor_user_id_87f6db_idx'), models.Index(fields=['user', 'count', 'word'], name='api_userwor_user_id_ae8979_idx')],
+                'unique_together': {('user', 'word')},
+            },
+        ),
+    ]
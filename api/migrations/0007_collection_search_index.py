@@ -0,0 +1,39 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_user_corpus_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='index_built',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='index_drift',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.TextField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('weight', models.FloatField(default=0)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='api.collection')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='api.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['collection', 'document'], name='api_posting_collect_f1b930_idx')],
+                'unique_together': {('collection', 'term', 'document')},
+            },
+        ),
+    ]
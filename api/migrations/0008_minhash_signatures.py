@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_collection_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSignature',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='api.document')),
+                ('signature', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='api.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='api_lshbuck_band_f8f4f9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_minhash_signatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('path', models.CharField(max_length=500)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+                ('term_count', models.PositiveIntegerField(default=0)),
+                ('stale', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='models', to='api.collection')),
+            ],
+            options={
+                'unique_together': {('collection', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:34
+
+import sys
+from array import array
+
+from django.db import migrations, models
+
+
+def pack(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def unpack(typecode, data):
+    column = array(typecode)
+    column.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def convert_statistics(apps, schema_editor):
+    '''JSON-списки переводятся в колонки; от повторных записей одного владельца остается последняя'''
+    Statistics = apps.get_model('api', 'Statistics')
+    Term = apps.get_model('api', 'Term')
+
+    Statistics.objects.filter(document__isnull=True, collection__isnull=True).delete()
+    Statistics.objects.filter(document__isnull=False, collection__isnull=False).delete()
+    latest = {}
+    for pk, document_id, collection_id in Statistics.objects.order_by('created_at', 'pk').values_list(
+            'pk', 'document_id', 'collection_id'):
+        latest[(document_id, collection_id)] = pk
+    Statistics.objects.exclude(pk__in=list(latest.values())).delete()
+
+    term_ids = {}
+    for statistics in Statistics.objects.iterator():
+        rows = statistics.data or []
+        for row in rows:
+            if row['word'] not in term_ids:
+                term_ids[row['word']] = Term.objects.get_or_create(text=row['word'])[0].pk
+        statistics.term_ids = pack('i', [term_ids[row['word']] for row in rows])
+        statistics.idf = pack('f', [row['idf'] for row in rows])
+        statistics.tfidf = pack('f', [row['tfidf'] for row in rows])
+        statistics.save(update_fields=['term_ids', 'idf', 'tfidf'])
+
+
+def restore_statistics(apps, schema_editor):
+    Statistics = apps.get_model('api', 'Statistics')
+    Term = apps.get_model('api', 'Term')
+    words = dict(Term.objects.values_list('id', 'text'))
+    for statistics in Statistics.objects.iterator():
+        statistics.data = [
+            {'word': words[term_id], 'tf': tfidf / idf, 'idf': idf, 'tfidf': tfidf}
+            for term_id, idf, tfidf in zip(
+                unpack('i', statistics.term_ids), unpack('f', statistics.idf), unpack('f', statistics.tfidf)
+            )
+        ]
+        statistics.save(update_fields=['data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_collection_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='statistics',
+            name='idf',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name='statistics',
+            name='term_ids',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name='statistics',
+            name='tfidf',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AlterField(
+            model_name='statistics',
+            name='data',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(convert_statistics, restore_statistics),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_statistics_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='statistics',
+            name='data',
+        ),
+        migrations.AlterField(
+            model_name='statistics',
+            name='collection',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='api.collection'),
+        ),
+        migrations.AlterField(
+            model_name='statistics',
+            name='document',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='api.document'),
+        ),
+        migrations.AddConstraint(
+            model_name='statistics',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('collection__isnull', True), ('document__isnull', False)), models.Q(('collection__isnull', False), ('document__isnull', True)), _connector='OR'), name='statistics_single_owner'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.20 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+def stamp_statistics(apps, schema_editor):
+    '''До версий статистика коллекций пересчитывалась при каждом изменении — она соответствует версии 0'''
+    Statistics = apps.get_model('api', 'Statistics')
+    Statistics.objects.filter(collection__isnull=False).update(version=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_statistics_owner_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statistics',
+            name='version',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(stamp_statistics, migrations.RunPython.noop),
+    ]
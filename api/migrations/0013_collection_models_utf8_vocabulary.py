@@ -0,0 +1,20 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:20
+
+from django.db import migrations
+
+
+def mark_models_stale(apps, schema_editor):
+    '''Словарь моделей теперь хранится байтами UTF-8 со смещениями — старые версии собираются заново'''
+    CollectionModel = apps.get_model('api', 'CollectionModel')
+    CollectionModel.objects.filter(stale=False).update(stale=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_collection_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_models_stale, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_collection_models_utf8_vocabulary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='api_documen_owner_i_5bc035_idx'),
+        ),
+    ]
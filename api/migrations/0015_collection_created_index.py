@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_document_created_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='api_collect_owner_i_9f250d_idx'),
+        ),
+    ]
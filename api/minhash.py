@@ -0,0 +1,92 @@
+import hashlib
+import zlib
+from functools import lru_cache
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+NUM_PERM = 128
+# LSH: BANDS полос по ROWS значений; пары с похожестью выше ~(1/BANDS)^(1/ROWS) ≈ 0.7
+# почти наверняка попадают в общую корзину хотя бы одной полосы
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+BATCH_SIZE = 4096
+
+_MAX = 0xFFFFFFFF
+
+
+@lru_cache(maxsize=None)
+def permutations():
+    '''Коэффициенты хеш-функций вида (a*x + b) mod 2^64 >> 32 с нечетным a; seed фиксирован, чтобы подписи
+    совпадали между процессами и перезапусками'''
+    rng = np.random.default_rng(20240229)
+    a = rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+class MinHasher:
+    '''MinHash-подпись документа по шинглам из SHINGLE_SIZE слов.
+    Токены подаются потоком, шинглы на границах пачек не теряются'''
+
+    def __init__(self):
+        self.values = np.full(NUM_PERM, _MAX, dtype=np.uint32)
+        self.window = []
+        self.shingles = 0
+        self._batch = []
+
+    def consume(self, tokens):
+        '''Пропускает токены дальше, попутно обновляя подпись'''
+        for token in tokens:
+            self.window.append(token)
+            if len(self.window) > SHINGLE_SIZE:
+                del self.window[0]
+            if len(self.window) == SHINGLE_SIZE:
+                self._add(' '.join(self.window))
+            yield token
+        self._flush()
+
+    def _add(self, shingle):
+        self._batch.append(zlib.crc32(shingle.encode('utf-8')))
+        if len(self._batch) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        hashes = np.array(self._batch, dtype=np.uint64)
+        self.shingles += len(self._batch)
+        self._batch = []
+        a, b = permutations()
+        with np.errstate(over='ignore'):
+            permuted = ((np.outer(hashes, a) + b) >> np.uint64(32)).astype(np.uint32)
+        np.minimum(self.values, permuted.min(axis=0), out=self.values)
+
+    def signature(self):
+        '''Подпись в байтах или None для пустого документа'''
+        if not self.shingles and self.window:
+            # документ короче шингла — весь текст один шингл
+            self._add(' '.join(self.window))
+            self._flush()
+        if not self.shingles:
+            return None
+        return self.values.astype('<u4').tobytes()
+
+
+def band_buckets(signature):
+    '''Номера корзин LSH по полосам подписи: [(полоса, корзина)]'''
+    buckets = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS * 4:(band + 1) * ROWS * 4]
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+
+def similarity(signature_a, signature_b):
+    '''Оценка коэффициента Жаккара множеств шинглов по двум подписям'''
+    a = np.frombuffer(signature_a, dtype='<u4')
+    b = np.frombuffer(signature_b, dtype='<u4')
+    return float(np.count_nonzero(a == b)) / NUM_PERM
@@ -1,7 +1,15 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
+from array import array
 import uuid
 import os
+import sys
+from .lru import text_cache
+
+# сколько слов словаря искать или добавлять одним запросом (лимит параметров SQLite)
+TERM_BATCH_SIZE = 500
 
 
 
@@ -14,28 +22,67 @@ class Document(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to='documents/')
+    # заполняются при индексации документа, чтобы списки не читали файлы
+    size = models.PositiveBigIntegerField(null=True, blank=True)  # байт в UTF-8
+    char_count = models.PositiveBigIntegerField(null=True, blank=True)
+    token_count = models.PositiveBigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # sha256
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # порядок CreatedCursorPagination в списке документов владельца
+        indexes = [models.Index(fields=['owner', '-created_at', '-id'])]
     
     @property
     def content(self):
+        key = (self.pk, self.file.name)
+        content = text_cache.get(key)
+        if content is not None:
+            return content
         try:
-            with open(self.file.path,'r', encoding="utf-8") as f:
+            with open(self.file.path,'r', encoding="utf-8", errors="replace") as f:
                 content = f.read()
-                return content
-        except:
-            print(f"Error reading file: {Exception}")
+        except Exception as e:
+            print(f"Error reading file: {e}")
             return ""
+        text_cache.set(key, content, self.size if self.size is not None else len(content.encode("utf-8")))
+        return content
 
     def __str__(self):
         return self.title
 
+
+class DocumentTerms(models.Model):
+    '''Частоты слов документа, считаются один раз при загрузке'''
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='terms')
+    counts = models.JSONField(default=dict)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Document terms"
+
+    def __str__(self):
+        return f"Terms of {self.document_id}"
+
 class Collection(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     documents = models.ManyToManyField(Document, related_name='collections')
+    document_count = models.PositiveIntegerField(default=0)
+    terms_built = models.BooleanField(default=False)
+    # поисковый индекс: построен ли и сколько документов добавлено/удалено с последнего пересчета весов
+    index_built = models.BooleanField(default=False)
+    index_drift = models.PositiveIntegerField(default=0)
+    # растет при каждом изменении состава; статистика помечается версией, по которой посчитана
+    version = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # порядок CreatedCursorPagination в списке коллекций владельца
+        indexes = [models.Index(fields=['owner', '-created_at', '-id'])]
     
     @property
     def content(self):
@@ -53,13 +100,223 @@ class Collection(models.Model):
 
     def __str__(self):
         return self.name
-    
+
+
+class DocumentSignature(models.Model):
+    '''MinHash-подпись документа (api.minhash), считается при индексации'''
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='signature')
+    signature = models.BinaryField()
+
+    def __str__(self):
+        return f"Signature of {self.document_id}"
+
+
+class LSHBucket(models.Model):
+    '''Корзина LSH для полосы подписи: документы с общей корзиной — кандидаты в почти-дубликаты'''
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='lsh_buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['band', 'bucket'])]
+
+    def __str__(self):
+        return f"{self.band}:{self.bucket} ({self.document_id})"
+
+
+class CollectionTerm(models.Model):
+    '''Счетчики слова в коллекции: df — в скольких документах встречается, cf — сколько раз всего'''
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='terms')
+    term = models.TextField()
+    df = models.PositiveIntegerField(default=0)
+    cf = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('collection', 'term')
+
+    def __str__(self):
+        return f"{self.term} ({self.collection_id})"
+
+
+class Posting(models.Model):
+    '''Обратный индекс коллекции: слово -> документы. weight — вес слова в нормированном
+    TF-IDF векторе документа по idf коллекции на момент последнего пересчета'''
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='postings')
+    term = models.TextField()
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='postings')
+    count = models.PositiveIntegerField(default=0)
+    weight = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('collection', 'term', 'document')
+        indexes = [models.Index(fields=['collection', 'document'])]
+
+    def __str__(self):
+        return f"{self.term} -> {self.document_id}"
+
+
+class CollectionModel(models.Model):
+    '''Версия обученной модели коллекции (словарь, idf, матрица TF-IDF) — файлы .npy в каталоге path.
+    stale — состав коллекции изменился, при следующем обращении соберется новая версия'''
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='models')
+    version = models.PositiveIntegerField()
+    path = models.CharField(max_length=500)
+    document_count = models.PositiveIntegerField(default=0)
+    term_count = models.PositiveIntegerField(default=0)
+    stale = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('collection', 'version')
+
+    def __str__(self):
+        return f"Model v{self.version} of {self.collection_id}"
+
+
+class UserCorpusStats(models.Model):
+    '''Агрегаты по всем документам пользователя для MetricsView, обновляются при индексации и удалении'''
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='corpus_stats')
+    documents_total = models.PositiveIntegerField(default=0)
+    total_length = models.PositiveBigIntegerField(default=0)
+    built = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name_plural = "User corpus stats"
+
+    def __str__(self):
+        return f"Corpus of {self.user_id}"
+
+
+class UserWordCount(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='word_counts')
+    word = models.TextField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'word')
+        indexes = [
+            models.Index(fields=['user', '-count', 'word']),  # most_common_words
+            models.Index(fields=['user', 'count', 'word']),  # rarest_words
+        ]
+
+    def __str__(self):
+        return f"{self.word}: {self.count}"
+
+
+class Term(models.Model):
+    '''Общий словарь: слово хранится один раз, Statistics ссылается на него по id'''
+    text = models.TextField(unique=True)
+
+    @classmethod
+    def ids(cls, words):
+        '''{слово: id}; недостающие слова добавляются в словарь'''
+        words = list(set(words))
+        ids = {}
+        for start in range(0, len(words), TERM_BATCH_SIZE):
+            ids.update(cls.objects.filter(text__in=words[start:start + TERM_BATCH_SIZE]).values_list('text', 'id'))
+        missing = [word for word in words if word not in ids]
+        if missing:
+            # ignore_conflicts: слово мог одновременно добавить другой процесс
+            cls.objects.bulk_create([cls(text=word) for word in missing], batch_size=TERM_BATCH_SIZE, ignore_conflicts=True)
+            for start in range(0, len(missing), TERM_BATCH_SIZE):
+                ids.update(cls.objects.filter(text__in=missing[start:start + TERM_BATCH_SIZE]).values_list('text', 'id'))
+        return ids
+
+    def __str__(self):
+        return self.text
+
+
+def _pack(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack(typecode, data):
+    column = array(typecode)
+    column.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
 class Statistics(models.Model):
-    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True)
-    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, null=True, blank=True)
-    data = models.JSONField() 
+    '''Топ слов документа или коллекции в колоночном виде: параллельные массивы id слов (int32),
+    idf и tfidf (float32, little-endian). tf не хранится — это tfidf / idf'''
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, null=True, blank=True, related_name='statistics')
+    collection = models.OneToOneField(Collection, on_delete=models.CASCADE, null=True, blank=True, related_name='statistics')
+    term_ids = models.BinaryField(default=bytes)
+    idf = models.BinaryField(default=bytes)
+    tfidf = models.BinaryField(default=bytes)
+    # версия коллекции, по составу которой посчитана статистика (у документов пусто)
+    version = models.PositiveBigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         verbose_name_plural = "Statistics"
-    
\ No newline at end of file
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(document__isnull=False, collection__isnull=True)
+                | models.Q(document__isnull=True, collection__isnull=False),
+                name='statistics_single_owner',
+            ),
+        ]
+
+    @staticmethod
+    def columns(rows, term_ids=None):
+        '''Поля модели из списка словарей build_statistics; term_ids — готовый {слово: id}'''
+        if term_ids is None:
+            term_ids = Term.ids(row['word'] for row in rows)
+        return {
+            'term_ids': _pack('i', [term_ids[row['word']] for row in rows]),
+            'idf': _pack('f', [row['idf'] for row in rows]),
+            'tfidf': _pack('f', [row['tfidf'] for row in rows]),
+        }
+
+    @cached_property
+    def data(self):
+        '''Список словарей для API; собирается при первом обращении, слова — одним запросом'''
+        term_ids = _unpack('i', self.term_ids)
+        words = dict(Term.objects.filter(id__in=set(term_ids)).values_list('id', 'text')) if term_ids else {}
+        return [
+            {'word': words[term_id], 'tf': tfidf / idf, 'idf': idf, 'tfidf': tfidf}
+            for term_id, idf, tfidf in zip(term_ids, _unpack('f', self.idf), _unpack('f', self.tfidf))
+        ]
+
+    def __str__(self):
+        if self.document_id:
+            return f"Statistics of {self.document_id}"
+        return f"Statistics of collection {self.collection_id}"
+
+
+class Job(models.Model):
+    '''Фоновая задача (подсчет статистики и т.п.), выполняется воркером manage.py run_worker'''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedCursorPagination(CursorPagination):
+    '''Курсорная пагинация по дате создания: страница — один индексный запрос без OFFSET и COUNT'''
+    ordering = ('-created_at', '-pk')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,11 @@
+from rest_framework.renderers import JSONRenderer
+
+from .tracing import span
+
+
+class TimedJSONRenderer(JSONRenderer):
+    '''JSONRenderer с замером сериализации ответа (этап json в Server-Timing)'''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('json'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -1,22 +1,61 @@
 from rest_framework import serializers
-from .models import Document, Collection, User, Statistics
+from .models import Document, Collection, User, Statistics, Job
+from .utils import STATISTICS_TOP_K, STATISTICS_ORDERS, SIMILARITY_THRESHOLD
 
-class DocumentSerializer(serializers.ModelSerializer):
+def query_list(request, name):
+    value = request.query_params.get(name, '') if request is not None else ''
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class ExpandableFieldsMixin:
+    '''?fields=a,b — оставить только эти поля; ?expand=x — добавить тяжелые поля из Meta.expandable_fields
+    (по умолчанию их нет в ответе). Поля по умолчанию можно раскрыть через context['expand']'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        expand = query_list(request, 'expand') | set(self.context.get('expand', ()))
+        for name in set(getattr(self.Meta, 'expandable_fields', ())) - expand:
+            self.fields.pop(name, None)
+        only = query_list(request, 'fields')
+        if only:
+            for name in set(self.fields) - only - expand:
+                self.fields.pop(name)
+
+
+class DocumentSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Document
+        fields = ['id', 'title', 'size', 'char_count', 'token_count']
+
+
+class DocumentSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ['id', 'title', 'file', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'file', 'size', 'char_count', 'token_count', 'content_hash', 'created_at', 'updated_at',
+                  'content']
+        read_only_fields = ['size', 'char_count', 'token_count', 'content_hash', 'content']
+        expandable_fields = ['content']
 
 class DocumentDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ['id', 'title', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'content', 'size', 'char_count', 'token_count', 'content_hash', 'created_at', 'updated_at']
+
+class CollectionSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    documents_total = serializers.SerializerMethodField()
+    documents = DocumentSummarySerializer(many=True, read_only=True)
 
-class CollectionSerializer(serializers.ModelSerializer):
-    documents = DocumentSerializer(many=True, read_only=True)
-    
     class Meta:
         model = Collection
-        fields = ['id', 'name', 'documents', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'documents_total', 'created_at', 'updated_at', 'documents', 'content']
+        read_only_fields = ['content']
+        expandable_fields = ['documents', 'content']
+
+    def get_documents_total(self, obj):
+        # в списке приходит из annotate, у только что созданной коллекции считается запросом
+        total = getattr(obj, 'documents_total', None)
+        return total if total is not None else obj.documents.count()
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -42,7 +81,99 @@ class ChangePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True)
 
 
+class CodeLengthField(serializers.Field):
+    '''Пара [символ, длина кода]: символ — строка из одного символа, длина — целое от 1'''
+    default_error_messages = {
+        'invalid': "Ожидается пара [символ, длина кода]",
+        'symbol': "Символ должен быть строкой",
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # пробел и перевод строки — тоже символы, их не обрезать
+        self.symbol = serializers.CharField(min_length=1, max_length=1, trim_whitespace=False)
+        self.length = serializers.IntegerField(min_value=1)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, (list, tuple)) or len(data) != 2:
+            self.fail('invalid')
+        symbol, length = data
+        # CharField превратил бы число в строку, IntegerField — true в 1
+        if not isinstance(symbol, str):
+            self.fail('symbol')
+        if isinstance(length, bool):
+            self.fail('invalid')
+        return [self.symbol.run_validation(symbol), self.length.run_validation(length)]
+
+    def to_representation(self, value):
+        return list(value)
+
+
+class HuffmanDecodeSerializer(serializers.Serializer):
+    encoded = serializers.CharField(allow_blank=True, help_text="Упакованные биты в base64")
+    padding = serializers.IntegerField(min_value=0, max_value=7)
+    lengths = serializers.ListField(
+        child=CodeLengthField(),
+        help_text="Пары [символ, длина кода] канонического кода Хаффмана"
+    )
+
+
 class StatisticsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Statistics
-        fields = ['data']
\ No newline at end of file
+        fields = ['data']
+
+
+class BulkUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), required=False, default=list)
+    archive = serializers.FileField(required=False, help_text="Архив .zip, .tar, .tar.gz, .tgz, .tar.bz2 или .tar.xz")
+    collection = serializers.IntegerField(required=False, help_text="Коллекция, в которую добавить все документы")
+
+    def validate(self, data):
+        if not data['files'] and not data.get('archive'):
+            raise serializers.ValidationError("Нужны files или archive")
+        return data
+
+
+class StatisticsQuerySerializer(serializers.Serializer):
+    k = serializers.IntegerField(min_value=1, default=STATISTICS_TOP_K, help_text="Сколько слов вернуть")
+    order = serializers.ChoiceField(
+        choices=STATISTICS_ORDERS, default='asc',
+        help_text="asc — слова с наименьшим tfidf, desc — с наибольшим"
+    )
+    full = serializers.BooleanField(default=False, help_text="Весь разреженный вектор {слово: tfidf}, k и order не учитываются")
+
+    def is_default(self):
+        '''Параметры совпадают с сохраненной в Statistics выборкой'''
+        data = self.validated_data
+        return data['k'] == STATISTICS_TOP_K and data['order'] == 'asc' and not data['full']
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(help_text="Текст запроса")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10, help_text="Сколько документов вернуть")
+
+
+class ScoreTextSerializer(serializers.Serializer):
+    text = serializers.CharField(help_text="Новый текст, который нужно оценить по модели коллекции")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10, help_text="Сколько близких документов вернуть")
+
+
+class SimilarityQuerySerializer(serializers.Serializer):
+    threshold = serializers.FloatField(min_value=0, max_value=1, default=SIMILARITY_THRESHOLD,
+                                       help_text="Минимальная оценка коэффициента Жаккара")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    duration = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'max_attempts', 'error',
+                  'created_at', 'started_at', 'finished_at', 'duration']
+
+    def get_duration(self, obj):
+        if obj.started_at and obj.finished_at:
+            return round((obj.finished_at - obj.started_at).total_seconds(), 3)
+        return None
@@ -0,0 +1,1031 @@
+import asyncio
+import hashlib
+import heapq
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import (Collection, CollectionModel, CollectionTerm, Document, DocumentSignature, DocumentTerms, Job, Posting,
+                     Statistics, Term, UserCorpusStats)
+from .async_views import database
+from .benchmarks import compare_results, generate_corpus, run_benchmarks
+from .lazy import lazy_import
+from .lru import ByteLRUCache, text_cache
+from .tracing import server_timing_header
+from .metrics import FILE_SIZE, SLOT_SECONDS, SLOTS, LatencyHistogram, _histograms
+from .jobs import HANDLERS, claim_job, enqueue, requeue_stale_jobs, run_job
+from .views import collections_queryset
+from .warmup import warm_up
+from .utils import (_loaded_models, add_document_to_collection, build_collection_model, build_statistics,
+                    cached_collection_statistics, calculate_collection_statistics, canonical_codes,
+                    collection_model_path, collection_tfidf, create_documents, fit_tfidf, get_collection_model,
+                    get_term_counts, huffman, huffman_code_lengths, matrix_row, rebuild_collection_index,
+                    rebuild_collection_terms, remove_document_from_collection)
+
+# Запуск без Postgres: python manage.py test api --settings=tf_idf.bench_settings
+
+
+class APITestCase(TestCase):
+    '''Файлы, кэши и гистограммы — во временном каталоге; задачи статистики выполняются сразу'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=f'{cls.tmpdir}/media',
+            METRICS_DIR=f'{cls.tmpdir}/metrics',
+            STATS_JOBS_EAGER=True,
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'tfidf_results': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': f'{cls.tmpdir}/tfidf_results',
+                },
+                'results': {
+                    'BACKEND': 'api.cache_backends.AtomicFileBasedCache',
+                    'LOCATION': f'{cls.tmpdir}/results',
+                },
+            },
+        )
+        cls.settings_override.enable()
+        # гистограммы открыты на METRICS_DIR прошлого класса
+        _histograms.clear()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        # id коллекций и версии моделей повторяются между тестами (откат транзакции):
+        # открытые и записанные модели прошлых тестов не должны находиться
+        _loaded_models.clear()
+        shutil.rmtree(f'{self.tmpdir}/media/models', ignore_errors=True)
+        self.user = get_user_model().objects.create_user(username='tester', password='tester')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='doc.txt'):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        response = self.client.post('/api/documents/', {'title': name, 'file': SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 201, response.content)
+        return Document.objects.get(pk=response.data['id'])
+
+    def create_collection(self, name='collection'):
+        return Collection.objects.create(owner=self.user, name=name)
+
+
+class TermCountsTests(APITestCase):
+    def test_upload_stores_term_counts(self):
+        document = self.upload('Apple apple, banana! a')
+        terms = DocumentTerms.objects.get(document=document)
+        self.assertEqual(terms.counts, {'apple': 2, 'banana': 1, 'a': 1})
+        self.assertEqual(terms.total, 4)
+
+    def test_statistics_are_built_from_stored_counts(self):
+        collection = self.create_collection()
+        documents = [self.upload('apple banana banana'), self.upload('apple kiwi')]
+        for document in documents:
+            add_document_to_collection(collection, document)
+        expected = self.client.get(f'/api/documents/{documents[0].pk}/statistics', {'k': 5}).data
+        # файлы больше не читаются: статистика собирается из сохраненных частот
+        for document in documents:
+            document.file.delete(save=False)
+        response = self.client.get(f'/api/documents/{documents[0].pk}/statistics', {'k': 5, 'order': 'desc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['word'] for row in response.data], ['banana', 'apple'])
+        self.assertEqual(sorted(expected, key=lambda row: row['word']), sorted(response.data, key=lambda row: row['word']))
+        banana = response.data[0]
+        # сглаженный idf sklearn: ln((1 + n) / (1 + df)) + 1
+        self.assertAlmostEqual(banana['idf'], math.log(3 / 2) + 1)
+
+
+@override_settings(STATS_JOB_MAX_ATTEMPTS=3, STATS_JOB_RETRY_DELAY=10)
+class JobQueueTests(APITestCase):
+    def test_upload_returns_finished_job(self):
+        response = self.client.post('/api/documents/', {'title': 'a', 'file': SimpleUploadedFile('a.txt', b'apple')})
+        self.assertEqual(response.status_code, 201)
+        job = self.client.get(f"/api/jobs/{response.data['job_id']}/").data
+        self.assertEqual((job['kind'], job['status'], job['attempts']), ('document_statistics', Job.DONE, 1))
+        self.assertIsNotNone(job['duration'])
+
+    def test_retry_with_backoff_then_fail(self):
+        calls = []
+
+        def broken(**payload):
+            calls.append(payload)
+            raise RuntimeError('boom')
+
+        with mock.patch.dict(HANDLERS, {'broken': broken}):
+            job = enqueue('broken', owner=self.user, value=1)
+            delays = []
+            while job.status == Job.QUEUED:
+                delays.append(round((job.run_after - timezone.now()).total_seconds()))
+                # следующая попытка еще не наступила — задачу никто не заберет
+                self.assertIsNone(claim_job(job_id=job.pk))
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                job = run_job(claim_job(job_id=job.pk))
+
+        self.assertEqual(delays, [10, 20])
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIn('RuntimeError: boom', job.error)
+        self.assertEqual(calls, [{'value': 1}] * 3)
+
+    def test_job_status_endpoint(self):
+        job = Job.objects.create(owner=self.user, kind='document_statistics')
+        response = self.client.get(f'/api/jobs/{job.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['status'], response.data['duration']), (Job.QUEUED, None))
+
+        other = get_user_model().objects.create_user(username='other', password='other')
+        foreign = Job.objects.create(owner=other, kind='document_statistics')
+        self.assertEqual(self.client.get(f'/api/jobs/{foreign.pk}/').status_code, 404)
+
+    def test_stale_running_job_is_requeued(self):
+        job = Job.objects.create(owner=self.user, kind='document_statistics', status=Job.RUNNING,
+                                 started_at=timezone.now() - timedelta(hours=1))
+        fresh = Job.objects.create(owner=self.user, kind='document_statistics', status=Job.RUNNING,
+                                   started_at=timezone.now())
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=fresh.pk).status, Job.RUNNING)
+
+
+class UserCorpusTests(APITestCase):
+    def metrics(self):
+        data = self.client.get('/api/metrics/').data
+        return {key: data[key] for key in ('documents_total', 'average_document_length', 'most_common_words', 'rarest_words')}
+
+    def test_aggregates_follow_upload_and_delete(self):
+        self.metrics()  # агрегаты построены до загрузок — дальше они только обновляются
+        first = self.upload('apple apple banana')
+        self.upload('apple kiwi')
+        self.assertEqual(self.metrics(), {
+            'documents_total': 2,
+            'average_document_length': 14.0,
+            'most_common_words': ['apple', 'banana', 'kiwi'],
+            'rarest_words': ['banana', 'kiwi'],
+        })
+
+        self.assertEqual(self.client.delete(f'/api/documents/{first.pk}').status_code, 204)
+        expected = {
+            'documents_total': 1,
+            'average_document_length': 10.0,
+            'most_common_words': ['apple', 'kiwi'],
+            'rarest_words': ['apple', 'kiwi'],
+        }
+        self.assertEqual(self.metrics(), expected)
+        # пересчет с нуля по сохраненным частотам дает то же самое
+        UserCorpusStats.objects.filter(user=self.user).update(built=False)
+        self.assertEqual(self.metrics(), expected)
+
+
+class CollectionMembershipTests(APITestCase):
+    def test_double_add_counts_document_once(self):
+        collection = self.create_collection()
+        self.upload('apple banana')
+        document = self.upload('kiwi apple')
+        self.assertTrue(add_document_to_collection(collection, document))
+        # второе добавление того же документа (как при гонке двух запросов) ничего не меняет
+        self.assertFalse(add_document_to_collection(collection, document))
+
+        collection.refresh_from_db()
+        self.assertEqual(collection.document_count, 1)
+        self.assertEqual(collection.documents.count(), 1)
+        self.assertEqual(CollectionTerm.objects.get(collection=collection, term='kiwi').df, 1)
+
+    def test_double_add_with_built_index(self):
+        collection = self.create_collection()
+        first = self.upload('apple banana')
+        document = self.upload('kiwi apple')
+        self.client.post(f'/api/collections/{collection.pk}/{first.pk}/')
+        # поиск строит обратный индекс: дальше добавления пишут постинги
+        self.client.get(f'/api/collections/{collection.pk}/search', {'q': 'apple'})
+        self.assertTrue(Collection.objects.get(pk=collection.pk).index_built)
+        self.assertEqual(self.client.post(f'/api/collections/{collection.pk}/{document.pk}/').status_code, 200)
+
+        self.assertFalse(add_document_to_collection(collection, document))
+        response = self.client.post(f'/api/collections/{collection.pk}/{document.pk}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], "Документ уже находится в коллекции")
+        collection.refresh_from_db()
+        self.assertEqual(collection.document_count, 2)
+        self.assertEqual(CollectionTerm.objects.get(collection=collection, term='kiwi').df, 1)
+
+
+
+class CollectionVectorTests(APITestCase):
+    TEXTS = ['apple banana banana', 'apple kiwi kiwi kiwi', 'banana cherry a']
+
+    def collection_terms(self, collection):
+        return set(CollectionTerm.objects.filter(collection=collection).values_list('term', 'df', 'cf'))
+
+    def test_vector_matches_concatenated_document(self):
+        collection = self.create_collection()
+        documents = [self.upload(text) for text in self.TEXTS]
+        for document in documents:
+            add_document_to_collection(collection, document)
+        words, idf_values, tfidf_values = collection_tfidf(collection)
+
+        # прежний расчет: корпус плюс склейка всех документов еще одной строкой
+        term_counts = get_term_counts(documents)
+        term_counts.append(sum(map(Counter, term_counts), Counter()))
+        expected_words, _, expected_values = matrix_row(*fit_tfidf(term_counts), len(documents))
+        expected = dict(zip(expected_words, expected_values))
+        self.assertEqual(set(words), set(expected))
+        for word, value in zip(words, tfidf_values):
+            self.assertAlmostEqual(value, expected[word])
+
+    def test_counters_after_add_and_remove_match_rebuild(self):
+        collection = self.create_collection()
+        documents = [self.upload(text) for text in self.TEXTS]
+        for document in documents:
+            add_document_to_collection(collection, document)
+        remove_document_from_collection(collection, documents[1])
+        incremental = self.collection_terms(collection)
+
+        rebuild_collection_terms(collection)
+        self.assertEqual(incremental, self.collection_terms(collection))
+        self.assertEqual(incremental, {('apple', 1, 1), ('banana', 2, 3), ('cherry', 1, 1)})
+
+
+class CollectionSearchTests(APITestCase):
+    TEXTS = ['apple banana banana', 'apple kiwi kiwi kiwi', 'banana cherry', 'cherry plum', 'plum plum apple']
+
+    def setUp(self):
+        super().setUp()
+        self.collection = self.create_collection()
+        self.documents = [self.upload(text, f'doc{i}.txt') for i, text in enumerate(self.TEXTS)]
+        for document in self.documents:
+            self.client.post(f'/api/collections/{self.collection.pk}/{document.pk}/')
+
+    def search(self, q):
+        response = self.client.get(f'/api/collections/{self.collection.pk}/search', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def weights(self):
+        return {
+            (str(document_id), term): weight
+            for document_id, term, weight in Posting.objects.filter(collection=self.collection)
+            .values_list('document_id', 'term', 'weight')
+        }
+
+    def test_ranking_matches_cosine_similarity(self):
+        data = self.search('banana kiwi unknown')
+        self.assertEqual(data['query_terms'], ['banana', 'kiwi'])
+
+        # эталон: косинус нормированных строк TF-IDF коллекции и вектора запроса с тем же idf
+        tfidf_matrix, vocabulary, idf_values = fit_tfidf(get_term_counts(self.documents))
+        query = np.zeros(len(vocabulary))
+        for term in data['query_terms']:
+            query[vocabulary.index(term)] = idf_values[vocabulary.index(term)]
+        scores = tfidf_matrix @ (query / np.linalg.norm(query))
+        expected = sorted(
+            ((str(document.pk), score) for document, score in zip(self.documents, scores) if score > 0),
+            key=lambda item: -item[1]
+        )
+        self.assertEqual([str(row['id']) for row in data['results']], [document_id for document_id, _ in expected])
+        for row, (_, score) in zip(data['results'], expected):
+            self.assertAlmostEqual(row['score'], score)
+
+    def test_index_follows_membership_and_is_reweighted(self):
+        self.search('apple')
+        added = self.upload('kiwi cherry', 'added.txt')
+        self.client.post(f'/api/collections/{self.collection.pk}/{added.pk}/')
+        self.assertIn(added.pk, [row['id'] for row in self.search('kiwi')['results']])
+        # одно изменение на шесть документов — в пределах INDEX_REWEIGHT_RATIO, веса не пересчитывались
+        self.assertEqual(Collection.objects.get(pk=self.collection.pk).index_drift, 1)
+
+        removed = self.documents[1]
+        self.client.delete(f'/api/collections/{self.collection.pk}/{removed.pk}/delete/')
+        self.assertFalse(Posting.objects.filter(collection=self.collection, document=removed).exists())
+        self.assertNotIn(removed.pk, [row['id'] for row in self.search('kiwi apple')['results']])
+        # второе изменение превышает порог: поиск пересобрал индекс с весами по текущему составу
+        collection = Collection.objects.get(pk=self.collection.pk)
+        self.assertEqual(collection.index_drift, 0)
+        weights = self.weights()
+        rebuild_collection_index(collection)
+        self.assertEqual(weights.keys(), self.weights().keys())
+        for key, weight in self.weights().items():
+            self.assertAlmostEqual(weights[key], weight)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.token = Token.objects.create(user=self.user)
+
+    def aget(self, url):
+        return self.async_client.get(url, headers={'Authorization': f'Token {self.token.key}'})
+
+    async def test_read_paths_match_sync_responses(self):
+        document = await database(self.upload)('abracadabra')
+        collection = await database(self.create_collection)()
+        await database(add_document_to_collection)(collection, document)
+        for url in (f'/api/documents/{document.pk}', f'/api/documents/{document.pk}/huffman/',
+                    '/api/collections/?expand=documents,content'):
+            with self.subTest(url=url):
+                response = await self.aget(url)
+                self.assertEqual(response.status_code, 200, response.content)
+                expected = await database(self.client.get)(url)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_foreign_document_is_not_found(self):
+        other = await database(get_user_model().objects.create_user)(username='other', password='other')
+        document = await Document.objects.acreate(owner=other, title='other', file='documents/missing.txt')
+        response = await self.aget(f'/api/documents/{document.pk}')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_slow_requests_do_not_block_each_other(self):
+        document = await database(self.upload)('abracadabra')
+
+        def slow_huffman(document, binary=False):
+            time.sleep(0.3)
+            return {'encoded': ''}
+
+        # вычисление уходит в пул потоков: три медленных запроса идут параллельно, а не друг за другом
+        with mock.patch('api.views.cached_huffman', slow_huffman):
+            started = time.monotonic()
+            responses = await asyncio.gather(*(
+                self.aget(f'/api/documents/{document.pk}/huffman/') for _ in range(3)
+            ))
+            elapsed = time.monotonic() - started
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertLess(elapsed, 0.8)
+
+
+class WarmStartTests(APITestCase):
+    def test_heavy_modules_are_imported_on_first_use(self):
+        # чистый процесс: импорт всего приложения не тянет numpy, scipy и scikit-learn
+        script = (
+            "import sys, django; django.setup(); import tf_idf.urls; "
+            "print(sorted(m for m in ('numpy', 'scipy', 'sklearn') if m in sys.modules))"
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'tf_idf.bench_settings'}
+        output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '[]')
+
+    def test_lazy_module_is_shared_and_loaded_once(self):
+        module = lazy_import('colorsys')
+        self.assertIs(lazy_import('colorsys'), module)
+        self.assertEqual(module.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+        # после первого обращения атрибуты лежат в самом объекте, __getattr__ больше не вызывается
+        self.assertIn('rgb_to_hsv', vars(module))
+
+    def test_preload_opens_ready_models_only(self):
+        ready, stale = self.create_collection('ready'), self.create_collection('stale')
+        for collection in (ready, stale):
+            add_document_to_collection(collection, self.upload('apple banana'))
+            build_collection_model(Collection.objects.get(pk=collection.pk))
+        CollectionModel.objects.filter(collection=stale).update(stale=True)
+        _loaded_models.clear()
+
+        with mock.patch('api.warmup.connections'), mock.patch('api.warmup.gc'):
+            state = warm_up()
+        self.assertEqual(state['collection_models'], 1)
+        self.assertEqual(list(_loaded_models), [ready.pk])
+        # открытая при прогреве модель используется запросами без повторной загрузки
+        model = _loaded_models[ready.pk]
+        self.assertIs(get_collection_model(Collection.objects.get(pk=ready.pk)), model)
+
+class NonUtf8IndexingTests(APITestCase):
+    CP1251 = 'привет мир, привет'.encode('cp1251')
+
+    def test_upload_non_utf8_file(self):
+        document = self.upload(self.CP1251, 'cp1251.txt')
+        self.assertEqual(Job.objects.get(payload__document_id=str(document.pk)).status, Job.DONE)
+        self.assertTrue(DocumentTerms.objects.filter(document=document).exists())
+        self.assertTrue(Statistics.objects.filter(document=document).exists())
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/documents/{document.pk}').status_code, 200)
+
+    def test_collection_with_non_utf8_document(self):
+        collection = self.create_collection()
+        for document in (self.upload('apple banana'), self.upload(self.CP1251, 'cp1251.txt')):
+            self.assertEqual(self.client.post(f'/api/collections/{collection.pk}/{document.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/collections/{collection.pk}/statistics/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/collections/{collection.pk}/search', {'q': 'apple'}).status_code, 200)
+
+    def test_bulk_upload_with_non_utf8_file(self):
+        response = self.client.post('/api/documents/bulk/', {'files': [
+            SimpleUploadedFile('good.txt', 'apple banana'.encode('utf-8')),
+            SimpleUploadedFile('cp1251.txt', self.CP1251),
+            SimpleUploadedFile('binary.bin', bytes(range(256))),
+        ]})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Job.objects.get(pk=response.data['job_id']).status, Job.DONE)
+        self.assertEqual(Statistics.objects.filter(document__owner=self.user).count(), 3)
+
+
+class BulkStatisticsTests(APITestCase):
+    def create(self, count, collection=None):
+        files = [(f'doc{i}.txt', io.BytesIO(f'apple word{i} banana'.encode('utf-8'))) for i in range(count)]
+        return create_documents(self.user, files, collection)
+
+    def test_failed_document_does_not_block_others(self):
+        collection = self.create_collection()
+        documents = self.create(3, collection) + self.create(2)
+        broken = [documents[1], documents[3]]
+        for document in broken:
+            document.file.delete(save=False)
+
+        job = enqueue('bulk_statistics', owner=self.user, document_ids=[str(document.pk) for document in documents])
+        self.assertEqual(job.status, Job.DONE)
+        for document in broken:
+            self.assertIn(str(document.pk), job.error)
+        self.assertEqual(
+            set(Statistics.objects.values_list('document_id', flat=True)),
+            {document.pk for document in documents if document not in broken}
+        )
+
+    def test_documents_are_counted_in_metrics(self):
+        before = self.client.get('/api/metrics/').data['processing_metrics']['files_processed']
+        documents = self.create(3)
+        documents[0].file.delete(save=False)
+        enqueue('bulk_statistics', owner=self.user, document_ids=[str(document.pk) for document in documents])
+        self.assertEqual(self.client.get('/api/metrics/').data['processing_metrics']['files_processed'], before + 2)
+
+    def test_truncated_tar_gz_is_rejected(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for i in range(3):
+                data = f'apple word{i} banana'.encode('utf-8') * 50
+                info = tarfile.TarInfo(f'doc{i}.txt')
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        data = buffer.getvalue()
+
+        response = self.client.post('/api/documents/bulk/', {'archive': SimpleUploadedFile('corpus.tar.gz', data[:-30])})
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Document.objects.exists())
+
+        response = self.client.post('/api/documents/bulk/', {'archive': SimpleUploadedFile('corpus.tar.gz', data)})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['documents_created'], 3)
+
+    def test_lookups_are_batched(self):
+        collection = self.create_collection()
+        documents = self.create(5, collection)
+        document_ids = [str(document.pk) for document in documents]
+        enqueue('bulk_statistics', owner=self.user, document_ids=document_ids)
+        expected = dict(Statistics.objects.values_list('document_id', 'tfidf'))
+
+        with mock.patch('api.utils.BULK_BATCH_SIZE', 2):
+            job = enqueue('bulk_statistics', owner=self.user, document_ids=document_ids)
+        self.assertEqual((job.status, job.error), (Job.DONE, ''))
+        # пачки по два документа дают ту же статистику, что и один запрос на всю пачку
+        self.assertEqual(dict(Statistics.objects.values_list('document_id', 'tfidf')), expected)
+        self.assertEqual(len(expected), 5)
+
+
+class SimilarDocumentsTests(APITestCase):
+    TEXT = ' '.join(f'word{i}' for i in range(200))
+
+    def test_signatures_are_computed_lazily(self):
+        document = self.upload(self.TEXT)
+        duplicate = self.upload(self.TEXT + ' extra')
+        other = self.upload(' '.join(f'other{i}' for i in range(200)))
+        # документы, загруженные до появления подписей
+        DocumentSignature.objects.all().delete()
+
+        response = self.client.get(f'/api/documents/{document.pk}/similar')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([row['id'] for row in response.data], [duplicate.pk])
+        # подпись посчитана для самого документа и кандидата, остальные документы владельца не тронуты
+        self.assertEqual(
+            set(DocumentSignature.objects.values_list('document_id', flat=True)), {document.pk, duplicate.pk}
+        )
+        self.assertFalse(DocumentSignature.objects.filter(document=other).exists())
+
+
+class CollectionModelTests(APITestCase):
+    def test_long_token_does_not_inflate_vocabulary(self):
+        collection = self.create_collection()
+        long_word = 'z' * 5000
+        for text in [f'apple {long_word}'] + [f'apple banana word{i} тест{i}' for i in range(50)]:
+            self.client.post(f'/api/collections/{collection.pk}/{self.upload(text).pk}/')
+
+        response = self.client.post(f'/api/collections/{collection.pk}/score', {'text': f'тест1 banana {long_word}'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual({row['word'] for row in response.data['data']}, {'тест1', 'banana', long_word})
+
+        entry = CollectionModel.objects.get(collection=collection)
+        vocabulary = [name for name in os.listdir(entry.path) if name.startswith('vocabulary')]
+        size = sum(os.path.getsize(os.path.join(entry.path, name)) for name in vocabulary)
+        # строками фиксированной ширины вышло бы 103 слова по 5000 символов UCS-4 — около 2 МБ
+        self.assertLess(size, 10 * 1024)
+
+
+    def collection_with_documents(self):
+        collection = self.create_collection()
+        for text in ('apple banana', 'apple kiwi'):
+            add_document_to_collection(collection, self.upload(text))
+        return collection
+
+    def test_orphan_version_directory_is_replaced(self):
+        collection = self.collection_with_documents()
+        # каталог v1 остался от процесса, который умер до записи CollectionModel
+        orphan = collection_model_path(collection.pk, 1)
+        os.makedirs(orphan)
+        with open(os.path.join(orphan, 'vocabulary_utf8.npy'), 'wb') as f:
+            f.write(b'garbage')
+
+        response = self.client.post(f'/api/collections/{collection.pk}/score', {'text': 'kiwi'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(CollectionModel.objects.get(collection=collection).path, orphan)
+
+    def test_failed_registration_removes_artifacts(self):
+        collection = self.collection_with_documents()
+        with mock.patch.object(CollectionModel.objects, 'create', side_effect=RuntimeError('db is gone')):
+            with self.assertRaises(RuntimeError):
+                build_collection_model(collection)
+        self.assertFalse(os.path.exists(collection_model_path(collection.pk, 1)))
+        self.assertEqual(build_collection_model(collection).version, 1)
+
+
+class ListPaginationTests(APITestCase):
+    def test_pages_follow_created_index(self):
+        documents = [self.upload(f'text {i}', f'doc{i}.txt') for i in range(5)]
+        response = self.client.get('/api/documents/', {'page_size': 2})
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, [str(document.pk) for document in reversed(documents)])
+
+        plan = Document.objects.filter(owner=self.user).order_by('-created_at', '-pk')[:2].explain()
+        # страница читается по индексу (owner, -created_at, -id), без сортировки во временном B-дереве
+        self.assertIn('api_documen_owner_i_5bc035_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_collection_pages_follow_created_index(self):
+        collections = [self.create_collection(f'c{i}') for i in range(5)]
+        add_document_to_collection(collections[4], self.upload('apple banana'))
+        add_document_to_collection(collections[4], self.upload('kiwi apple'))
+        response = self.client.get('/api/collections/', {'page_size': 2})
+        self.assertEqual([row['documents_total'] for row in response.data['results']], [2, 0])
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, [collection.pk for collection in reversed(collections)])
+
+        request = mock.Mock(user=self.user, query_params={})
+        plan = collections_queryset(request).order_by('-created_at', '-pk')[:2].explain()
+        self.assertIn('api_collect_owner_i_9f250d_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class CollectionStatisticsCacheTests(APITestCase):
+    def test_cache_hit_does_not_query_documents(self):
+        collection = self.create_collection()
+        add_document_to_collection(collection, self.upload('apple banana'))
+        collection.refresh_from_db()
+        first = cached_collection_statistics(collection, k=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_collection_statistics(collection, k=5), first)
+
+        add_document_to_collection(collection, self.upload('kiwi apple'))
+        collection.refresh_from_db()
+        # новая версия коллекции — новый ключ, результат пересчитан по новому составу
+        words = {row['word'] for row in cached_collection_statistics(collection, k=5)}
+        self.assertIn('kiwi', words)
+
+
+
+class CollectionVersionTests(APITestCase):
+    def statistics(self, collection):
+        with mock.patch('api.utils.calculate_collection_statistics', wraps=calculate_collection_statistics) as calculate:
+            response = self.client.get(f'/api/collections/{collection.pk}/statistics/')
+        self.assertEqual(response.status_code, 200)
+        return response.data, calculate.call_count
+
+    def test_burst_of_changes_costs_one_computation(self):
+        collection = self.create_collection()
+        documents = [self.upload(f'apple word{i}') for i in range(10)]
+        for document in documents:
+            self.client.post(f'/api/collections/{collection.pk}/{document.pk}/')
+        self.client.delete(f'/api/collections/{collection.pk}/{documents[0].pk}/delete/')
+        # изменения только поднимают версию, статистика не считается, пока ее не прочитают
+        self.assertEqual(Collection.objects.get(pk=collection.pk).version, 11)
+        self.assertFalse(Statistics.objects.filter(collection=collection).exists())
+
+        data, calculations = self.statistics(collection)
+        self.assertEqual(calculations, 1)
+        self.assertNotIn('word0', [row['word'] for row in data['data']])
+        self.assertEqual(Statistics.objects.get(collection=collection).version, 11)
+        self.assertEqual(self.statistics(collection), (data, 0))
+
+        self.client.post(f'/api/collections/{collection.pk}/{documents[0].pk}/')
+        data, calculations = self.statistics(collection)
+        self.assertEqual(calculations, 1)
+        self.assertIn('word0', [row['word'] for row in data['data']])
+
+class DocumentStatisticsTests(APITestCase):
+    def test_default_and_custom_k_use_the_same_corpus(self):
+        collection = self.create_collection()
+        document = self.upload(' '.join(f'word{i}' for i in range(60)) + ' apple')
+        self.client.post(f'/api/collections/{collection.pk}/{document.pk}/')
+        self.client.post(f'/api/collections/{collection.pk}/{self.upload("apple banana").pk}/')
+
+        default = self.client.get(f'/api/documents/{document.pk}/statistics').data
+        custom = self.client.get(f'/api/documents/{document.pk}/statistics', {'k': 49}).data
+        self.assertEqual(len(default), 50)
+        self.assertEqual(default[:49], custom)
+        # idf посчитан по коллекции из двух документов, а не по одному документу на момент загрузки
+        idf = {row['word']: row['idf'] for row in custom}
+        self.assertEqual(idf['apple'], 1.0)
+        self.assertGreater(idf['word0'], 1.0)
+
+
+    def test_full_vector_ignores_k(self):
+        document = self.upload('apple banana banana kiwi')
+        response = self.client.get(f'/api/documents/{document.pk}/statistics', {'k': 1, 'full': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'apple', 'banana', 'kiwi'})
+        self.assertGreater(response.data['banana'], response.data['apple'])
+
+
+class BuildStatisticsTests(TestCase):
+    WORDS = ['d', 'c', 'b', 'a', 'e']
+    TFIDF = [0.3, 0.1, 0.2, 0.1, 0.5]
+
+    def ranking(self, **options):
+        return [row['word'] for row in build_statistics(self.WORDS, [2.0] * 5, self.TFIDF, **options)]
+
+    def test_top_k_matches_full_sort(self):
+        self.assertEqual(self.ranking(k=None), ['a', 'c', 'b', 'd', 'e'])
+        self.assertEqual(self.ranking(k=None, order='desc'), ['e', 'd', 'b', 'a', 'c'])
+        for k in range(1, 6):
+            self.assertEqual(self.ranking(k=k), self.ranking(k=None)[:k])
+            self.assertEqual(self.ranking(k=k, order='desc'), self.ranking(k=None, order='desc')[:k])
+
+    def test_ties_at_the_boundary_are_ordered_by_word(self):
+        # у a и c одинаковый tfidf: в top-1 попадает a, где бы argpartition ни оставил c
+        self.assertEqual(self.ranking(k=1), ['a'])
+        row = build_statistics(self.WORDS, [2.0] * 5, self.TFIDF, k=1)[0]
+        self.assertEqual(row, {'word': 'a', 'tf': 0.05, 'idf': 2.0, 'tfidf': 0.1})
+
+
+class ColumnarStatisticsTests(APITestCase):
+    ROWS = [
+        {'word': 'apple', 'tf': 0.25, 'idf': 1.5, 'tfidf': 0.375},
+        {'word': 'привет', 'tf': 0.1, 'idf': 2.0, 'tfidf': 0.2},
+    ]
+
+    def test_columns_round_trip(self):
+        document = self.upload('apple')
+        Statistics.objects.update_or_create(document=document, defaults=Statistics.columns(self.ROWS))
+        self.assertEqual(len(Statistics.objects.get(document=document).term_ids), 2 * 4)
+
+        statistics = Statistics.objects.get(document=document)
+        # слова подтягиваются одним запросом при первом обращении к data, дальше берутся из объекта
+        with self.assertNumQueries(1):
+            data = statistics.data
+            self.assertEqual(statistics.data, data)
+        self.assertEqual([row['word'] for row in data], ['apple', 'привет'])
+        for row, expected in zip(data, self.ROWS):
+            for field in ('tf', 'idf', 'tfidf'):
+                # float32: точность около 7 значащих цифр
+                self.assertAlmostEqual(row[field], expected[field], places=6)
+
+    def test_words_are_shared_between_statistics(self):
+        first, second = self.upload('apple'), self.upload('apple')
+        for document in (first, second):
+            Statistics.objects.update_or_create(document=document, defaults=Statistics.columns(self.ROWS))
+        self.assertEqual(Term.objects.filter(text__in=['apple', 'привет']).count(), 2)
+        self.assertEqual(Statistics.objects.get(document=first).term_ids, Statistics.objects.get(document=second).term_ids)
+
+    def test_single_owner_constraint(self):
+        document = self.upload('apple')
+        collection = self.create_collection()
+        for owners in ({}, {'document': document, 'collection': collection}):
+            with self.subTest(owners=owners), self.assertRaises(IntegrityError), transaction.atomic():
+                Statistics.objects.create(**owners)
+        Statistics.objects.filter(document=document).delete()
+        Statistics.objects.create(document=document)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Statistics.objects.create(document=document)
+
+class TextCacheTests(APITestCase):
+    def test_metadata_saved_on_upload(self):
+        text = 'привет мир\r\nhello'
+        document = self.upload(text)
+        data = text.encode('utf-8')
+        self.assertEqual(
+            (document.size, document.char_count, document.token_count, document.content_hash),
+            (len(data), len(text) - 1, 3, hashlib.sha256(data).hexdigest())
+        )
+        row = self.client.get('/api/documents/').data['results'][0]
+        self.assertEqual((row['size'], row['token_count']), (len(data), 3))
+        self.assertNotIn('content', row)
+
+    def test_byte_lru_evicts_by_size(self):
+        cache = ByteLRUCache(10)
+        cache.set('a', 'aaaa', 4)
+        cache.set('b', 'bbbb', 4)
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.set('c', 'cccc', 4)
+        # вытесняется давно не читанный b, а не первый записанный a
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('aaaa', 'cccc'))
+        cache.set('huge', 'x' * 11, 11)
+        self.assertIsNone(cache.get('huge'))
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_deleted_document_leaves_cache(self):
+        document = self.upload('apple banana')
+        self.assertEqual(document.content, 'apple banana')
+        key = (document.pk, document.file.name)
+        self.assertIsNotNone(text_cache.get(key))
+        self.assertEqual(self.client.delete(f'/api/documents/{document.pk}').status_code, 204)
+        self.assertIsNone(text_cache.get(key))
+
+    def test_cache_counters_in_metrics(self):
+        document = self.upload('apple banana kiwi')
+        before = self.client.get('/api/metrics/').data['text_cache']
+        for _ in range(3):
+            response = self.client.get(f'/api/documents/{document.pk}', {'expand': 'content'})
+            self.assertEqual(response.data['content'], 'apple banana kiwi')
+        after = self.client.get('/api/metrics/').data['text_cache']
+        # первое чтение могло попасть в кэш, заполненный при загрузке; остальные — попадания
+        self.assertEqual((after['hits'] + after['misses']) - (before['hits'] + before['misses']), 3)
+        self.assertGreaterEqual(after['hits'] - before['hits'], 2)
+        self.assertGreaterEqual(after['bytes'], len('apple banana kiwi'))
+
+
+class HuffmanTests(APITestCase):
+    TEXT = 'абракадабра, hello 世界!\n' + ''.join(chr(0x4e00 + i) for i in range(3000))
+
+    def test_text_mode(self):
+        document = self.upload('abracadabra')
+        response = self.client.get(f'/api/documents/{document.pk}/huffman/')
+        self.assertEqual(response.status_code, 200)
+        codes = response.data['codes']
+        self.assertEqual(''.join(codes[ch] for ch in 'abracadabra'), response.data['encoded'])
+
+    def test_binary_round_trip(self):
+        document = self.upload(self.TEXT)
+        result = self.client.get(f'/api/documents/{document.pk}/huffman/', {'mode': 'binary'}).json()
+        response = self.client.post('/api/huffman/decode/', {
+            'encoded': result['encoded'], 'padding': result['padding'], 'lengths': result['lengths'],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['text'], self.TEXT)
+
+    def test_raw_round_trip_with_large_alphabet(self):
+        document = self.upload(self.TEXT)
+        response = self.client.get(f'/api/documents/{document.pk}/huffman/', {'mode': 'raw'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        # таблица на тысячи символов — в теле, заголовки остаются короткими
+        self.assertNotIn('X-Huffman-Lengths', response)
+        self.assertLess(sum(len(value) for _, value in response.items()), 1024)
+
+        response = self.client.post('/api/huffman/decode/', response.content, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['text'], self.TEXT)
+
+    def test_bad_decode_input(self):
+        lengths = [['a', 1], ['b', 1]]
+        cases = [
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [['a', True], ['b', 1]]},
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [['a', 0], ['b', 1]]},
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [['ab', 1], ['b', 1]]},
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [[1, 1], ['b', 1]]},
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [['a', 1, 2]]},
+            {'encoded': 'QA==', 'padding': 0, 'lengths': [['a', 1], ['b', 1], ['c', 1]]},
+            {'encoded': 'not base64!', 'padding': 0, 'lengths': lengths},
+            {'encoded': 'QA==', 'padding': 8, 'lengths': lengths},
+        ]
+        for data in cases:
+            with self.subTest(data=data):
+                response = self.client.post('/api/huffman/decode/', data, format='json')
+                self.assertEqual(response.status_code, 400, response.content)
+
+        for body in (b'', b'\x00\x00\x00\x10{}', b'\x00\x00\x00\x02[]', b'\x00\x00\x00\x02{}\x40'):
+            with self.subTest(body=body):
+                response = self.client.post('/api/huffman/decode/', body, content_type='application/octet-stream')
+                self.assertEqual(response.status_code, 400, response.content)
+
+    def test_space_and_newline_symbols(self):
+        response = self.client.post('/api/huffman/decode/', {
+            'encoded': 'QA==', 'padding': 6, 'lengths': [[' ', 1], ['\n', 1]],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['text'], '\n ')
+
+
+class CanonicalHuffmanTests(APITestCase):
+    def optimal_cost(self, freq):
+        '''Длина кода всего текста у любого дерева Хаффмана — сумма весов внутренних узлов'''
+        heap = list(freq.values())
+        heapq.heapify(heap)
+        cost = 0
+        while len(heap) > 1:
+            merged = heapq.heappop(heap) + heapq.heappop(heap)
+            cost += merged
+            heapq.heappush(heap, merged)
+        return cost
+
+    def test_lengths_are_optimal(self):
+        for text in ('abracadabra', 'aaaaaaaab', 'the quick brown fox jumps over the lazy dog', 'абв' * 7 + 'г'):
+            with self.subTest(text=text):
+                freq = Counter(text)
+                lengths = huffman_code_lengths(freq)
+                self.assertEqual(sum(freq[symbol] * lengths[symbol] for symbol in freq), self.optimal_cost(freq))
+
+    def test_codes_are_canonical(self):
+        result = huffman('abracadabra')
+        codes = result['codes']
+        ordered = sorted(codes, key=lambda symbol: (len(codes[symbol]), symbol))
+        # соседние по (длина, символ) коды идут подряд: следующий = (предыдущий + 1) << разница длин
+        for prev, symbol in zip(ordered, ordered[1:]):
+            expected = (int(codes[prev], 2) + 1) << (len(codes[symbol]) - len(codes[prev]))
+            self.assertEqual(int(codes[symbol], 2), expected)
+        self.assertEqual(codes[ordered[0]], '0' * len(codes[ordered[0]]))
+        self.assertEqual(sum(2 ** -len(code) for code in codes.values()), 1)
+        self.assertEqual(result['encoded'], ''.join(codes[ch] for ch in 'abracadabra'))
+
+    def test_single_symbol_and_deep_tree(self):
+        self.assertEqual(huffman('aaaa'), {'encoded': '0000', 'codes': {'a': '0'}})
+        # частоты Фибоначчи дают дерево-«лесенку»: глубина равна числу символов без одного, рекурсии нет
+        fib = [1, 1]
+        while len(fib) < 1200:
+            fib.append(fib[-1] + fib[-2])
+        lengths = huffman_code_lengths({chr(0x4e00 + i): f for i, f in enumerate(fib)})
+        self.assertEqual(max(lengths.values()), len(fib) - 1)
+        self.assertEqual(len(set(canonical_codes(lengths).values())), len(fib))
+
+    def test_invalid_lengths(self):
+        for lengths in ({'a': 1, 'b': 1, 'c': 1}, {'a': 0, 'b': 1}):
+            with self.subTest(lengths=lengths), self.assertRaises(ValueError):
+                canonical_codes(lengths)
+
+
+class LatencyHistogramTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        self.path = os.path.join(tmpdir, 'test.hist')
+        self.histogram = LatencyHistogram(self.path)
+
+    def test_percentiles_within_bucket_precision(self):
+        for i in range(1, 1001):
+            self.histogram.record(i / 1000)
+        stats = self.histogram.snapshot()
+        self.assertEqual((stats['count'], stats['total_count']), (1000, 1000))
+        self.assertAlmostEqual(stats['sum'], 500.5)
+        self.assertEqual((stats['min'], stats['max']), (0.001, 1.0))
+        for name, expected in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            # корзины растут в 1.1 раза: оценка — не ниже точного значения и не больше чем на 10% выше
+            self.assertGreaterEqual(stats[name], expected)
+            self.assertLessEqual(stats[name], expected * 1.1)
+        self.assertEqual(os.path.getsize(self.path), FILE_SIZE)
+
+    def test_window(self):
+        now = time.time()
+        self.histogram.record(5.0, timestamp=now - 30 * 60)
+        self.histogram.record(0.2, timestamp=now)
+        self.histogram.record(0.4, timestamp=now)
+        # минута, ушедшая за пределы кольца, в окно не попадает, но в счетчике за все время остается
+        self.histogram.record(100.0, timestamp=now - SLOTS * SLOT_SECONDS - 60)
+
+        recent = self.histogram.snapshot(window=60)
+        self.assertEqual((recent['count'], recent['max'], recent['total_count']), (2, 0.4, 4))
+        full = self.histogram.snapshot()
+        self.assertEqual((full['count'], full['max'], full['total_max']), (3, 5.0, 100.0))
+
+    def test_shared_between_processes(self):
+        self.histogram.record(0.1)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                LatencyHistogram(self.path).record(0.3)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.histogram.snapshot()['count'], 2)
+
+
+class MetricsWindowTests(APITestCase):
+    def test_window_parameter(self):
+        before = self.client.get('/api/metrics/', {'window': 60}).data['processing_metrics']
+        self.upload('apple banana')
+        data = self.client.get('/api/metrics/', {'window': 60}).data['processing_metrics']
+        self.assertEqual(data['window_seconds'], 60)
+        self.assertEqual(data['files_in_window'] - before['files_in_window'], 1)
+        self.assertEqual(data['files_processed'] - before['files_processed'], 1)
+        self.assertEqual(self.client.get('/api/metrics/', {'window': 'hour'}).status_code, 400)
+
+
+class ServerTimingTests(APITestCase):
+    def test_header_lists_request_stages(self):
+        document = self.upload('abracadabra')
+        response = self.client.get(f'/api/documents/{document.pk}/huffman/')
+        stages = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertIn('huffman.codebook', stages)
+        self.assertRegex(stages['total'], r'^dur=\d+\.\d{3}$')
+        self.assertIn('huffman.codebook', self.client.get('/api/metrics/').data['stage_metrics'])
+
+    def test_repeated_stages_are_merged(self):
+        header = server_timing_header([('rank', 0.001), ('load', 0.002), ('rank', 0.003)], 0.01)
+        self.assertEqual(header, 'rank;dur=4.000;desc="x2", load;dur=2.000, total;dur=10.000')
+
+    def test_sampled_profile_is_dumped(self):
+        profile_dir = f'{self.tmpdir}/profiles'
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=profile_dir):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        self.assertEqual([name.endswith('-GET-api_metrics.prof') for name in os.listdir(profile_dir)], [True])
+
+
+class BenchmarkTests(APITestCase):
+    def result(self, ops_per_second, peak_memory_mb):
+        return {'ops_per_second': ops_per_second, 'peak_memory_mb': peak_memory_mb}
+
+    def test_corpus_is_deterministic(self):
+        options = {'documents': 6, 'words_per_document': 40, 'vocabulary': 50, 'language': 'mixed'}
+        corpus = generate_corpus(**options, seed=1)
+        self.assertEqual(corpus, generate_corpus(**options, seed=1))
+        self.assertNotEqual(corpus, generate_corpus(**options, seed=2))
+        self.assertEqual([name[:2] for name, _ in corpus], ['en', 'ru'] * 3)
+        with self.assertRaises(ValueError):
+            generate_corpus(language='de')
+
+    def test_skew_follows_zipf(self):
+        def frequencies(skew):
+            corpus = generate_corpus(documents=20, words_per_document=500, vocabulary=200, skew=skew, language='ru')
+            return Counter(word for _, text in corpus for word in text.replace('.', ' ').split()).most_common()
+
+        skewed, uniform = frequencies(1.5), frequencies(0)
+        # при skew=1.5 самое частое слово — первое служебное, и оно встречается примерно в 2^1.5 раз чаще второго
+        self.assertEqual(skewed[0][0], 'и')
+        self.assertAlmostEqual(skewed[0][1] / skewed[1][1], 2 ** 1.5, delta=0.5)
+        self.assertLess(uniform[0][1] / uniform[-1][1], skewed[0][1] / skewed[-1][1])
+
+    def test_compare_results_thresholds(self):
+        baseline = {'benchmarks': {'a': self.result(100, 10), 'b': self.result(100, 10), 'c': self.result(100, 10)}}
+        current = {'benchmarks': {
+            'a': self.result(81, 12),  # в пределах 20%
+            'b': self.result(79, 12.1),  # ниже порога по скорости, память в пределах шума
+            'c': self.result(100, 12.2),
+            'new': self.result(1, 100),  # нет в базовых результатах
+        }}
+        self.assertEqual(compare_results(baseline, current), [
+            ('b', 'ops_per_second', 100, 79),
+            ('c', 'peak_memory_mb', 10, 12.2),
+        ])
+        self.assertEqual(compare_results(baseline, current, throughput_threshold=0.25, memory_threshold=0.25), [])
+
+    def test_run_and_compare_saved_results(self):
+        options = {'documents': 4, 'words_per_document': 30, 'vocabulary': 40, 'skew': 1.0, 'language': 'en', 'seed': 0}
+        results = run_benchmarks(options, names=['compute_tfidf', 'huffman'], repeat=1)
+        self.assertEqual(set(results['benchmarks']), {'compute_tfidf', 'huffman'})
+        self.assertGreater(results['benchmarks']['huffman']['ops_per_second'], 0)
+
+        baseline, current = f'{self.tmpdir}/baseline.json', f'{self.tmpdir}/current.json'
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        huffman_result = results['benchmarks']['huffman']
+        slower = {**huffman_result, 'ops_per_second': huffman_result['ops_per_second'] / 2}
+        with open(current, 'w') as f:
+            json.dump({**results, 'benchmarks': {**results['benchmarks'], 'huffman': slower}}, f)
+
+        stdout = io.StringIO()
+        call_command('benchmark', compare=baseline, results=baseline, stdout=stdout)
+        self.assertIn('Регрессий нет', stdout.getvalue())
+        with self.assertRaisesMessage(CommandError, 'Регрессий: 1'):
+            call_command('benchmark', compare=baseline, results=current, stdout=io.StringIO(), stderr=io.StringIO())
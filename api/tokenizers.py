@@ -0,0 +1,104 @@
+import codecs
+import hashlib
+import re
+from collections import Counter
+
+CHUNK_SIZE = 64 * 1024
+# если в буфере нет пробелов, дольше этого хвост не копится (защита от «бесконечного» слова)
+MAX_TAIL = 1024 * 1024
+
+WORD_RE = re.compile(r'\b\w+\b')
+
+
+class HashingReader:
+    '''Обертка над бинарным файлом: считает прочитанные байты и sha256 по ходу чтения'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def iter_text_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    '''Читает бинарный файл кусками и отдает текст в UTF-8.
+    Многобайтные символы на границе кусков собирает инкрементальный декодер,
+    переводы строк приводятся к \\n, как при open(..., 'r').
+    Байты не в UTF-8 (cp1251, бинарные файлы) заменяются на U+FFFD: индексация не падает на кодировке'''
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    carry = ''
+    while True:
+        data = fileobj.read(chunk_size)
+        if isinstance(data, str):
+            text = carry + data
+        else:
+            text = carry + decoder.decode(data, final=not data)
+        carry = ''
+        if data and text.endswith('\r'):
+            # \r\n мог разорваться между кусками
+            carry, text = '\r', text[:-1]
+        if text:
+            yield text.replace('\r\n', '\n').replace('\r', '\n')
+        if not data:
+            return
+
+
+def _is_token_char(char):
+    return char.isalnum() or char in "_'"
+
+
+def _split_point(buffer):
+    '''Позиция, до которой в буфере нет незаконченных слов'''
+    for i in range(len(buffer) - 1, -1, -1):
+        if buffer[i].isspace():
+            return i + 1
+    if len(buffer) <= MAX_TAIL:
+        return 0
+    # очень длинный текст без пробелов режем по знаку препинания
+    # (lower() для греческой сигмы перед ним может дать другую форму)
+    for i in range(len(buffer) - 1, -1, -1):
+        if not _is_token_char(buffer[i]):
+            return i + 1
+    return len(buffer)
+
+
+def iter_tokens(chunks, pattern=WORD_RE):
+    '''Токены в нижнем регистре из потока кусков текста.
+    Кусок режется по последнему пробелу, хвост переносится в следующий —
+    так слова на границе кусков не рвутся, а в памяти никогда нет всего текста'''
+    tail = ''
+    for chunk in chunks:
+        buffer = tail + chunk
+        cut = _split_point(buffer)
+        tail = buffer[cut:]
+        if cut:
+            yield from pattern.findall(buffer[:cut].lower())
+    if tail:
+        yield from pattern.findall(tail.lower())
+
+
+def count_tokens(fileobj, pattern=WORD_RE, chunk_size=CHUNK_SIZE, minhash=None):
+    '''Частоты слов файла без загрузки всего текста. Возвращает (Counter, число символов).
+    Если передан minhash (api.minhash.MinHasher), он получает те же токены за тот же проход'''
+    counts = Counter()
+    chars = 0
+
+    def counted(chunks):
+        nonlocal chars
+        for chunk in chunks:
+            chars += len(chunk)
+            yield chunk
+
+    tokens = iter_tokens(counted(iter_text_chunks(fileobj, chunk_size)), pattern)
+    if minhash is not None:
+        tokens = minhash.consume(tokens)
+    counts.update(tokens)
+    return counts, chars
@@ -0,0 +1,140 @@
+import contextvars
+import cProfile
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import histogram
+
+STAGE_PREFIX = 'stage.'
+
+# тайминги текущего запроса; None — вне запроса (воркер очереди, manage.py)
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+@contextmanager
+def span(name):
+    '''Замер этапа: попадает в заголовок Server-Timing текущего запроса
+    и в общую гистограмму этапа (видна в /metrics/)'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+        histogram(STAGE_PREFIX + name).record(duration)
+
+
+def traced(name):
+    '''span в виде декоратора'''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage_names():
+    try:
+        files = os.listdir(settings.METRICS_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        name[len(STAGE_PREFIX):-len('.hist')]
+        for name in files if name.startswith(STAGE_PREFIX) and name.endswith('.hist')
+    )
+
+
+def get_stage_metrics(window=None):
+    '''Время по этапам со всех процессов, в миллисекундах'''
+    result = {}
+    for name in stage_names():
+        stats = histogram(STAGE_PREFIX + name).snapshot(window)
+        if not stats['count']:
+            continue
+        result[name] = {
+            'count': stats['count'],
+            'avg_ms': round(stats['sum'] / stats['count'] * 1000, 3),
+            'p50_ms': round(stats['p50'] * 1000, 3),
+            'p90_ms': round(stats['p90'] * 1000, 3),
+            'p99_ms': round(stats['p99'] * 1000, 3),
+            'max_ms': round(stats['max'] * 1000, 3),
+        }
+    return result
+
+
+def server_timing_header(timings, total):
+    # одинаковые этапы (например, rank для каждого документа) суммируются
+    merged = {}
+    for name, duration in timings:
+        count, summed = merged.get(name, (0, 0.0))
+        merged[name] = (count + 1, summed + duration)
+    parts = [
+        f'{name};dur={summed * 1000:.3f}' + (f';desc="x{count}"' if count > 1 else '')
+        for name, (count, summed) in merged.items()
+    ]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+class ServerTimingMiddleware:
+    '''Собирает span-ы запроса в заголовок Server-Timing.
+    С вероятностью PROFILE_SAMPLE_RATE запрос профилируется cProfile, дамп пишется в PROFILE_DIR.
+    Работает и под WSGI, и под ASGI: в async-режиме не заставляет Django переводить цепочку в поток'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _timings.set([])
+        profiler = None
+        if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+            total = time.perf_counter() - start
+            response['Server-Timing'] = server_timing_header(_timings.get(), total)
+        finally:
+            _timings.reset(token)
+        if profiler is not None:
+            self.dump_profile(profiler, request)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile здесь не используется: в event loop он записал бы и чужие запросы.
+        # span-ы из sync_to_async попадают в тот же список — контекст копируется в поток
+        token = _timings.set([])
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            total = time.perf_counter() - start
+            response['Server-Timing'] = server_timing_header(_timings.get(), total)
+        finally:
+            _timings.reset(token)
+        return response
+
+    def dump_profile(self, profiler, request):
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        path = re.sub(r'[^\w-]+', '_', request.path).strip('_') or 'root'
+        filename = f'{int(time.time() * 1000)}-{os.getpid()}-{request.method}-{path}.prof'
+        profiler.dump_stats(os.path.join(settings.PROFILE_DIR, filename))
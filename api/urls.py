@@ -1,8 +1,8 @@
 from django.urls import path
 from .views import (getData, RegisterView, LoginView, LogoutView, ChangePasswordView, DeleteUserView,
-    DocumentListCreateView, DocumentDetailView, DocumentStatisticsView,
-    CollectionListView, CollectionDetailView, CollectionStatisticsView,
-    AddDocumentToCollectionView, RemoveDocumentFromCollectionView, HuffmanAPIView, MetricsView, getVersion)
+    DocumentListCreateView, DocumentBulkUploadView, DocumentDetailView, DocumentStatisticsView, DocumentSimilarView,
+    CollectionListView, CollectionDetailView, CollectionStatisticsView, CollectionSearchView, CollectionDuplicatesView, CollectionScoreView,
+    AddDocumentToCollectionView, RemoveDocumentFromCollectionView, HuffmanAPIView, MetricsView, JobDetailView, HuffmanDecodeView, getVersion)
 
 urlpatterns = [
     ##### Пути для статистики и прочего #####
@@ -13,14 +13,20 @@ urlpatterns = [
     ##### Пути для работы с документами #####
     
     path('documents/', DocumentListCreateView.as_view() ), # выдает список документов загруженных пользователем
+    path('documents/bulk/', DocumentBulkUploadView.as_view() ), # много файлов или архив за один запрос
     path('documents/<uuid:doc_id>', DocumentDetailView.as_view() ), #выдаает содержимое документа и удаляет документ по медотду DELETE, текст внутри content
     path('documents/<uuid:doc_id>/statistics', DocumentStatisticsView.as_view() ),
+    path('documents/<uuid:doc_id>/similar', DocumentSimilarView.as_view() ), # почти-дубликаты документа
+    path('jobs/<int:pk>/', JobDetailView.as_view() ), # статус фоновой задачи подсчета статистики
 
     ##### Пути для работы с коллекциями #####
     
     path('collections/', CollectionListView.as_view()),
     path('collections/<int:pk>/', CollectionDetailView.as_view()),
     path('collections/<int:pk>/statistics/', CollectionStatisticsView.as_view()),
+    path('collections/<int:pk>/search', CollectionSearchView.as_view()), # поиск по обратному индексу, ?q=
+    path('collections/<int:pk>/duplicates', CollectionDuplicatesView.as_view()), # отчет о почти-дубликатах
+    path('collections/<int:pk>/score', CollectionScoreView.as_view()), # TF-IDF нового текста по модели коллекции
     path('collections/<int:pk>/<uuid:doc_id>/', AddDocumentToCollectionView.as_view()),
     path('collections/<int:pk>/<uuid:doc_id>/delete/', RemoveDocumentFromCollectionView.as_view()),
     
@@ -33,7 +39,8 @@ urlpatterns = [
     path('user/<int:user_id>/delete/', DeleteUserView.as_view(), name='delete-user'),
     
     ##### КОД ХАФМАНА
-    path('documents/<uuid:doc_id>/huffman/', HuffmanAPIView.as_view(), name='document-huffman')
+    path('documents/<uuid:doc_id>/huffman/', HuffmanAPIView.as_view(), name='document-huffman'),
+    path('huffman/decode/', HuffmanDecodeView.as_view(), name='huffman-decode'),
 
 ]
 
@@ -1,116 +1,1097 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from .models import Statistics
-
-def compute_tfidf(documents, target_document):
-    corpus = [doc.content.lower() for doc in documents]
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(corpus)
-    idf_values = dict(zip(vectorizer.get_feature_names_out(), vectorizer.idf_))
-
-    doc_index = documents.index(target_document)
-
-    tfidf_vector = tfidf_matrix[doc_index]
-    tfidf_data = tfidf_vector.tocoo()
-
-    statistics = []
-    for idx, tfidf_value in zip(tfidf_data.col, tfidf_data.data):
-        word = vectorizer.get_feature_names_out()[idx]
-        tf = tfidf_value / idf_values[word]  # tf = tfidf / idf
-        idf = idf_values[word]
-        
-        statistics.append({
-            'word': word,
-            'tf': tf,
-            'idf': idf,
-            'tfidf': tfidf_value
-        })
-
-    statistics = sorted(statistics, key=lambda x: x['tfidf'])[:50]
-    return statistics
+import heapq
+import json
+import os
+import shutil
+import struct
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from itertools import combinations
 
-def calculate_statistics(document):
-    collections = document.collections.all()
-    
-    if collections:
-        documents = set()
-        for collection in collections:
-            documents.update(collection.documents.all())
-        documents = list(documents)
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, Q
+from .cache import computing, get_or_compute
+from .lazy import lazy_import
+from .lru import text_cache
+from .minhash import MinHasher, band_buckets, similarity
+from .tokenizers import WORD_RE, HashingReader, count_tokens
+from .vectorizers import CollectionVectorizer, write_artifacts
+from .tracing import span, traced
+from .models import (Statistics, Document, DocumentTerms, DocumentSignature, LSHBucket, Collection,
+                     CollectionTerm, CollectionModel, Posting, Term, UserCorpusStats, UserWordCount)
+
+# NumPy, SciPy и scikit-learn импортируются при первом расчете, а не при старте процесса
+np = lazy_import('numpy')
+sparse = lazy_import('scipy.sparse')
+sklearn_text = lazy_import('sklearn.feature_extraction.text')
+
+# В DocumentTerms хранятся все слова документа (как в MetricsView). Для TF-IDF берутся
+# слова от двух символов — это ровно токены TfidfVectorizer c token_pattern по умолчанию.
+MIN_TERM_LENGTH = 2
+
+
+def index_document(document):
+    '''Токенизация документа, сохранение частот слов и метаданных текста (один раз при загрузке).
+    Файл читается потоком, кусками фиксированного размера'''
+    minhash = MinHasher()
+    with span('index.tokenize'), document.file.open('rb') as f:
+        reader = HashingReader(f)
+        counts, chars = count_tokens(reader, minhash=minhash)
+    total = sum(counts.values())
+    metadata = {
+        'size': reader.size,
+        'char_count': chars,
+        'token_count': total,
+        'content_hash': reader.hexdigest(),
+    }
+    with span('index.save'), transaction.atomic():
+        corpus = lock_user_corpus(document.owner_id)
+        previous = DocumentTerms.objects.filter(document=document).first()
+        if previous is not None and corpus.built:
+            # повторная индексация (например, повтор задачи) — сначала вычитаем старые частоты
+            previous_length = Document.objects.filter(pk=document.pk).values_list('char_count', flat=True).first()
+            update_user_corpus(corpus, previous.counts, previous_length or 0, -1)
+
+        # update(), чтобы не трогать updated_at
+        Document.objects.filter(pk=document.pk).update(**metadata)
+        for field, value in metadata.items():
+            setattr(document, field, value)
+
+        terms, _ = DocumentTerms.objects.update_or_create(
+            document=document,
+            defaults={'counts': dict(counts), 'total': total}
+        )
+        if corpus.built:
+            update_user_corpus(corpus, counts, chars, 1)
+        save_signature(document, minhash.signature())
+    return terms
+
+
+def get_term_counts(documents):
+    '''Сохраненные частоты слов документов; старые документы индексируются при первом обращении'''
+    with span('counts.load'):
+        stored = {}
+        for batch in batched(documents):
+            stored.update(DocumentTerms.objects.filter(document__in=batch).values_list('document_id', 'counts'))
+    result = []
+    for doc in documents:
+        counts = stored.get(doc.pk)
+        if counts is None:
+            counts = index_document(doc).counts
+        result.append(counts)
+    return result
+
+
+def build_count_matrix(term_counts):
+    vocabulary = sorted({
+        term for counts in term_counts for term in counts if len(term) >= MIN_TERM_LENGTH
+    })
+    index = {term: i for i, term in enumerate(vocabulary)}
+
+    indptr, indices, data = [0], [], []
+    for counts in term_counts:
+        for term, count in counts.items():
+            col = index.get(term)
+            if col is not None:
+                indices.append(col)
+                data.append(count)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(term_counts), len(vocabulary))
+    )
+    matrix.sort_indices()
+    return matrix, vocabulary
+
+
+# сколько слов хранится в Statistics и отдается по умолчанию
+STATISTICS_TOP_K = 50
+STATISTICS_ORDERS = ('asc', 'desc')
+
+
+@traced('tfidf.rank')
+def build_statistics(words, idf_values, tfidf_values, k=STATISTICS_TOP_K, order='asc'):
+    '''k слов с наименьшим (asc) или наибольшим (desc) tfidf, k=None — все слова.
+    argpartition отбирает кандидатов за O(n), сортируются и превращаются в словари только они'''
+    tfidf_values = np.asarray(tfidf_values, dtype=np.float64)
+    idf_values = np.asarray(idf_values, dtype=np.float64)
+    keys = tfidf_values if order == 'asc' else -tfidf_values
+
+    if k is not None and k < len(keys):
+        top = np.argpartition(keys, k - 1)[:k]
+        # слова с тем же tfidf, что у k-го, тоже кандидаты: между ними решает порядок по слову
+        candidates = np.flatnonzero(keys <= keys[top].max())
     else:
-        documents = [document]
+        candidates = np.arange(len(keys))
+
+    # при равных tfidf порядок по слову, чтобы не зависеть от порядка ключей в JSON
+    ranked = sorted(candidates.tolist(), key=lambda i: (keys[i], words[i]))[:k]
+    return [
+        {
+            'word': words[i],
+            'tf': float(tfidf_values[i] / idf_values[i]),  # tf = tfidf / idf
+            'idf': float(idf_values[i]),
+            'tfidf': float(tfidf_values[i])
+        }
+        for i in ranked
+    ]
+
+
+def tfidf_vector(words, tfidf_values):
+    '''Полный разреженный вектор: все ненулевые слова с их tfidf'''
+    return dict(zip(words, np.asarray(tfidf_values, dtype=np.float64).tolist()))
+
+
+def select_statistics(words, idf_values, tfidf_values, k=STATISTICS_TOP_K, order='asc', full=False):
+    '''Выборка по параметрам запроса: полный вектор или top-k'''
+    if full:
+        return tfidf_vector(words, tfidf_values)
+    return build_statistics(words, idf_values, tfidf_values, k=k, order=order)
+
+
+def fit_tfidf(term_counts):
+    '''TF-IDF всего корпуса: (матрица, словарь, idf)'''
+    with span('tfidf.matrix'):
+        counts_matrix, vocabulary = build_count_matrix(term_counts)
+    if not vocabulary:
+        # в документах нет слов от двух символов — TfidfTransformer на пустом словаре падает
+        return counts_matrix, vocabulary, np.zeros(0)
+    with span('tfidf.fit'):
+        transformer = sklearn_text.TfidfTransformer()
+        tfidf_matrix = transformer.fit_transform(counts_matrix)
+    return tfidf_matrix, vocabulary, transformer.idf_
+
+
+def matrix_row(tfidf_matrix, vocabulary, idf_values, index):
+    '''Ненулевые элементы строки index: (слова, idf, tfidf)'''
+    row = tfidf_matrix[index]
+    return [vocabulary[idx] for idx in row.indices], idf_values[row.indices], row.data
+
+
+def tfidf_row(term_counts, target_index):
+    '''Ненулевые элементы строки TF-IDF документа target_index: (слова, idf, tfidf)'''
+    return matrix_row(*fit_tfidf(term_counts), target_index)
+
+
+def compute_tfidf(term_counts, target_index, k=STATISTICS_TOP_K, order='asc'):
+    '''TF-IDF документа target_index по сохраненным частотам слов корпуса'''
+    return build_statistics(*tfidf_row(term_counts, target_index), k=k, order=order)
+
+
+def statistics_corpus(document):
+    '''Документы, по которым считается idf: все коллекции документа или он сам'''
+    documents = set()
+    for collection in document.collections.all():
+        documents.update(collection.documents.all())
+    return list(documents) if documents else [document]
+
+
+def document_tfidf(document):
+    '''(слова, idf, tfidf) документа по текущему составу его коллекций — для /documents/<id>/statistics.
+    Документ одной коллекции берется из сохраненной модели коллекции без обучения'''
+    collections = list(document.collections.all()[:2])
+    if len(collections) == 1:
+        model = get_collection_model(collections[0])
+        row = model.document_row(document.pk) if model is not None else None
+        if row is not None:
+            columns, values = row
+            return model.vocabulary.terms(columns), model.idf[columns], values
+    documents = statistics_corpus(document)
+    return tfidf_row(get_term_counts(documents), documents.index(document))
+
+def calculate_statistics(document):
+    index_document(document)
+    documents = statistics_corpus(document)
+
+    statistics = compute_tfidf(get_term_counts(documents), documents.index(document))
+
+    with span('statistics.save'):
+        Statistics.objects.update_or_create(
+            document=document,
+            defaults=Statistics.columns(statistics)
+        )
+
+
+############### Счетчики слов коллекций ###############
+
+TERMS_BATCH_SIZE = 500
+
 
-    statistics = compute_tfidf(documents, document)
+def tfidf_terms(counts):
+    return {term: count for term, count in counts.items() if len(term) >= MIN_TERM_LENGTH}
 
-    Statistics.objects.update_or_create(
-        document=document,
-        defaults={'data': statistics}
+
+def rebuild_collection_terms(collection):
+    '''Полный пересчет счетчиков коллекции по сохраненным частотам документов'''
+    documents = list(collection.documents.all())
+    with span('collection.sum'):
+        # вектор коллекции — сумма строк матрицы частот документов, df — число ненулевых в столбце
+        counts_matrix, vocabulary = build_count_matrix(get_term_counts(documents))
+        cf = np.asarray(counts_matrix.sum(axis=0)).ravel().astype(np.int64).tolist()
+        df = counts_matrix.getnnz(axis=0).tolist()
+
+    with transaction.atomic():
+        CollectionTerm.objects.filter(collection=collection).delete()
+        CollectionTerm.objects.bulk_create(
+            (
+                CollectionTerm(collection=collection, term=term, df=term_df, cf=term_cf)
+                for term, term_df, term_cf in zip(vocabulary, df, cf)
+            ),
+            batch_size=TERMS_BATCH_SIZE
+        )
+        Collection.objects.filter(pk=collection.pk).update(document_count=len(documents), terms_built=True)
+    collection.document_count = len(documents)
+    collection.terms_built = True
+
+
+def update_collection_terms(collection, counts, sign):
+    '''Добавление (sign=1) или вычитание (sign=-1) частот одного документа из счетчиков коллекции.
+    Возвращает новые df слов документа'''
+    counts = tfidf_terms(counts)
+    terms = list(counts)
+    dfs = {}
+    to_update, to_delete = [], []
+    for start in range(0, len(terms), TERMS_BATCH_SIZE):
+        batch = terms[start:start + TERMS_BATCH_SIZE]
+        for row in CollectionTerm.objects.filter(collection=collection, term__in=batch):
+            row.df += sign
+            row.cf += sign * counts.pop(row.term)
+            dfs[row.term] = row.df
+            (to_update if row.df > 0 else to_delete).append(row)
+
+    CollectionTerm.objects.bulk_update(to_update, ['df', 'cf'], batch_size=TERMS_BATCH_SIZE)
+    CollectionTerm.objects.filter(pk__in=[row.pk for row in to_delete]).delete()
+    if sign > 0:
+        # в counts остались слова, которых в коллекции еще не было
+        CollectionTerm.objects.bulk_create(
+            (CollectionTerm(collection=collection, term=term, df=1, cf=count) for term, count in counts.items()),
+            batch_size=TERMS_BATCH_SIZE
+        )
+        dfs.update(dict.fromkeys(counts, 1))
+    Collection.objects.filter(pk=collection.pk).update(document_count=F('document_count') + sign)
+    return dfs
+
+
+def add_document_to_collection(collection, document):
+    '''Добавление документа в коллекцию; False, если он уже там. Членство проверяется под блокировкой
+    строки коллекции: два одновременных добавления не посчитают документ дважды'''
+    counts = get_term_counts([document])[0]
+    with transaction.atomic():
+        collection = Collection.objects.select_for_update().get(pk=collection.pk)
+        if collection.documents.filter(pk=document.pk).exists():
+            return False
+        collection.documents.add(document)
+        if collection.terms_built:
+            dfs = update_collection_terms(collection, counts, 1)
+            if collection.index_built:
+                add_document_postings(collection, document, counts, dfs, collection.document_count + 1)
+        else:
+            rebuild_collection_terms(collection)
+            # без df по всей коллекции веса не посчитать — индекс пересоберется при поиске
+            Collection.objects.filter(pk=collection.pk).update(index_built=False)
+        collection_changed(collection)
+    return True
+
+
+def remove_document_from_collection(collection, document):
+    counts = get_term_counts([document])[0]
+    with transaction.atomic():
+        collection = Collection.objects.select_for_update().get(pk=collection.pk)
+        if not collection.documents.filter(pk=document.pk).exists():
+            return None
+        collection.documents.remove(document)
+        if collection.terms_built:
+            update_collection_terms(collection, counts, -1)
+        else:
+            rebuild_collection_terms(collection)
+        remove_document_postings(collection, document)
+        collection_changed(collection)
+
+
+def delete_document(document):
+    '''Удаление документа с вычитанием его частот из всех коллекций и агрегатов пользователя'''
+    for collection in list(document.collections.all()):
+        remove_document_from_collection(collection, document)
+    with transaction.atomic():
+        corpus = lock_user_corpus(document.owner_id)
+        terms = DocumentTerms.objects.filter(document=document).first()
+        if terms is not None and corpus.built:
+            update_user_corpus(corpus, terms.counts, document.char_count or 0, -1)
+        text_cache.delete((document.pk, document.file.name))
+        document.delete()
+
+
+############### Агрегаты пользователя для MetricsView ###############
+
+def lock_user_corpus(user_id):
+    corpus, _ = UserCorpusStats.objects.get_or_create(user_id=user_id)
+    return UserCorpusStats.objects.select_for_update().get(pk=corpus.pk)
+
+
+def update_user_words(user_id, counts, sign):
+    counts = dict(counts)
+    words = list(counts)
+    to_update, to_delete = [], []
+    for start in range(0, len(words), TERMS_BATCH_SIZE):
+        batch = words[start:start + TERMS_BATCH_SIZE]
+        for row in UserWordCount.objects.filter(user_id=user_id, word__in=batch):
+            row.count += sign * counts.pop(row.word)
+            (to_update if row.count > 0 else to_delete).append(row)
+
+    UserWordCount.objects.bulk_update(to_update, ['count'], batch_size=TERMS_BATCH_SIZE)
+    UserWordCount.objects.filter(pk__in=[row.pk for row in to_delete]).delete()
+    if sign > 0:
+        UserWordCount.objects.bulk_create(
+            (UserWordCount(user_id=user_id, word=word, count=count) for word, count in counts.items()),
+            batch_size=TERMS_BATCH_SIZE
+        )
+
+
+def update_user_corpus(corpus, counts, length, sign):
+    '''Добавление (sign=1) или вычитание (sign=-1) одного документа из агрегатов пользователя'''
+    update_user_words(corpus.user_id, counts, sign)
+    corpus.documents_total += sign
+    corpus.total_length += sign * length
+    corpus.save(update_fields=['documents_total', 'total_length'])
+
+
+def rebuild_user_corpus(user):
+    '''Полный пересчет агрегатов по сохраненным частотам (для документов, загруженных до появления агрегатов)'''
+    with transaction.atomic():
+        corpus = lock_user_corpus(user.pk)
+        documents = list(Document.objects.filter(owner=user))
+        words = Counter()
+        for counts in get_term_counts(documents):
+            words.update(counts)
+
+        UserWordCount.objects.filter(user=user).delete()
+        UserWordCount.objects.bulk_create(
+            (UserWordCount(user=user, word=word, count=count) for word, count in words.items()),
+            batch_size=TERMS_BATCH_SIZE
+        )
+        corpus.documents_total = len(documents)
+        corpus.total_length = sum(doc.char_count or 0 for doc in documents)
+        corpus.built = True
+        corpus.save()
+    return corpus
+
+
+def get_user_corpus(user):
+    corpus = UserCorpusStats.objects.filter(user=user).first()
+    if corpus is None or not corpus.built:
+        corpus = rebuild_user_corpus(user)
+    return corpus
+
+
+def collection_tfidf(collection):
+    '''(слова, idf, tfidf) коллекции по счетчикам CollectionTerm'''
+    collection = Collection.objects.get(pk=collection.pk)
+    if not collection.terms_built:
+        rebuild_collection_terms(collection)
+
+    with span('collection.load_terms'):
+        rows = list(CollectionTerm.objects.filter(collection=collection).values_list('term', 'df', 'cf'))
+    if not rows:
+        return [], np.zeros(0), np.zeros(0)
+    words, df, cf = zip(*rows)
+    df = np.array(df, dtype=np.float64)
+    cf = np.array(cf, dtype=np.float64)
+    # Вся коллекция как еще один документ корпуса, в котором есть каждое слово:
+    # те же числа, что TfidfTransformer дает на документах + их склейке
+    n_samples = collection.document_count + 1
+    idf_values = np.log((1 + n_samples) / (1 + df + 1)) + 1
+    tfidf_values = cf * idf_values
+    tfidf_values /= np.sqrt(np.dot(tfidf_values, tfidf_values))
+    return words, idf_values, tfidf_values
+
+
+def collection_changed(collection):
+    '''Состав коллекции изменился: новая версия (статистика и кэш по старой устаревают), модель устаревает.
+    Ничего не пересчитывается — это сделает первое чтение'''
+    Collection.objects.filter(pk=collection.pk).update(version=F('version') + 1)
+    invalidate_collection_model(collection)
+
+
+def cached_collection_statistics(collection, k=STATISTICS_TOP_K, order='asc', full=False):
+    '''select_statistics коллекции через общий кэш результатов. Версия коллекции растет при каждом
+    изменении состава, так что ключ (pk, версия) отсекает старые результаты без запроса к документам'''
+    key = f'collection-statistics:{collection.pk}:{collection.version}:{k}:{order}:{int(full)}'
+    return get_or_compute(
+        key, lambda: select_statistics(*collection_tfidf(collection), k=k, order=order, full=full)
     )
- 
-    for collection in collections:
-        calculate_collection_statistics(collection)
+
+
+def statistics_is_current(statistics, version):
+    return statistics is not None and statistics.version is not None and statistics.version >= version
+
+
+def collection_statistics(collection):
+    '''Сохраненная статистика коллекции. Отсутствующая или посчитанная по старой версии пересчитывается
+    при чтении, один раз на все параллельные запросы: серия изменений без чтений стоит одного расчета'''
+    version = Collection.objects.values_list('version', flat=True).get(pk=collection.pk)
+    statistics = Statistics.objects.filter(collection=collection).first()
+    if not statistics_is_current(statistics, version):
+        with computing(f'collection-statistics:{collection.pk}:{version}'):
+            statistics = Statistics.objects.filter(collection=collection).first()
+            if not statistics_is_current(statistics, version):
+                statistics = calculate_collection_statistics(collection)
+    return statistics
+
 
 def calculate_collection_statistics(collection):
-    documents = list(collection.documents.all())
-    if not documents:
-        return None
+    # версия читается до данных: изменение во время расчета оставит статистику устаревшей, а не помеченной новой
+    version = Collection.objects.values_list('version', flat=True).get(pk=collection.pk)
+    statistics = build_statistics(*collection_tfidf(collection))
 
-    combined_document = ' '.join(doc.content for doc in documents)
-    combined_doc = type('Doc', (object,), {'content': combined_document})
+    with span('statistics.save'):
+        collection_statistics, _ = Statistics.objects.update_or_create(
+            collection=collection,
+            defaults={**Statistics.columns(statistics), 'version': version}
+        )
     
-    statistics = compute_tfidf(documents + [combined_doc], combined_doc)
+    return collection_statistics
+
+
+############### Обученные модели коллекций ###############
+
+# сколько моделей один процесс держит открытыми через mmap
+LOADED_MODELS_LIMIT = 64
+_loaded_models = OrderedDict()
+_loaded_models_lock = threading.Lock()
+
+
+def collection_model_path(collection_id, version):
+    return os.path.join(settings.MEDIA_ROOT, 'models', 'collections', str(collection_id), f'v{version}')
+
+
+def invalidate_collection_model(collection):
+    CollectionModel.objects.filter(collection_id=collection.pk, stale=False).update(stale=True)
+
 
-    Statistics.objects.update_or_create(
-        collection=collection,
-        defaults={'data': statistics}
+def build_collection_model(collection):
+    '''Новая версия модели коллекции по сохраненным частотам документов.
+    Предыдущая версия остается на диске для процессов, которые еще ее читают, более старые удаляются.
+    Если запись о версии не сохранилась, каталог версии удаляется: файлы без записи в реестре никто не прочтет'''
+    path = None
+    try:
+        with transaction.atomic():
+            collection = Collection.objects.select_for_update().get(pk=collection.pk)
+            latest = CollectionModel.objects.filter(collection=collection).order_by('-version').first()
+            if latest is not None and not latest.stale:
+                # модель собрал другой процесс, пока ждали блокировку
+                return latest
+            documents = sorted(collection.documents.all(), key=lambda document: str(document.pk))
+            if not documents:
+                return None
+
+            with span('model.fit'):
+                tfidf_matrix, vocabulary, idf_values = fit_tfidf(get_term_counts(documents))
+            version = latest.version + 1 if latest is not None else 1
+            path = collection_model_path(collection.pk, version)
+            with span('model.save'):
+                write_artifacts(path, vocabulary, idf_values, tfidf_matrix, [str(document.pk) for document in documents])
+            entry = CollectionModel.objects.create(
+                collection=collection, version=version, path=path,
+                document_count=len(documents), term_count=len(vocabulary)
+            )
+            outdated = list(CollectionModel.objects.filter(collection=collection, version__lt=version - 1))
+            CollectionModel.objects.filter(pk__in=[old.pk for old in outdated]).delete()
+    except BaseException:
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+        raise
+    for old in outdated:
+        shutil.rmtree(old.path, ignore_errors=True)
+    return entry
+
+
+def get_collection_model(collection):
+    '''Актуальная модель коллекции (CollectionVectorizer) или None для пустой коллекции.
+    Открытые модели кэшируются в процессе, пока версия в реестре не сменится'''
+    entry = CollectionModel.objects.filter(collection_id=collection.pk).order_by('-version').first()
+    if entry is None or entry.stale:
+        entry = build_collection_model(collection)
+        if entry is None:
+            return None
+    with _loaded_models_lock:
+        model = _loaded_models.get(collection.pk)
+        if model is None or model.version != entry.version:
+            with span('model.load'):
+                model = CollectionVectorizer(entry.path, entry.version)
+            _loaded_models[collection.pk] = model
+        _loaded_models.move_to_end(collection.pk)
+        while len(_loaded_models) > LOADED_MODELS_LIMIT:
+            _loaded_models.popitem(last=False)
+    return model
+
+
+def preload_collection_models(limit):
+    '''Открывает готовые модели недавно измененных коллекций (прогрев перед fork); ничего не строит.
+    Возвращает число открытых моделей'''
+    loaded = 0
+    for collection_id in Collection.objects.order_by('-updated_at').values_list('pk', flat=True)[:limit]:
+        entry = CollectionModel.objects.filter(collection_id=collection_id).order_by('-version').first()
+        if entry is None or entry.stale or not os.path.isdir(entry.path):
+            continue
+        with _loaded_models_lock:
+            with span('model.load'):
+                _loaded_models[collection_id] = CollectionVectorizer(entry.path, entry.version)
+        loaded += 1
+    return loaded
+
+
+def score_text(collection, text, limit=10):
+    '''TF-IDF нового текста по модели коллекции и самые близкие к нему документы коллекции'''
+    model = get_collection_model(collection)
+    if model is None:
+        return ([], np.zeros(0), np.zeros(0)), []
+    columns, values = model.transform(tfidf_terms(Counter(WORD_RE.findall(text.lower()))))
+    similar = model.similar(columns, values, limit)
+    titles = dict(Document.objects.filter(pk__in=[document_id for document_id, _ in similar]).values_list('pk', 'title'))
+    return (model.vocabulary.terms(columns), model.idf[columns], values), [
+        {'id': document_id, 'title': titles.get(uuid.UUID(document_id)), 'score': score}
+        for document_id, score in similar
+    ]
+
+
+############### Поисковый индекс коллекций ###############
+
+# Веса постингов зависят от idf коллекции. Новый документ получает веса по текущим df,
+# а веса остальных пересчитываются целиком, когда изменилась заметная доля коллекции
+INDEX_REWEIGHT_RATIO = 0.2
+
+
+def smooth_idf(df, n_documents):
+    '''idf как у TfidfTransformer(smooth_idf=True)'''
+    return np.log((1 + n_documents) / (1 + np.asarray(df, dtype=np.float64))) + 1
+
+
+def rebuild_collection_index(collection):
+    '''Полная пересборка постингов: веса — нормированные строки TF-IDF документов коллекции'''
+    documents = list(collection.documents.all())
+    with span('search.rebuild'):
+        counts_matrix, vocabulary = build_count_matrix(get_term_counts(documents))
+        weights = sklearn_text.TfidfTransformer().fit_transform(counts_matrix) if vocabulary else counts_matrix
+        weights.sort_indices()
+        # структура матрицы при взвешивании не меняется: data обеих матриц идут в одном порядке
+        rows = np.repeat(np.arange(len(documents)), np.diff(counts_matrix.indptr))
+        postings = (
+            Posting(collection=collection, term=vocabulary[col], document=documents[row],
+                    count=int(count), weight=float(weight))
+            for row, col, count, weight in zip(
+                rows.tolist(), counts_matrix.indices.tolist(),
+                counts_matrix.data.tolist(), weights.data.tolist()
+            )
+        )
+        with transaction.atomic():
+            Posting.objects.filter(collection=collection).delete()
+            Posting.objects.bulk_create(postings, batch_size=TERMS_BATCH_SIZE)
+            Collection.objects.filter(pk=collection.pk).update(index_built=True, index_drift=0)
+    collection.index_built = True
+    collection.index_drift = 0
+
+
+def add_document_postings(collection, document, counts, dfs, n_documents):
+    '''Постинги нового документа коллекции с весами по ее текущим df'''
+    counts = tfidf_terms(counts)
+    terms = list(counts)
+    if terms:
+        weights = np.array([counts[term] for term in terms], dtype=np.float64)
+        weights *= smooth_idf([dfs[term] for term in terms], n_documents)
+        weights /= np.sqrt(np.dot(weights, weights))
+        Posting.objects.bulk_create(
+            (
+                Posting(collection=collection, term=term, document=document, count=counts[term], weight=weight)
+                for term, weight in zip(terms, weights.tolist())
+            ),
+            batch_size=TERMS_BATCH_SIZE
+        )
+    Collection.objects.filter(pk=collection.pk).update(index_drift=F('index_drift') + 1)
+
+
+def remove_document_postings(collection, document):
+    Posting.objects.filter(collection=collection, document=document).delete()
+    Collection.objects.filter(pk=collection.pk).update(index_drift=F('index_drift') + 1)
+
+
+def search_collection(collection, query, limit=10):
+    '''Документы коллекции по убыванию косинусной близости TF-IDF к запросу.
+    Читаются только постинги слов запроса'''
+    collection = Collection.objects.get(pk=collection.pk)
+    if not collection.terms_built:
+        rebuild_collection_terms(collection)
+    if not collection.index_built or collection.index_drift > INDEX_REWEIGHT_RATIO * collection.document_count:
+        rebuild_collection_index(collection)
+
+    query_counts = tfidf_terms(Counter(WORD_RE.findall(query.lower())))
+    dfs = dict(
+        CollectionTerm.objects.filter(collection=collection, term__in=list(query_counts)).values_list('term', 'df')
     )
-    
-    return statistics
+    # слов, которых нет в коллекции, нет и в постингах — на ранжирование они не влияют
+    terms = sorted(dfs)
+    if not terms:
+        return terms, []
+    query_weights = np.array([query_counts[term] for term in terms], dtype=np.float64)
+    query_weights *= smooth_idf([dfs[term] for term in terms], collection.document_count)
+    query_weights /= np.sqrt(np.dot(query_weights, query_weights))
+    query_weights = dict(zip(terms, query_weights.tolist()))
 
+    scores = {}
+    with span('search.postings'):
+        postings = Posting.objects.filter(collection=collection, term__in=terms)
+        for document_id, term, weight in postings.values_list('document_id', 'term', 'weight').iterator():
+            scores[document_id] = scores.get(document_id, 0.0) + query_weights[term] * weight
 
-from collections import Counter
-import heapq
+    top = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], str(item[0])))
+    titles = dict(Document.objects.filter(pk__in=[document_id for document_id, _ in top]).values_list('pk', 'title'))
+    return terms, [
+        {'id': document_id, 'title': titles[document_id], 'score': score}
+        for document_id, score in top
+    ]
 
-class HuffmanNode:
-    def __init__(self, char=None, freq=0, left=None, right=None):
-        self.char = char
-        self.freq = freq
-        self.left = left
-        self.right = right
 
-    def __lt__(self, other):
-        return self.freq < other.freq
+############### Почти-дубликаты (MinHash/LSH) ###############
 
+SIMILARITY_THRESHOLD = 0.8
+
+
+def save_signature(document, signature):
+    '''Подпись и корзины LSH документа. У пустого документа подпись пустая и корзин нет'''
+    DocumentSignature.objects.update_or_create(document=document, defaults={'signature': signature or b''})
+    LSHBucket.objects.filter(document=document).delete()
+    if signature:
+        LSHBucket.objects.bulk_create(
+            LSHBucket(document=document, band=band, bucket=bucket) for band, bucket in band_buckets(signature)
+        )
+
+
+def ensure_signatures(documents):
+    '''Документы, загруженные до появления подписей, индексируются при первом обращении'''
+    for document in documents.filter(signature__isnull=True):
+        index_document(document)
+
+
+def document_signature(document):
+    '''Подпись документа; документ, загруженный до появления подписей, индексируется при первом обращении'''
+    signature = DocumentSignature.objects.filter(document=document).values_list('signature', flat=True).first()
+    if signature is None:
+        index_document(document)
+        signature = DocumentSignature.objects.get(document=document).signature
+    return bytes(signature)
+
+
+def similar_documents(document, threshold=SIMILARITY_THRESHOLD, limit=20):
+    '''Почти-дубликаты документа среди документов владельца.
+    Кандидаты — документы с общей корзиной LSH, похожесть оценивается по подписям только для них.
+    Подпись считается заранее только для самого документа, остальные документы без подписи
+    получают ее при собственном обращении'''
+    own = document_signature(document)
+    if not own:
+        return []
+
+    with span('similar.candidates'):
+        buckets = Q()
+        for band, bucket in LSHBucket.objects.filter(document=document).values_list('band', 'bucket'):
+            buckets |= Q(band=band, bucket=bucket)
+        candidates = set(
+            LSHBucket.objects.filter(buckets, document__owner_id=document.owner_id)
+            .exclude(document=document).values_list('document_id', flat=True)
+        )
+
+    signatures = {}
+    for batch in batched(candidates):
+        signatures.update(DocumentSignature.objects.filter(document__in=batch).values_list('document_id', 'signature'))
+    # корзины пишутся вместе с подписью; кандидат, у которого строки подписи все же нет, индексируется здесь
+    for candidate in Document.objects.filter(pk__in=candidates - set(signatures)):
+        signatures[candidate.pk] = document_signature(candidate)
+
+    scored = []
+    for document_id, signature in signatures.items():
+        score = similarity(own, bytes(signature))
+        if score >= threshold:
+            scored.append((document_id, score))
+    scored = sorted(scored, key=lambda item: (-item[1], str(item[0])))[:limit]
+
+    titles = dict(Document.objects.filter(pk__in=[document_id for document_id, _ in scored]).values_list('pk', 'title'))
+    return [{'id': document_id, 'title': titles[document_id], 'similarity': score} for document_id, score in scored]
+
+
+def collection_duplicates(collection, threshold=SIMILARITY_THRESHOLD):
+    '''Пары почти-дубликатов коллекции и группы связанных ими документов.
+    Сравниваются только документы, попавшие в общую корзину LSH'''
+    ensure_signatures(collection.documents.all())
+
+    with span('similar.candidates'):
+        buckets = {}
+        for band, bucket, document_id in LSHBucket.objects.filter(document__collections=collection).values_list(
+            'band', 'bucket', 'document_id'
+        ):
+            buckets.setdefault((band, bucket), []).append(document_id)
+        pairs = set()
+        for members in buckets.values():
+            if len(members) > 1:
+                pairs.update(combinations(sorted(members, key=str), 2))
+
+    documents = {document_id for pair in pairs for document_id in pair}
+    signatures = {
+        document_id: bytes(signature)
+        for document_id, signature in DocumentSignature.objects.filter(document__in=documents).values_list(
+            'document_id', 'signature'
+        )
+    }
+
+    # группы — компоненты связности по найденным парам (система непересекающихся множеств)
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    duplicates = []
+    for a, b in pairs:
+        score = similarity(signatures[a], signatures[b])
+        if score >= threshold:
+            duplicates.append({'a': a, 'b': b, 'similarity': score})
+            parent[find(a)] = find(b)
+    duplicates.sort(key=lambda pair: (-pair['similarity'], str(pair['a']), str(pair['b'])))
+
+    groups = {}
+    for document_id in parent:
+        groups.setdefault(find(document_id), []).append(document_id)
+    groups = sorted((sorted(group, key=str) for group in groups.values()), key=lambda group: (-len(group), str(group[0])))
+    return duplicates, groups
 
-def build_huffman_tree(text):
-    freq = Counter(text)
-    heap = [HuffmanNode(char=ch, freq=freq[ch]) for ch in freq]
-    heapq.heapify(heap)
 
+############### Пакетная загрузка ###############
+
+BULK_BATCH_SIZE = 500
+
+
+def batched(items, size=None):
+    '''Список пачками по BULK_BATCH_SIZE: запросы с __in не упираются в лимит переменных SQLite'''
+    items = list(items)
+    size = size or BULK_BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def create_documents(owner, files, collection=None):
+    '''Сохранение пачки файлов (пары имя, файловый объект) одним bulk_create.
+    Файлы пишутся в хранилище по одному потоком, документы в БД — пачками.
+    Статистику пачки потом считает calculate_bulk_statistics'''
+    documents = []
+    try:
+        for name, fileobj in files:
+            document = Document(owner=owner, title=os.path.basename(name)[:255])
+            with span('bulk.store'):
+                document.file.save(os.path.basename(name), File(fileobj), save=False)
+            documents.append(document)
+    except Exception:
+        # ошибка посреди архива — уже записанные файлы не должны остаться в хранилище
+        for document in documents:
+            document.file.delete(save=False)
+        raise
+
+    with span('bulk.insert'), transaction.atomic():
+        Document.objects.bulk_create(documents, batch_size=BULK_BATCH_SIZE)
+        if collection is not None:
+            collection = Collection.objects.select_for_update().get(pk=collection.pk)
+            Collection.documents.through.objects.bulk_create(
+                (Collection.documents.through(collection_id=collection.pk, document_id=document.pk)
+                 for document in documents),
+                batch_size=BULK_BATCH_SIZE
+            )
+            # счетчики и поисковый индекс коллекции пересобираются один раз по всей пачке
+            Collection.objects.filter(pk=collection.pk).update(terms_built=False, index_built=False)
+            collection_changed(collection)
+    return documents
+
+
+def calculate_bulk_statistics(documents):
+    '''Статистика пачки документов: TF-IDF считается один раз на каждый общий корпус.
+    Статистика коллекций пересчитывается при чтении (collection_statistics).
+    Документ, который не удалось обработать, пропускается, остальные сохраняются.
+    Возвращает словарь id документа -> текст ошибки'''
+    failed = {}
+    indexed = []
+    for document in documents:
+        try:
+            index_document(document)
+        except Exception as e:
+            failed[document.pk] = f"{type(e).__name__}: {e}"
+        else:
+            indexed.append(document)
+
+    memberships = {}
+    for batch in batched(indexed):
+        for document_id, collection_id in Collection.documents.through.objects.filter(
+            document__in=batch
+        ).values_list('document_id', 'collection_id'):
+            memberships.setdefault(document_id, set()).add(collection_id)
+
+    # документы с одинаковым набором коллекций делят корпус, а значит и матрицу TF-IDF
+    groups = {}
+    for document in indexed:
+        groups.setdefault(frozenset(memberships.get(document.pk, ())), []).append(document)
+
+    rows = []
+    for collection_ids, targets in groups.items():
+        if collection_ids:
+            corpus = [
+                document for document in Document.objects.filter(collections__in=collection_ids).distinct()
+                if document.pk not in failed
+            ]
+            corpus_groups = [(corpus, targets)]
+        else:
+            corpus_groups = [([document], [document]) for document in targets]
+        for corpus, corpus_targets in corpus_groups:
+            try:
+                fitted = fit_tfidf(get_term_counts(corpus))
+            except Exception as e:
+                # сломался соседний документ корпуса (например, пропал файл) — без него TF-IDF не посчитать
+                for document in corpus_targets:
+                    failed[document.pk] = f"{type(e).__name__}: {e}"
+                continue
+            positions = {document.pk: i for i, document in enumerate(corpus)}
+            for document in corpus_targets:
+                rows.append((document, build_statistics(*matrix_row(*fitted, positions[document.pk]))))
+
+    with span('statistics.save'), transaction.atomic():
+        # словарь пополняется одним проходом на всю пачку
+        term_ids = Term.ids(row['word'] for _, statistics in rows for row in statistics)
+        statistics = [
+            Statistics(document=document, **Statistics.columns(document_statistics, term_ids))
+            for document, document_statistics in rows
+        ]
+        for batch in batched(document.pk for document, _ in rows):
+            Statistics.objects.filter(document__in=batch).delete()
+        Statistics.objects.bulk_create(statistics, batch_size=BULK_BATCH_SIZE)
+    return failed
+
+
+def huffman_code_lengths(freq):
+    '''Длины кодов Хаффмана без дерева объектов и рекурсии.
+    В куче пары (частота, номер узла), для узлов хранится только номер родителя:
+    родитель создается позже детей, поэтому глубины считаются одним проходом с конца'''
+    symbols = list(freq)
+    n = len(symbols)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {symbols[0]: 1}
+
+    heap = [(freq[symbol], i) for i, symbol in enumerate(symbols)]
+    heapq.heapify(heap)
+    parent = [0] * (2 * n - 1)
+    next_node = n
     while len(heap) > 1:
-        node1 = heapq.heappop(heap)
-        node2 = heapq.heappop(heap)
-        merged = HuffmanNode(freq=node1.freq + node2.freq, left=node1, right=node2)
-        heapq.heappush(heap, merged)
-
-    return heap[0] if heap else None
-
-
-def generate_codes(node, prefix="", codebook=None):
-    if codebook is None:
-        codebook = dict()
-    if node:
-        if node.char is not None:
-            codebook[node.char] = prefix or "0"
-        generate_codes(node.left, prefix + "0", codebook)
-        generate_codes(node.right, prefix + "1", codebook)
+        freq1, node1 = heapq.heappop(heap)
+        freq2, node2 = heapq.heappop(heap)
+        parent[node1] = parent[node2] = next_node
+        heapq.heappush(heap, (freq1 + freq2, next_node))
+        next_node += 1
+
+    depth = [0] * (2 * n - 1)  # корень — последний узел, глубина 0
+    for node in range(2 * n - 3, -1, -1):
+        depth[node] = depth[parent[node]] + 1
+    return {symbol: depth[i] for i, symbol in enumerate(symbols)}
+
+
+def canonical_order(lengths):
+    return sorted(lengths.items(), key=lambda item: (item[1], item[0]))
+
+
+def canonical_codes(lengths):
+    '''Канонические коды по одним длинам: символы по (длина, символ),
+    каждый следующий код = предыдущий + 1, при росте длины сдвигается влево'''
+    codebook = {}
+    code = 0
+    prev_length = 0
+    for symbol, length in canonical_order(lengths):
+        code <<= length - prev_length
+        if length < 1 or code >= 1 << length:
+            raise ValueError("Длины кодов не образуют префиксный код")
+        codebook[symbol] = format(code, f'0{length}b')
+        code += 1
+        prev_length = length
     return codebook
 
 
+@traced('huffman.codebook')
+def huffman_codebook(text):
+    lengths = huffman_code_lengths(Counter(text))
+    return lengths, canonical_codes(lengths)
+
+
 def huffman(text):
-    root = build_huffman_tree(text)
-    codebook = generate_codes(root)
-    encoded = ''.join(codebook[ch] for ch in text)
+    _, codebook = huffman_codebook(text)
+    with span('huffman.encode'):
+        encoded = ''.join(codebook[ch] for ch in text)
     return {
         "encoded": encoded,
         "codes": codebook
     }
+
+
+def cached_huffman(document, binary=False):
+    '''huffman или huffman_binary текста документа через общий кэш результатов; ключ — sha256 содержимого'''
+    encode = huffman_binary if binary else huffman
+    if not document.content_hash:
+        # документ еще не проиндексирован — хеша нет
+        return encode(document.content)
+    key = f"huffman:{'binary' if binary else 'text'}:{document.content_hash}"
+    return get_or_compute(key, lambda: encode(document.content))
+
+
+############### Бинарный режим Хаффмана ###############
+
+PACK_CHUNK_SIZE = 64 * 1024
+# для кода длиннее 64 бит нужен текст порядка 10^13 символов (частоты Фибоначчи)
+MAX_CODE_LENGTH = 64
+
+
+@traced('huffman.pack')
+def pack_bits(text, codebook):
+    '''Упаковка кодов в байты. Возвращает (bytes, padding) — padding нулевых бит дописано в последний байт.
+    Текст кодируется кусками, строка из '0'/'1' для всего текста не строится'''
+    packed = bytearray()
+    carry = ''
+    for start in range(0, len(text), PACK_CHUNK_SIZE):
+        bits = carry + ''.join(codebook[ch] for ch in text[start:start + PACK_CHUNK_SIZE])
+        whole = len(bits) - len(bits) % 8
+        if whole:
+            packed += int(bits[:whole], 2).to_bytes(whole // 8, 'big')
+        carry = bits[whole:]
+    padding = (8 - len(carry)) % 8
+    if carry:
+        packed += int(carry + '0' * padding, 2).to_bytes(1, 'big')
+    return bytes(packed), padding
+
+
+def huffman_binary(text):
+    lengths, codebook = huffman_codebook(text)
+    packed, padding = pack_bits(text, codebook)
+    original_size = len(text.encode('utf-8'))
+    return {
+        "encoded": packed,
+        "padding": padding,
+        # компактная таблица: пары (символ, длина) в каноническом порядке, коды по ним восстанавливаются
+        "lengths": [[symbol, length] for symbol, length in canonical_order(lengths)],
+        "original_size": original_size,
+        "compressed_size": len(packed),
+        "compression_ratio": round(len(packed) / original_size, 4) if original_size else 0.0,
+    }
+
+
+# mode=raw: 4 байта длины заголовка (big-endian), заголовок в JSON, затем упакованные биты.
+# Таблица длин растет с алфавитом и в HTTP-заголовок (обычно до 8 КБ на прокси) может не поместиться
+RAW_PREAMBLE = struct.Struct('>I')
+
+
+def huffman_raw(result):
+    '''Тело mode=raw из результата huffman_binary: таблица кодов и padding — в заголовке перед битами'''
+    header = json.dumps({
+        'padding': result['padding'],
+        'lengths': result['lengths'],
+        'original_size': result['original_size'],
+    }, ensure_ascii=False).encode('utf-8')
+    return RAW_PREAMBLE.pack(len(header)) + header + result['encoded']
+
+
+def parse_huffman_raw(body):
+    '''(упакованные биты, padding, lengths) из тела mode=raw'''
+    if len(body) < RAW_PREAMBLE.size:
+        raise ValueError("Нет заголовка с таблицей кодов")
+    size, = RAW_PREAMBLE.unpack_from(body)
+    end = RAW_PREAMBLE.size + size
+    if len(body) < end:
+        raise ValueError("Заголовок длиннее тела")
+    header = json.loads(body[RAW_PREAMBLE.size:end].decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError("Заголовок должен быть объектом JSON")
+    padding = header.get('padding', 0)
+    if isinstance(padding, bool) or not isinstance(padding, int) or not 0 <= padding <= 7:
+        raise ValueError("padding должен быть от 0 до 7")
+    return body[end:], padding, header.get('lengths', [])
+
+
+class HuffmanDecoder:
+    '''Табличное декодирование: состояние — внутренний узел дерева кодов,
+    по (состояние, байт) таблица сразу дает декодированные символы и следующее состояние.
+    Таблица заполняется лениво, только для реально встретившихся пар'''
+
+    def __init__(self, codebook):
+        # дерево в массивах: children[node] = [узел по 0, узел по 1], symbols[node] — символ листа
+        self.children = [[None, None]]
+        self.symbols = [None]
+        for symbol, code in codebook.items():
+            node = 0
+            if not code or set(code) - {'0', '1'}:
+                raise ValueError(f"Некорректный код символа {symbol!r}: {code!r}")
+            for bit in code:
+                bit = int(bit)
+                if self.children[node][bit] is None:
+                    self.children.append([None, None])
+                    self.symbols.append(None)
+                    self.children[node][bit] = len(self.children) - 1
+                node = self.children[node][bit]
+            if self.symbols[node] is not None or self.children[node] != [None, None]:
+                raise ValueError("Коды не являются префиксными")
+            self.symbols[node] = symbol
+        self.table = {}
+
+    def walk(self, state, byte, bits=8):
+        out = []
+        for shift in range(7, 7 - bits, -1):
+            state = self.children[state][(byte >> shift) & 1]
+            if state is None:
+                raise ValueError("Данные не соответствуют таблице кодов")
+            symbol = self.symbols[state]
+            if symbol is not None:
+                out.append(symbol)
+                state = 0
+        return ''.join(out), state
+
+    def decode(self, data, padding=0):
+        if not data:
+            return ''
+        if not 0 <= padding <= 7:
+            raise ValueError("padding должен быть от 0 до 7")
+        table = self.table
+        state = 0
+        out = []
+        for byte in data[:-1]:
+            key = (state, byte)
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = self.walk(state, byte)
+            symbols, state = entry
+            out.append(symbols)
+        symbols, state = self.walk(state, data[-1], 8 - padding)
+        out.append(symbols)
+        if state != 0:
+            raise ValueError("Данные обрываются посреди кода")
+        return ''.join(out)
+
+
+@traced('huffman.decode')
+def huffman_decode(data, padding, lengths):
+    '''Декодирование по каноническим длинам кодов: lengths — пары (символ, длина) или словарь'''
+    if isinstance(lengths, dict):
+        lengths = lengths.items()
+    if any(not isinstance(pair, (list, tuple)) or len(pair) != 2 for pair in lengths):
+        raise ValueError("Таблица кодов — пары [символ, длина]")
+    lengths = dict(lengths)
+    if any(not isinstance(symbol, str) or len(symbol) != 1 for symbol in lengths):
+        raise ValueError("Символы таблицы должны быть строками из одного символа")
+    # bool — подкласс int: true в JSON не должно стать длиной 1
+    if any(isinstance(length, bool) or not isinstance(length, int) or not 1 <= length <= MAX_CODE_LENGTH
+           for length in lengths.values()):
+        raise ValueError(f"Длина кода должна быть от 1 до {MAX_CODE_LENGTH}")
+    return HuffmanDecoder(canonical_codes(lengths)).decode(data, padding)
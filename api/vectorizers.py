@@ -0,0 +1,130 @@
+import os
+import shutil
+from bisect import bisect_left
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+sparse = lazy_import('scipy.sparse')
+
+# файлы артефактов модели коллекции; все — .npy, чтобы их можно было открыть через mmap
+# отсортированные слова подряд в UTF-8 (uint8) и смещения их начал плюс общая длина (int64):
+# массив строк numpy фиксированной ширины раздувается до самого длинного слова
+VOCABULARY_FILE = 'vocabulary_utf8.npy'
+OFFSETS_FILE = 'vocabulary_offsets.npy'
+IDF_FILE = 'idf.npy'
+DOCUMENTS_FILE = 'documents.npy'  # id документов по строкам матрицы, отсортированы
+DATA_FILE = 'data.npy'  # матрица документ-слово (нормированный TF-IDF) в CSR
+INDICES_FILE = 'indices.npy'
+INDPTR_FILE = 'indptr.npy'
+
+
+def write_artifacts(path, vocabulary, idf_values, tfidf_matrix, document_ids):
+    '''Записывает артефакты во временный каталог и переименовывает его в path —
+    читатели видят либо полную модель, либо никакой'''
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        tfidf_matrix = tfidf_matrix.tocsr()
+        tfidf_matrix.sort_indices()
+        encoded = [term.encode('utf-8') for term in vocabulary]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+        np.save(os.path.join(tmp_path, VOCABULARY_FILE), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        np.save(os.path.join(tmp_path, OFFSETS_FILE), offsets)
+        np.save(os.path.join(tmp_path, IDF_FILE), np.asarray(idf_values, dtype=np.float64))
+        np.save(os.path.join(tmp_path, DOCUMENTS_FILE), np.array(document_ids, dtype=str))
+        np.save(os.path.join(tmp_path, DATA_FILE), tfidf_matrix.data.astype(np.float64))
+        # scipy сам приводит индексы к int32, когда они помещаются, — тогда копия вместо mmap
+        index_dtype = np.int32 if max(tfidf_matrix.nnz, tfidf_matrix.shape[1]) < 2 ** 31 else np.int64
+        np.save(os.path.join(tmp_path, INDICES_FILE), tfidf_matrix.indices.astype(index_dtype))
+        np.save(os.path.join(tmp_path, INDPTR_FILE), tfidf_matrix.indptr.astype(index_dtype))
+        if os.path.isdir(path):
+            # каталог версии, запись о которой не сохранилась (процесс умер до коммита): rename поверх
+            # непустого каталога падает с ENOTEMPTY, и все следующие сборки этой версии тоже
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+class Vocabulary:
+    '''Отсортированный словарь поверх байтов слов и смещений (оба массива открыты через mmap).
+    Порядок байтов UTF-8 совпадает с порядком кодовых точек, так что двоичный поиск идет по тем же данным'''
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('utf-8')
+
+    def terms(self, positions):
+        return [self[position] for position in positions]
+
+    def index(self, term):
+        '''Номер слова или -1, если его нет в словаре'''
+        position = bisect_left(self, term)
+        return position if position < len(self) and self[position] == term else -1
+
+
+class CollectionVectorizer:
+    '''Обученная модель коллекции поверх файлов, открытых через mmap.
+    Процессы, открывшие одну версию, делят страницы в памяти; transform не требует обучения'''
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+
+        self.vocabulary = Vocabulary(load(VOCABULARY_FILE), load(OFFSETS_FILE))
+        self.idf = load(IDF_FILE)
+        self.documents = load(DOCUMENTS_FILE)
+        self.matrix = sparse.csr_matrix(
+            (load(DATA_FILE), load(INDICES_FILE), load(INDPTR_FILE)),
+            shape=(len(self.documents), len(self.vocabulary)), copy=False
+        )
+
+    def term_indices(self, terms):
+        '''Номера столбцов слов; слов вне словаря — -1'''
+        return np.array([self.vocabulary.index(term) for term in terms], dtype=np.int64)
+
+    def transform(self, counts):
+        '''Нормированный TF-IDF вектор новых частот слов по idf коллекции: (столбцы, значения)'''
+        terms = list(counts)
+        columns = self.term_indices(terms)
+        known = columns >= 0
+        columns = columns[known]
+        values = np.array([counts[term] for term in terms], dtype=np.float64)[known] * self.idf[columns]
+        norm = np.sqrt(np.dot(values, values))
+        if norm:
+            values /= norm
+        order = np.argsort(columns)
+        return columns[order], values[order]
+
+    def document_row(self, document_id):
+        '''(столбцы, значения) строки документа или None, если его нет в модели'''
+        document_id = str(document_id)
+        position = int(np.searchsorted(self.documents, document_id))
+        if position >= len(self.documents) or self.documents[position] != document_id:
+            return None
+        start, end = self.matrix.indptr[position], self.matrix.indptr[position + 1]
+        return np.asarray(self.matrix.indices[start:end]), np.asarray(self.matrix.data[start:end])
+
+    def similar(self, columns, values, limit=10):
+        '''Документы коллекции по убыванию косинусной близости к вектору: [(id, оценка)]'''
+        if not len(columns) or not len(self.documents):
+            return []
+        vector = np.zeros(len(self.vocabulary))
+        vector[columns] = values
+        scores = self.matrix @ vector
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = sorted(top.tolist(), key=lambda i: (-scores[i], self.documents[i]))
+        return [(str(self.documents[i]), float(scores[i])) for i in top if scores[i] > 0]
@@ -4,17 +4,27 @@ from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth import logout
-from .serializers import UserRegisterSerializer, ChangePasswordSerializer, DocumentSerializer, DocumentDetailSerializer, CollectionSerializer, StatisticsSerializer
-from .models import Document, Collection, Statistics
+from .serializers import UserRegisterSerializer, ChangePasswordSerializer, DocumentSerializer, DocumentDetailSerializer, CollectionSerializer, StatisticsSerializer, StatisticsQuerySerializer, JobSerializer, HuffmanDecodeSerializer, BulkUploadSerializer, SearchQuerySerializer, SimilarityQuerySerializer, ScoreTextSerializer, query_list
+from .models import Document, Collection, Job, UserWordCount
 from rest_framework.authtoken.models import Token
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied
-from rest_framework.parsers import MultiPartParser, FormParser
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser, BaseParser
+from django.http import HttpResponse
+from django.conf import settings
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from .decorators import track_processing_time
+from .pagination import CreatedCursorPagination
+from .async_views import AsyncAPIViewMixin, aget_object_or_404, blocking, database
 from .metrics import get_metrics
-import re
-from collections import Counter
+from .tracing import get_stage_metrics
+from .warmup import process_memory
+from .lru import text_cache
+from .utils import get_user_corpus
+import base64
 from .version import __version__
 
 ############## Статистика рантайм и тд ##############################
@@ -42,34 +52,37 @@ class MetricsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        documents = Document.objects.filter(owner=request.user)
-        collections = Collection.objects.filter(owner=request.user)
-
-        documents_total = documents.count()
-        total_length = sum(len(doc.content or '') for doc in documents)
-        average_document_length = total_length / documents_total if documents_total > 0 else 0
-
-        all_words = []
-        for doc in documents:
-            content = doc.content or ''
-            words = re.findall(r'\b\w+\b', content.lower())
-            all_words.extend(words)
-
-        word_counts = Counter(all_words)
-        most_common_words = [word for word, _ in word_counts.most_common(10)]
-        rarest_words = [word for word, count in word_counts.items() if count == 1][:10]
-
-        documents_per_collection = {
-        collection.name: collection.documents.count() for collection in collections
-    }
-        extra_metrics = get_metrics()
+        # слова и длины берутся из агрегатов, которые обновляются при загрузке и удалении документов
+        corpus = get_user_corpus(request.user)
+        documents_total = corpus.documents_total
+        average_document_length = corpus.total_length / documents_total if documents_total > 0 else 0
+
+        word_counts = UserWordCount.objects.filter(user=request.user)
+        most_common_words = list(word_counts.order_by('-count', 'word').values_list('word', flat=True)[:10])
+        rarest_words = list(word_counts.filter(count=1).order_by('word').values_list('word', flat=True)[:10])
+
+        documents_per_collection = dict(
+            Collection.objects.filter(owner=request.user)
+            .annotate(documents_total=Count('documents'))
+            .values_list('name', 'documents_total')
+        )
+        try:
+            window = int(request.query_params['window']) if 'window' in request.query_params else None
+        except ValueError:
+            return Response({"detail": "window — число секунд"}, status=status.HTTP_400_BAD_REQUEST)
+        extra_metrics = get_metrics(window)
+        stage_metrics = get_stage_metrics(window)
         return Response({
         "documents_total": documents_total,
         "average_document_length": round(average_document_length, 2),
         "most_common_words": most_common_words,
         "rarest_words": rarest_words,
         "documents_per_collection": documents_per_collection,
-        "processing_metrics": extra_metrics
+        "processing_metrics": extra_metrics,
+        "stage_metrics": stage_metrics,
+        "process": process_memory(),
+        # кэш текстов документов у каждого воркера свой — это счетчики ответившего процесса
+        "text_cache": text_cache.stats()
     })
 
 ############### Рега Логаут и все такое ######################
@@ -140,36 +153,146 @@ class DeleteUserView(generics.DestroyAPIView):
 
 
 ############### Для работы с документами ##########################
-from .utils import calculate_statistics, huffman
+from .utils import create_documents, delete_document, document_tfidf, similar_documents, select_statistics, cached_huffman, huffman_decode, huffman_raw, parse_huffman_raw
+from .jobs import enqueue
+from .archives import UploadError, iter_uploads
+
+
+class OctetStreamParser(BaseParser):
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read()
+
+
+class HuffmanAPIView(AsyncAPIViewMixin, APIView):
+    @swagger_auto_schema(operation_description="Huffman-кодирование документа. mode=text (по умолчанию) — "
+                         "строка из 0 и 1, mode=binary — биты упакованы в байты (base64), "
+                         "mode=raw — application/octet-stream: 4 байта длины (big-endian), JSON с lengths и padding, "
+                         "затем упакованные биты")
+    async def get(self, request, doc_id):
+        document = await aget_object_or_404(Document.objects.all(), id=doc_id)
+        mode = request.query_params.get('mode', 'text')
+        # результат общий для воркеров (кэш по хешу содержимого); промах считается в пуле потоков
+        if mode == 'text':
+            result = await blocking(cached_huffman)(document)
+            return Response(result, status=status.HTTP_200_OK)
+        if mode not in ('binary', 'raw'):
+            return Response({"detail": "mode должен быть text, binary или raw"}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = await blocking(cached_huffman)(document, binary=True)
+        if mode == 'raw':
+            response = HttpResponse(huffman_raw(result), content_type='application/octet-stream')
+            response['X-Huffman-Padding'] = result['padding']
+            response['X-Huffman-Original-Size'] = result['original_size']
+            return response
+        result['encoded'] = base64.b64encode(result['encoded']).decode('ascii')
+        return Response(result, status=status.HTTP_200_OK)
 
 
-class HuffmanAPIView(APIView):
-    def get(self, request, doc_id):
-        document = get_object_or_404(Document, id=doc_id)
-        result = huffman(document.content)
-        return Response(result, status=status.HTTP_200_OK)
+class HuffmanDecodeView(APIView):
+    '''Декодирование Хаффмана: JSON (encoded в base64, padding, lengths)
+    или тело ответа mode=raw как есть (application/octet-stream)'''
+    parser_classes = (JSONParser, OctetStreamParser)
+
+    @swagger_auto_schema(request_body=HuffmanDecodeSerializer,
+                         operation_description="Декодирование упакованного Huffman-кода обратно в текст")
+    def post(self, request):
+        try:
+            if isinstance(request.data, bytes):
+                data, padding, lengths = parse_huffman_raw(request.data)
+            else:
+                serializer = HuffmanDecodeSerializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
+                data = base64.b64decode(serializer.validated_data['encoded'], validate=True)
+                padding = serializer.validated_data['padding']
+                lengths = serializer.validated_data['lengths']
+            text = huffman_decode(data, padding, lengths)
+        except (ValueError, TypeError) as e:
+            # binascii.Error и JSONDecodeError — наследники ValueError
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"text": text}, status=status.HTTP_200_OK)
+
+
+FIELDS_PARAMETERS = [
+    openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Только перечисленные поля, через запятую"),
+    openapi.Parameter('expand', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Дополнительные поля через запятую (content, documents)"),
+]
 
 
 class DocumentListCreateView(generics.ListCreateAPIView):
     parser_classes = (MultiPartParser, FormParser)
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedCursorPagination
     
-    @swagger_auto_schema(operation_description="Получить список загруженных пользователем документов")
     def get_queryset(self):
         '''Получение списка загруженных документов'''
         return Document.objects.filter(owner=self.request.user)
+
+    @swagger_auto_schema(operation_description="Получить список загруженных пользователем документов. "
+                         "Без expand=content файлы не читаются", manual_parameters=FIELDS_PARAMETERS)
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
     
 
     @swagger_auto_schema(operation_description="Загрузить новый документ")
-    @track_processing_time
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['job_id'] = self.job.id
+        return response
+
     def perform_create(self, serializer):
-        '''Добавление документа в список'''
+        '''Добавление документа в список, статистика считается воркером в фоне'''
         serializer.save(owner=self.request.user)
-        calculate_statistics(serializer.instance)
+        self.job = enqueue('document_statistics', owner=self.request.user, document_id=str(serializer.instance.id))
     
 
-class DocumentDetailView(generics.RetrieveDestroyAPIView):
+class DocumentBulkUploadView(APIView):
+    '''Пакетная загрузка: много файлов и/или архив, статистика считается одной задачей на всю пачку'''
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(manual_parameters=[
+                             openapi.Parameter('files', openapi.IN_FORM, type=openapi.TYPE_FILE,
+                                               description="Файлы документов, поле можно повторять"),
+                             openapi.Parameter('archive', openapi.IN_FORM, type=openapi.TYPE_FILE,
+                                               description="Архив .zip, .tar, .tar.gz, .tgz, .tar.bz2 или .tar.xz"),
+                             openapi.Parameter('collection', openapi.IN_FORM, type=openapi.TYPE_INTEGER),
+                         ],
+                         operation_description="Загрузить много документов сразу: files и/или архив archive, "
+                         "collection — добавить все документы в коллекцию")
+    def post(self, request):
+        serializer = BulkUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        collection = None
+        if 'collection' in data:
+            collection = get_object_or_404(Collection, id=data['collection'])
+            if collection.owner != request.user:
+                raise PermissionDenied("Вы не владеете данной коллекцией!")
+
+        uploads = iter_uploads(data['files'], data.get('archive'), settings.BULK_UPLOAD_MAX_FILES)
+        try:
+            documents = create_documents(request.user, uploads, collection)
+        except UploadError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not documents:
+            return Response({"detail": "В архиве нет файлов"}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue('bulk_statistics', owner=request.user, document_ids=[str(document.pk) for document in documents])
+        return Response({
+            "documents_created": len(documents),
+            "document_ids": [document.pk for document in documents],
+            "collection": collection.pk if collection else None,
+            "job_id": job.id,
+        }, status=status.HTTP_201_CREATED)
+
+
+class DocumentDetailView(AsyncAPIViewMixin, generics.RetrieveDestroyAPIView):
     '''Просмотр и удаление одного документа'''
     serializer_class = DocumentDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -179,32 +302,99 @@ class DocumentDetailView(generics.RetrieveDestroyAPIView):
         return Document.objects.filter(owner=self.request.user)
 
     @swagger_auto_schema(operation_description="Получить содержимое выбранного документа")
-    def get(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+    async def get(self, request, *args, **kwargs):
+        document = await aget_object_or_404(self.get_queryset(), pk=kwargs['doc_id'])
+        self.check_object_permissions(request, document)
+        # сериализатор читает файл (content) — вне event loop и вне потока БД
+        data = await blocking(lambda: self.get_serializer(document).data)()
+        return Response(data)
 
     @swagger_auto_schema(operation_description="Удалить выбранный документ")
-    def delete(self, request, *args, **kwargs):
-        return self.destroy(request, *args, **kwargs)
+    async def delete(self, request, *args, **kwargs):
+        return await database(self.destroy)(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        delete_document(instance)
     
 class DocumentStatisticsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    @swagger_auto_schema(operation_description="Получить статистику по документу")
+    @swagger_auto_schema(operation_description="Получить статистику по документу. По умолчанию 50 слов "
+                         "с наименьшим tfidf; idf — по текущему составу коллекций документа",
+                         query_serializer=StatisticsQuerySerializer)
     def get(self, request, doc_id):
-        '''Получение статистики документа'''
+        '''Получение статистики документа. Сохраненная при загрузке строка посчитана по корпусу того момента,
+        поэтому при любых k/order/full статистика берется из модели коллекции или сохраненных частот'''
         document = get_object_or_404(Document, id=doc_id, owner=request.user)
-        statistics = Statistics.objects.filter(document=document).first()
-        return Response(statistics.data if statistics else {})
+        query = StatisticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(select_statistics(*document_tfidf(document), **query.validated_data))
 
-########################## Для работы с коллекциями ###############################
+class DocumentSimilarView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Почти-дубликаты документа среди документов пользователя (MinHash/LSH)",
+                         query_serializer=SimilarityQuerySerializer)
+    def get(self, request, doc_id):
+        document = get_object_or_404(Document, id=doc_id, owner=request.user)
+        query = SimilarityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(similar_documents(document, **query.validated_data))
+
+class JobDetailView(generics.RetrieveAPIView):
+    '''Статус фоновой задачи'''
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Job.objects.none()
+        return Job.objects.filter(owner=self.request.user)
 
-from .utils import calculate_collection_statistics
+########################## Для работы с коллекциями ###############################
 
-class CollectionListView(generics.ListCreateAPIView):
+from .utils import collection_statistics, cached_collection_statistics, search_collection, collection_duplicates, score_text, add_document_to_collection, remove_document_from_collection
+
+def collections_queryset(request, expand=()):
+    '''Коллекции пользователя с числом документов одним запросом; документы подгружаются prefetch_related,
+    только если они будут в ответе. Число документов — коррелированный подзапрос, а не JOIN с GROUP BY:
+    так страница читается по индексу (owner, -created_at, -id), а подзапрос считается только для ее строк'''
+    documents_total = (
+        Collection.documents.through.objects.filter(collection=OuterRef('pk'))
+        .order_by().values('collection').annotate(total=Count('*')).values('total')
+    )
+    queryset = Collection.objects.filter(owner=request.user).annotate(
+        documents_total=Coalesce(Subquery(documents_total), 0)
+    )
+    expand = query_list(request, 'expand') | set(expand)
+    if 'content' in expand:
+        # текст коллекции читается из файлов документов — нужны полные строки
+        queryset = queryset.prefetch_related('documents')
+    elif 'documents' in expand:
+        queryset = queryset.prefetch_related(
+            Prefetch('documents', queryset=Document.objects.only('id', 'title', 'size', 'char_count', 'token_count'))
+        )
+    return queryset
+
+class CollectionListView(AsyncAPIViewMixin, generics.ListCreateAPIView):
     serializer_class = CollectionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedCursorPagination
     
     def get_queryset(self):
-        return Collection.objects.filter(owner=self.request.user)
+        return collections_queryset(self.request)
+
+    @swagger_auto_schema(operation_description="Список коллекций: id, имя и число документов. "
+                         "expand=documents — краткие данные документов, expand=content — текст коллекции",
+                         manual_parameters=FIELDS_PARAMETERS)
+    async def get(self, request, *args, **kwargs):
+        # запросы страницы и prefetch документов выполняются сразу, сериализатор к БД уже не обращается
+        page = await database(self.paginate_queryset)(self.filter_queryset(self.get_queryset()))
+        # expand=content читает файлы документов — вне потока БД
+        data = await blocking(lambda: self.get_serializer(page, many=True).data)()
+        return self.get_paginated_response(data)
+
+    async def post(self, request, *args, **kwargs):
+        return await database(self.create)(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -217,7 +407,16 @@ class CollectionDetailView(generics.RetrieveAPIView):
         if getattr(self, 'swagger_fake_view', False):
             return Collection.objects.none()
         
-        return Collection.objects.filter(owner=self.request.user)
+        return collections_queryset(self.request, expand={'documents'})
+
+    def get_serializer_context(self):
+        # в карточке коллекции список документов показывается всегда
+        return {**super().get_serializer_context(), 'expand': {'documents'}}
+
+    @swagger_auto_schema(operation_description="Коллекция с кратким списком документов; expand=content — текст коллекции",
+                         manual_parameters=FIELDS_PARAMETERS)
+    def get(self, request, *args, **kwargs):
+        return self.retrieve(request, *args, **kwargs)
 
 class CollectionStatisticsView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -229,13 +428,60 @@ class CollectionStatisticsView(generics.RetrieveAPIView):
             return Collection.objects.none()
         return Collection.objects.filter(owner=self.request.user)
 
+    @swagger_auto_schema(operation_description="Статистика коллекции. По умолчанию 50 слов с наименьшим tfidf; "
+                         "другие k/order/full пересчитываются по счетчикам коллекции",
+                         query_serializer=StatisticsQuerySerializer)
+    def get(self, request, *args, **kwargs):
+        query = StatisticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        if not query.is_default():
+            collection = get_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+            return Response({'data': cached_collection_statistics(collection, **query.validated_data)})
+        return self.retrieve(request, *args, **kwargs)
+
     @track_processing_time
     def get_object(self):
-        collection = super().get_object()
-        statistics = Statistics.objects.filter(collection=collection).first()
-        if not statistics:
-            statistics = calculate_collection_statistics(collection)
-        return statistics
+        return collection_statistics(super().get_object())
+
+class CollectionSearchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Поиск документов коллекции по косинусной близости TF-IDF к запросу",
+                         query_serializer=SearchQuerySerializer)
+    def get(self, request, pk):
+        collection = get_object_or_404(Collection, id=pk, owner=request.user)
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        terms, results = search_collection(collection, query.validated_data['q'], query.validated_data['limit'])
+        return Response({"query_terms": terms, "results": results})
+
+class CollectionScoreView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(request_body=ScoreTextSerializer, query_serializer=StatisticsQuerySerializer,
+                         operation_description="TF-IDF нового текста по сохраненной модели коллекции "
+                         "(без переобучения) и самые близкие к нему документы коллекции")
+    def post(self, request, pk):
+        collection = get_object_or_404(Collection, id=pk, owner=request.user)
+        body = ScoreTextSerializer(data=request.data)
+        body.is_valid(raise_exception=True)
+        query = StatisticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        vector, similar = score_text(collection, body.validated_data['text'], body.validated_data['limit'])
+        return Response({"data": select_statistics(*vector, **query.validated_data), "similar": similar})
+
+class CollectionDuplicatesView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Отчет о почти-дубликатах в коллекции: пары и группы документов",
+                         manual_parameters=[openapi.Parameter('threshold', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
+                                                              description="Минимальная оценка коэффициента Жаккара")])
+    def get(self, request, pk):
+        collection = get_object_or_404(Collection, id=pk, owner=request.user)
+        query = SimilarityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        duplicates, groups = collection_duplicates(collection, query.validated_data['threshold'])
+        return Response({"threshold": query.validated_data['threshold'], "pairs": duplicates, "groups": groups})
 
 class AddDocumentToCollectionView(APIView):
     def post(self, request, pk, doc_id, *args, **kwargs):
@@ -250,14 +496,11 @@ class AddDocumentToCollectionView(APIView):
             if document.owner != request.user:
                 raise PermissionDenied("Это не ваш документ имейте совесть")
             
-            if collection.documents.filter(id=document.id).exists():
+            if not add_document_to_collection(collection, document):
                 return Response(
                     {"detail": "Документ уже находится в коллекции"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            collection.documents.add(document)
-            calculate_collection_statistics(collection)
 
             return Response(
                 {"detail": "Документ успешно добавлен, поздравляю!"},
@@ -283,8 +526,7 @@ class RemoveDocumentFromCollectionView(APIView):
         collection = get_object_or_404(Collection, id=pk, owner=request.user)
         document = get_object_or_404(Document, id=doc_id, owner=request.user)
 
-        collection.documents.remove(document)
-        calculate_collection_statistics(collection)
+        remove_document_from_collection(collection, document)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -0,0 +1,55 @@
+import gc
+import os
+import resource
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .lazy import load_all
+
+# поля /proc/self/smaps_rollup (Linux), в кБ
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def warm_up():
+    '''Общее состояние только для чтения строится в мастере gunicorn (preload_app) до fork:
+    воркеры получают его общими страницами памяти, а не собирают каждый заново'''
+    start = time.perf_counter()
+    # стоп-слова, регулярные выражения токенизаторов — константы модулей
+    import tf_idf_calculator.functions  # noqa: F401
+    from . import minhash, tokenizers, utils  # noqa: F401
+
+    load_all()
+    minhash.permutations()
+    models = utils.preload_collection_models(settings.PRELOAD_COLLECTION_MODELS)
+
+    # соединение с БД после fork оказалось бы общим у всех воркеров
+    connections.close_all()
+    # объекты мастера уходят в постоянное поколение: сборщик мусора воркеров их не трогает
+    # и не заставляет копировать общие страницы
+    gc.collect()
+    gc.freeze()
+    return {'seconds': round(time.perf_counter() - start, 3), 'collection_models': models}
+
+
+def process_memory():
+    '''Память текущего процесса в МБ: rss, доля общих с другими процессами страниц (shared) и собственных (private)'''
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            values = {}
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in SMAPS_FIELDS:
+                    values[name] = int(rest.split()[0])
+    except (OSError, ValueError):
+        # не Linux: только пиковый RSS
+        return {'pid': os.getpid(), 'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return {
+        'pid': os.getpid(),
+        'rss_mb': round(values.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(values.get('Pss', 0) / 1024, 1),
+        'shared_mb': round((values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0)) / 1024, 1),
+        'private_mb': round((values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)) / 1024, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
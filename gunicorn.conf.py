@@ -0,0 +1,28 @@
+# Настройки gunicorn; файл подхватывается автоматически при запуске из корня проекта
+import os
+import time
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+# приложение загружается в мастере, общее состояние строится один раз (api.warmup) и делится воркерами после fork
+preload_app = os.getenv('GUNICORN_PRELOAD', 'False') == 'True'
+
+_started = time.monotonic()
+
+
+def when_ready(server):
+    from api.warmup import process_memory, warm_up
+
+    if server.cfg.preload_app:
+        server.log.info("Прогрев: %s", warm_up())
+    server.log.info("Мастер готов за %.3f с, память: %s", time.monotonic() - _started, process_memory())
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    from api.warmup import process_memory
+
+    worker.log.info("Воркер готов за %.3f с после fork, память: %s", time.monotonic() - worker.forked_at, process_memory())
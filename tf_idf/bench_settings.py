@@ -0,0 +1,33 @@
+'''Настройки для бенчмарков (manage.py benchmark --settings=tf_idf.bench_settings):
+SQLite и все файлы в отдельном каталоге, задачи выполняются сразу, без воркера'''
+from .settings import *  # noqa: F401,F403
+
+# manage.py benchmark очищает базу и MEDIA_ROOT — без этого флага он не запустится
+BENCHMARK = True
+BENCHMARK_DIR = os.getenv('BENCHMARK_DIR', os.path.join(BASE_DIR, 'cache', 'bench'))
+BENCHMARK_OUTPUT = os.path.join(BENCHMARK_DIR, 'results.json')
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver', 'localhost']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+    }
+}
+
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+METRICS_DIR = os.path.join(BENCHMARK_DIR, 'metrics')
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = os.path.join(BENCHMARK_DIR, 'profiles')
+
+CACHES['tfidf_results']['LOCATION'] = os.path.join(BENCHMARK_DIR, 'tfidf_results')
+CACHES['results'] = {
+    'BACKEND': 'api.cache_backends.AtomicFileBasedCache',
+    'LOCATION': os.path.join(BENCHMARK_DIR, 'results'),
+    'KEY_PREFIX': 'tfidf',
+}
+
+STATS_JOBS_EAGER = True
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -27,9 +27,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    # 'DEFAULT_RENDERER_CLASSES': (
-    #     'rest_framework.renderers.JSONRenderer',
-    # )
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 
 }
 
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.tracing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -141,6 +143,66 @@ STATICFILES_DIRS = [
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Кэши. Результаты веб-калькулятора лежат в файлах, чтобы их видели все воркеры gunicorn;
+# объем ограничен MAX_BYTES (api.cache_backends.SizeBoundedFileBasedCache), MAX_ENTRIES — число кусков по 50 строк
+RESULTS_CACHE_BACKEND = os.getenv('RESULTS_CACHE_BACKEND', 'api.cache_backends.AtomicFileBasedCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tfidf_results': {
+        'BACKEND': 'api.cache_backends.SizeBoundedFileBasedCache',
+        'LOCATION': os.getenv('TFIDF_RESULTS_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'tfidf_results')),
+        'TIMEOUT': int(os.getenv('TFIDF_RESULTS_TTL', '3600')),
+        'OPTIONS': {
+            'MAX_BYTES': int(os.getenv('TFIDF_RESULTS_MAX_BYTES', str(256 * 1024 * 1024))),
+            'MAX_ENTRIES': int(os.getenv('TFIDF_RESULTS_MAX_CHUNKS', '20000')),
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    # Результаты API (Huffman, статистика коллекций), общие для воркеров (api/cache.py). По умолчанию — файлы
+    # на хосте; для нескольких хостов, например,
+    # RESULTS_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache RESULTS_CACHE_LOCATION=memcached:11211
+    'results': {
+        'BACKEND': RESULTS_CACHE_BACKEND,
+        'LOCATION': os.getenv('RESULTS_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'results')),
+        'TIMEOUT': int(os.getenv('RESULTS_CACHE_TTL', '3600')),
+        'KEY_PREFIX': 'tfidf',
+        # OPTIONS файлового кэша; клиенту memcached они не подходят
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('RESULTS_CACHE_MAX_ENTRIES', '10000')),
+            'CULL_FREQUENCY': 4,
+        } if RESULTS_CACHE_BACKEND.endswith('FileBasedCache') else {},
+    },
+}
+
+# Гистограммы времени обработки — файлы, общие для всех воркеров и run_worker
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'cache', 'metrics'))
+
+# Профилирование: доля запросов (0..1), которые снимаются cProfile, и куда класть дампы .prof
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'cache', 'profiles'))
+
+# Прогрев в мастере gunicorn при GUNICORN_PRELOAD=True (gunicorn.conf.py): сколько моделей недавно измененных коллекций открыть до fork
+PRELOAD_COLLECTION_MODELS = int(os.getenv('PRELOAD_COLLECTION_MODELS', '16'))
+
+# LRU-кэш текстов документов в памяти процесса, в байтах
+DOCUMENT_TEXT_CACHE_BYTES = int(os.getenv('DOCUMENT_TEXT_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Очередь фоновых задач (manage.py run_worker)
+STATS_JOBS_EAGER = os.getenv('STATS_JOBS_EAGER', 'False') == 'True'  # выполнять задачи сразу в запросе, без воркера
+STATS_WORKER_CONCURRENCY = int(os.getenv('STATS_WORKER_CONCURRENCY', '2'))
+STATS_WORKER_POLL_INTERVAL = float(os.getenv('STATS_WORKER_POLL_INTERVAL', '1'))
+STATS_JOB_MAX_ATTEMPTS = int(os.getenv('STATS_JOB_MAX_ATTEMPTS', '3'))
+STATS_JOB_RETRY_DELAY = int(os.getenv('STATS_JOB_RETRY_DELAY', '5'))  # сек, удваивается с каждой попыткой
+STATS_JOB_STALE_AFTER = int(os.getenv('STATS_JOB_STALE_AFTER', '600'))
+
+# Пакетная загрузка: максимум файлов в одном запросе (включая содержимое архива)
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '50000'))
+# сколько отдельных файлов Django примет в одном multipart-запросе (большие корпуса — архивом)
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.getenv('DATA_UPLOAD_MAX_NUMBER_FILES', '1000'))
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -1,8 +1,12 @@
 from django.contrib import admin
-from api.models import User, Document, Collection, Statistics
+from api.models import User, Document, DocumentTerms, Collection, CollectionTerm, Posting, Statistics, Term
 # Register your models here.
 
 admin.site.register(User)
 admin.site.register(Document)
+admin.site.register(DocumentTerms)
 admin.site.register(Collection)
-admin.site.register(Statistics)
\ No newline at end of file
+admin.site.register(CollectionTerm)
+admin.site.register(Posting)
+admin.site.register(Statistics)
+admin.site.register(Term)
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hashlib
+
+from django.core.cache import caches
+
+# строки результата хранятся кусками по размеру страницы: листание читает один кусок
+CHUNK_SIZE = 50
+
+
+class ResultsEvicted(Exception):
+    '''Кусок результата вытеснен из кэша раньше меты: результат считается отсутствующим'''
+
+
+def results_cache():
+    return caches['tfidf_results']
+
+
+def files_key(files):
+    '''Ключ результата — sha256 по содержимому загруженных файлов (с учетом порядка)'''
+    digest = hashlib.sha256()
+    for file in files:
+        file_digest = hashlib.sha256()
+        for chunk in file.chunks():
+            file_digest.update(chunk)
+        file.seek(0)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+
+def store_results(key, rows, docs_num):
+    cache = results_cache()
+    chunks = {
+        f"{key}:{i // CHUNK_SIZE}": rows[i:i + CHUNK_SIZE]
+        for i in range(0, len(rows), CHUNK_SIZE)
+    }
+    cache.set_many(chunks)
+    # мета пишется последней: если она есть, куски уже в кэше
+    cache.set(key, {'total': len(rows), 'docs_num': docs_num})
+
+
+def get_results(key):
+    '''CachedResults по ключу или None, если результата нет (истек TTL или вытеснен)'''
+    if not key:
+        return None
+    meta = results_cache().get(key)
+    if meta is None:
+        return None
+    return CachedResults(key, meta['total'], meta['docs_num'])
+
+
+class CachedResults:
+    '''Последовательность строк результата для Paginator: по срезу подгружаются только нужные куски'''
+
+    def __init__(self, key, total, docs_num):
+        self.key = key
+        self.total = total
+        self.docs_num = docs_num
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += self.total
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(self.total)
+        if start >= stop:
+            return []
+        first, last = start // CHUNK_SIZE, (stop - 1) // CHUNK_SIZE
+        keys = [f"{self.key}:{i}" for i in range(first, last + 1)]
+        cache = results_cache()
+        chunks = cache.get_many(keys)
+        if len(chunks) < len(keys):
+            # неполная страница хуже промаха: мета удаляется, результат придется посчитать заново
+            cache.delete(self.key)
+            raise ResultsEvicted(self.key)
+        rows = []
+        for chunk_key in keys:
+            rows.extend(chunks[chunk_key])
+        offset = first * CHUNK_SIZE
+        return rows[start - offset:stop - offset]
@@ -1,6 +1,9 @@
 import re
 import math 
-from collections import Counter
+
+from api.lazy import lazy_import
+from api.tokenizers import count_tokens
+from api.tracing import span
 
 stop_words = [
     "a", "about", "above", "after", "again", "against", "all", "am", "an", "and", "any", "are", "aren't", "as", "at",
@@ -35,82 +38,100 @@ stop_words = [
     "иногда", "лучше", "чуть", "том", "нельзя", "такой", "им", "более", "всегда", "конечно", "всю", "между",
 ]
 
+STOP_WORDS = frozenset(stop_words)
+TOKEN_RE = re.compile(r"\b\w+(?:'\w+)?\b")
+
+np = lazy_import('numpy')
+sparse = lazy_import('scipy.sparse')
+
+
 class TfidfComputer:
     """
     Класс создан для гибкости рассчетов и во избежании каши в views.py))
 
+    Документы один раз переводятся в разреженную матрицу документ-слово (счетчики без стоп-слов),
+    дальше TF, IDF и TF-IDF считаются операциями над массивами.
     """
 
     def __init__(self, files):
         documents = files
-        self.whole_texts = self.all_docs_text_joiner(documents)
-        self.docs = self.clean_and_tokenize(self.whole_texts)
-        self.N = len(self.docs)
-        self.results = self.tf_idf_counter()
-        self.idf = self.all_idf_counter()
+        with span('calc.tokenize'):
+            self.doc_counts = self.count_documents(documents)
+        self.N = len(self.doc_counts)
+        with span('calc.matrix'):
+            self.vocabulary, self.matrix = self.build_matrix(self.doc_counts)
+        with span('calc.idf'):
+            self.idf = self.all_idf_counter()
+        with span('calc.tfidf'):
+            self.results = self.tf_idf_counter()
+
+
+    def count_documents(self, documents):
+        '''Частоты слов каждого файла без стоп-слов. Файлы читаются потоком,
+        целиком текст и список токенов в памяти не держатся'''
+        all_docs_counts = []
 
+        for file in documents:
+            word_count, _ = count_tokens(file, pattern=TOKEN_RE)
+            all_docs_counts.append(self.stop_word_filter(word_count))
 
-    def all_docs_text_joiner(self, documents):
-        whole_text = []
+        return all_docs_counts
 
-        for file in documents:
-            text = file.read().decode("utf-8")
-            whole_text.append(text)
-            
-        return whole_text
 
+    def build_matrix(self, docs_counts):
+        '''Счетчики слов в CSR-матрице N x V.
+        Внутри строки слова идут в порядке первого появления в документе'''
+        vocabulary = {}
+        indptr, indices, data = [0], [], []
+        for word_count in docs_counts:
+            for word, count in word_count.items():
+                indices.append(vocabulary.setdefault(word, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
 
-    def clean_and_tokenize(self, texts):
-        all_docs_tokens = []
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+            shape=(len(docs_counts), len(vocabulary))
+        )
+        return list(vocabulary), matrix
 
-        for text in texts:
-            text_lower = text.lower()
-            words = re.findall(r"\b\w+(?:'\w+)?\b", text_lower)
-            all_docs_tokens.append(words)
 
-        return all_docs_tokens
+    def document_frequencies(self):
+        return np.bincount(self.matrix.indices, minlength=len(self.vocabulary))
 
 
     def all_idf_counter(self):
-        idf = {}
-        unique_words = set()
-        filtered_doc = self.stop_word_filter(self.docs)
-        for doc in filtered_doc:
-            for word in doc:
-                unique_words.add(word)
-        
-        for word in unique_words:
-            doc_count = 0
-            for doc in self.docs:
-                if word in doc:
-                    doc_count += 1
-            idf[word] = math.log((1 + self.N) / (1 + doc_count))
-        return idf
-
-    def stop_word_filter(self, document):
-        filtered = [word for word in document if word not in stop_words]
+        # df принимает только значения 0..N, поэтому логарифм считается math.log
+        # по таблице — числа в точности совпадают с прежним поэлементным расчетом
+        idf_table = np.array([math.log((1 + self.N) / (1 + df)) for df in range(self.N + 1)])
+        idf_values = idf_table[self.document_frequencies()]
+        return dict(zip(self.vocabulary, idf_values.tolist()))
+
+    def stop_word_filter(self, word_count):
+        filtered = {word: count for word, count in word_count.items() if word not in STOP_WORDS}
         return filtered
     
     def tf_idf_counter(self):
         results = []
-        idf = self.all_idf_counter()
-        for doc_index in range(self.N):
-            doc = self.docs[doc_index]
-            filtered_doc = self.stop_word_filter(doc)
-            total_words = len(filtered_doc)
-            word_count = Counter(filtered_doc)
-            unique_words = word_count.keys()
-
-            for word in unique_words:
-                tf = word_count[word] / total_words
-                word_idf = idf.get(word, 0)
-                tfidf = tf * word_idf
-
-                results.append({
-                    'doc': doc_index + 1,
-                    'word': word,
-                    'tf': round(tf, 3),
-                    'idf': round(word_idf, 3),
-                    'tfidf': round(tfidf, 3)
-                })
-        return results
\ No newline at end of file
+        matrix = self.matrix
+        idf_values = np.fromiter(self.idf.values(), dtype=np.float64, count=len(self.idf))
+
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        row_of_entry = np.repeat(np.arange(self.N), np.diff(matrix.indptr))
+        tf_values = matrix.data / totals[row_of_entry]
+        entry_idf = idf_values[matrix.indices]
+        tfidf_values = tf_values * entry_idf
+
+        vocabulary = self.vocabulary
+        for row, col, tf, word_idf, tfidf in zip(
+            row_of_entry.tolist(), matrix.indices.tolist(),
+            tf_values.tolist(), entry_idf.tolist(), tfidf_values.tolist()
+        ):
+            results.append({
+                'doc': row + 1,
+                'word': vocabulary[col],
+                'tf': round(tf, 3),
+                'idf': round(word_idf, 3),
+                'tfidf': round(tfidf, 3)
+            })
+        return results
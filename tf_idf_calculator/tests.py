@@ -1,3 +1,137 @@
-from django.test import TestCase
+import io
+import math
+import os
+import re
+from collections import Counter
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from api.cache_backends import SizeBoundedFileBasedCache
+from .functions import STOP_WORDS, TfidfComputer
+from .cache import CHUNK_SIZE, ResultsEvicted, get_results, results_cache, store_results
+
+# Запуск без Postgres: python manage.py test tf_idf_calculator --settings=tf_idf.bench_settings
+
+
+class ResultsCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'tfidf_results': {
+                'BACKEND': 'api.cache_backends.SizeBoundedFileBasedCache',
+                'LOCATION': cls.tmpdir,
+            },
+        })
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        results_cache().clear()
+
+    def rows(self, count):
+        return [{'doc': 1, 'word': f'w{i}', 'tf': 0.1, 'idf': 0.2, 'tfidf': 0.02} for i in range(count)]
+
+    def test_pages_from_chunks(self):
+        rows = self.rows(CHUNK_SIZE * 2 + 7)
+        store_results('key', rows, 3)
+        results = get_results('key')
+        self.assertEqual(len(results), len(rows))
+        self.assertEqual(results.docs_num, 3)
+        self.assertEqual(results[CHUNK_SIZE - 5:CHUNK_SIZE + 5], rows[CHUNK_SIZE - 5:CHUNK_SIZE + 5])
+        self.assertEqual(results[-1], rows[-1])
+
+    def test_evicted_chunk_is_a_miss(self):
+        store_results('key', self.rows(CHUNK_SIZE * 3), 1)
+        results_cache().delete('key:1')
+        results = get_results('key')
+        self.assertEqual(results[:CHUNK_SIZE], self.rows(CHUNK_SIZE))
+        with self.assertRaises(ResultsEvicted):
+            results[CHUNK_SIZE:CHUNK_SIZE * 2]
+        self.assertIsNone(get_results('key'))
+
+    def test_evicted_chunk_in_view(self):
+        files = [SimpleUploadedFile('a.txt', b'apple banana apple'), SimpleUploadedFile('b.txt', b'kiwi apple')]
+        response = self.client.post(reverse('upload_file'), {'file': files})
+        self.assertEqual(response.status_code, 302)
+        key = self.client.session['results_key']
+        self.assertEqual(len(self.client.get(reverse('upload_file')).context['words']), 4)
+
+        results_cache().delete(f'{key}:0')
+        response = self.client.get(reverse('upload_file'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['expired'])
+        self.assertIsNone(response.context['words'])
+        self.assertNotIn('results_key', self.client.session)
+
+    def test_stop_words_only_upload_keeps_document_count(self):
+        files = [SimpleUploadedFile('a.txt', b'the and of'), SimpleUploadedFile('b.txt', b'is it the')]
+        self.assertEqual(self.client.post(reverse('upload_file'), {'file': files}).status_code, 302)
+        response = self.client.get(reverse('upload_file'))
+        self.assertEqual(response.context['docs'], 2)
+        self.assertEqual(response.context['total_words'], 0)
+        self.assertContains(response, 'Количество загруженных документов: 2')
+
+
+class SizeBoundedFileBasedCacheTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def cache_size(self):
+        return sum(os.path.getsize(os.path.join(self.tmpdir, name)) for name in os.listdir(self.tmpdir))
+
+    def test_bounded_by_bytes(self):
+        cache = SizeBoundedFileBasedCache(self.tmpdir, {'OPTIONS': {'MAX_BYTES': 64 * 1024, 'MAX_ENTRIES': 10000}})
+        cache.SCAN_INTERVAL = 0
+        for i in range(40):
+            cache.set(f'big{i}', os.urandom(8 * 1024))
+        # предел проверяется перед записью: сверху может лечь еще одна запись (случайные байты не сжимаются)
+        self.assertLessEqual(self.cache_size(), 64 * 1024 + 9 * 1024)
+        self.assertTrue(cache.has_key('big39'))
+        self.assertLess(sum(cache.has_key(f'big{i}') for i in range(40)), 10)
+
+    def test_unbounded_without_max_bytes(self):
+        cache = SizeBoundedFileBasedCache(self.tmpdir, {'OPTIONS': {'MAX_ENTRIES': 10000}})
+        for i in range(20):
+            cache.set(f'big{i}', os.urandom(8 * 1024))
+        self.assertEqual(len(os.listdir(self.tmpdir)), 20)
+
+
+class TfidfComputerTests(TestCase):
+    TEXTS = [
+        "The cat sat on the mat. The cat's hat!",
+        'Кошка сидит на коврике, cat и hat',
+        'mat mat mat dog',
+    ]
+
+    def reference(self, texts):
+        '''Прямой расчет по словам, как до перехода на разреженную матрицу'''
+        docs = [[word for word in re.findall(r"\b\w+(?:'\w+)?\b", text.lower()) if word not in STOP_WORDS]
+                for text in texts]
+        results = []
+        for index, doc in enumerate(docs, 1):
+            for word, count in Counter(doc).items():
+                tf = count / len(doc)
+                idf = math.log((1 + len(docs)) / (1 + sum(word in other for other in docs)))
+                results.append({'doc': index, 'word': word, 'tf': round(tf, 3), 'idf': round(idf, 3),
+                                'tfidf': round(tf * idf, 3)})
+        return results
+
+    def test_matches_word_by_word_calculation(self):
+        files = [io.BytesIO(text.encode('utf-8')) for text in self.TEXTS]
+        computer = TfidfComputer(files)
+        self.assertEqual(computer.results, self.reference(self.TEXTS))
+        self.assertEqual(computer.N, 3)
+        self.assertAlmostEqual(computer.idf['mat'], math.log(4 / 3))
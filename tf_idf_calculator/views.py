@@ -3,6 +3,8 @@ from django.shortcuts import render, redirect
 # Create your views here.
 from .forms import UploadFileForm
 from .functions import TfidfComputer
+from .cache import ResultsEvicted, files_key, get_results, store_results
+from api.tracing import span
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 def upload_file(request):
@@ -14,31 +16,46 @@ def upload_file(request):
         
         if form.is_valid():  
             files = request.FILES.getlist("file")
-            tfidf = TfidfComputer(files)
-            tfidf_list = tfidf.results
-            request.session['txt_data'] = sorted(
-                tfidf_list, 
-                key=lambda x: x["idf"], 
-                reverse=True
-            )
-            request.session["docs_num"] = len(list(files))
+            # в сессии только ключ, сами строки лежат в серверном кэше
+            key = files_key(files)
+            if get_results(key) is None:
+                tfidf = TfidfComputer(files)
+                tfidf_list = tfidf.results
+                with span('calc.sort'):
+                    rows = sorted(
+                        tfidf_list, 
+                        key=lambda x: x["idf"], 
+                        reverse=True
+                    )
+                with span('calc.cache'):
+                    store_results(key, rows, len(files))
+            request.session['results_key'] = key
             request.session.modified = True
             return redirect('upload_file')
 
-    session_data = request.session.get('txt_data', [])
-    docs_number = request.session.get('docs_num')
-    words_total = len(session_data)
-    paginator = Paginator(session_data, 50)
+    results = get_results(request.session.get('results_key'))
+    if results is None:
+        # пустой результат (в файлах одни стоп-слова) — тоже результат: число документов в нем есть
+        results = []
+    docs_number = getattr(results, 'docs_num', None)
+    words_total = len(results)
+    paginator = Paginator(results, 50)
     page_number = request.GET.get('page')
     
     try:
-        words = paginator.page(page_number)
-    except PageNotAnInteger:
-        words = paginator.page(1)
-    except EmptyPage:
-        words = paginator.page(paginator.num_pages)
+        try:
+            words = paginator.page(page_number)
+        except PageNotAnInteger:
+            words = paginator.page(1)
+        except EmptyPage:
+            words = paginator.page(paginator.num_pages)
+    except ResultsEvicted:
+        # файлы не хранятся — пересчитать нечем, пользователь загружает их заново
+        request.session.pop('results_key', None)
+        context["expired"] = True
+        words, docs_number, words_total = None, None, 0
     
     context["words"] = words
     context["docs"] = docs_number
     context["total_words"] = words_total
-    return render(request, "tf_idf_calculator/upload.html", context)
\ No newline at end of file
+    return render(request, "tf_idf_calculator/upload.html", context)